@@ -0,0 +1,103 @@
+"""
+Login storm: bcrypt inline on the event loop vs on the password pool.
+
+Run from ``backend/``::
+
+    uv run python benchmarks/bench_login_storm.py
+    uv run python benchmarks/bench_login_storm.py --logins 400 --concurrency 100 --workers 4 --max-queue 32
+
+``--concurrency`` clients log in back to back (``--logins`` in total; a 503 counts as a
+shed attempt and the client moves on). Meanwhile a chat ticker stands in for socket traffic
+on the same loop: every ``--tick-ms`` it "handles a message" and records how late it ran,
+which is the latency every WebSocket on the worker sees. Reported per mode: completed
+logins/s, shed logins, and chat latency p50 / p99 / max, plus the pool's queue wait.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import bcrypt
+
+from fast_room_api.api.dependencies import verify_password
+from fast_room_api.api.password_pool import PasswordPool, PasswordPoolBusy
+
+
+async def _chat_ticker(tick_ms: float, stop: asyncio.Event, lags: list[float]) -> None:
+    interval = tick_ms / 1000
+    while not stop.is_set():
+        due = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - due) * 1000)
+
+
+async def _storm(check, logins: int, concurrency: int) -> tuple[int, int]:
+    remaining = logins
+    done = shed = 0
+
+    async def client() -> None:
+        nonlocal remaining, done, shed
+        while remaining > 0:
+            remaining -= 1
+            try:
+                await check()
+                done += 1
+            except PasswordPoolBusy:
+                shed += 1
+                await asyncio.sleep(0.001)  # what a client honouring Retry-After would spread out further
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return done, shed
+
+
+async def _run(name: str, check, args) -> None:
+    stop = asyncio.Event()
+    lags: list[float] = []
+    ticker = asyncio.create_task(_chat_ticker(args.tick_ms, stop, lags))
+    start = time.perf_counter()
+    done, shed = await _storm(check, args.logins, args.concurrency)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    print(
+        f"  {name:<8} {done / elapsed:>7.1f} logins/s  shed={shed:<4}"
+        f" chat latency p50={statistics.median(lags):7.2f} p99={p99:7.2f} max={lags[-1]:7.2f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor of the stored hash")
+    parser.add_argument("--tick-ms", type=float, default=5)
+    args = parser.parse_args()
+    hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(args.rounds)).decode()
+    print(f"{args.logins} logins, {args.concurrency} concurrent clients, bcrypt rounds={args.rounds}")
+
+    async def inline() -> None:
+        verify_password("correct horse", hashed)
+
+    pool = PasswordPool(args.workers, args.max_queue)
+
+    async def pooled() -> None:
+        await pool.run(verify_password, "correct horse", hashed)
+
+    await _run("inline", inline, args)
+    await _run("pool", pooled, args)
+    stats = pool.as_dict()
+    print(
+        f"  pool: workers={args.workers} max_queue={args.max_queue}"
+        f" queue wait avg={stats['avg_queue_wait_ms']} max={stats['queue_wait_ms_max']:.1f} ms"
+        f" bcrypt avg={stats['avg_run_ms']} ms"
+    )
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Join/leave throughput with per-room pub/sub channels vs hash-bucketed channels.
+
+Run from ``backend/``::
+
+    uv run python benchmarks/bench_pubsub_buckets.py --redis-url redis://localhost:6379/0
+    uv run python benchmarks/bench_pubsub_buckets.py --simulate-rtt-ms 0.3   # no Redis required
+
+Every join is the first local join of its room and every leave the last one, which is
+the worst case for per-room mode (SUBSCRIBE/UNSUBSCRIBE round trip under the manager lock).
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from redis.asyncio import Redis
+
+from fast_room_api.api.fanout import PubSubFanout
+from fast_room_api.api.routers.ws import SERVER_ID, ConnectionManager
+
+
+class _SimPubSub:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.channels: set[str] = set()
+
+    async def subscribe(self, *channels: str) -> None:
+        await asyncio.sleep(self.rtt)
+        self.channels.update(channels)
+
+    async def unsubscribe(self, *channels: str) -> None:
+        await asyncio.sleep(self.rtt)
+        self.channels.difference_update(channels)
+
+    async def listen(self):
+        while True:
+            await asyncio.sleep(3600)
+            yield {}
+
+
+class _SimRedis:
+    """Just enough of redis.asyncio.Redis for join/leave, with a fixed round-trip time per command."""
+
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self._pubsub = _SimPubSub(rtt)
+
+    def pubsub(self) -> _SimPubSub:
+        return self._pubsub
+
+    def register_script(self, _script: str):
+        async def run(keys: Any = None, args: Any = None, client: Any = None) -> int:
+            await asyncio.sleep(self.rtt)
+            return 1
+
+        return run
+
+
+class _NullWS:
+    async def send_text(self, data: str) -> None:
+        return None
+
+
+async def _run(redis: Any, buckets: int, rooms: int, rounds: int) -> tuple[float, int]:
+    manager = ConnectionManager(redis)
+    fanout = manager.fanout = PubSubFanout(redis, SERVER_ID, manager._deliver, manager._active, buckets=buckets)
+    sockets = [_NullWS() for _ in range(rooms)]
+    peak = 0
+    start = time.perf_counter()
+    for r in range(rounds):
+        names = [f"bench:{r}:{i}" for i in range(rooms)]
+        await asyncio.gather(*(manager.join(n, ws, f"u{i}") for i, (n, ws) in enumerate(zip(names, sockets))))  # type: ignore[arg-type]
+        peak = max(peak, len(fanout.room_subscribed) if not buckets else buckets)
+        await asyncio.gather(*(manager.leave(n, ws) for n, ws in zip(names, sockets)))  # type: ignore[arg-type]
+    elapsed = time.perf_counter() - start
+    await fanout.close()
+    await manager.heartbeats.stop()
+    return (2 * rooms * rounds) / elapsed, peak
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default=None)
+    parser.add_argument("--simulate-rtt-ms", type=float, default=0.3)
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--buckets", type=int, default=256)
+    args = parser.parse_args()
+    redis: Any = Redis.from_url(args.redis_url, decode_responses=True) if args.redis_url else None
+    for label, buckets in (("per-room", 0), (f"buckets={args.buckets}", args.buckets)):
+        client = redis or _SimRedis(args.simulate_rtt_ms / 1000)
+        ops, peak = await _run(client, buckets, args.rooms, args.rounds)
+        print(f"{label:<14} {ops:10.0f} join+leave ops/s   peak subscriptions={peak}")
+    if redis:
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Micro-benchmark: previous stdlib JSON fanout path vs the orjson encode-once path.
+
+Run from ``backend/``::
+
+    uv run python benchmarks/bench_serialization.py [--peers 5000] [--rounds 20]
+
+"previous" reproduces what a chat broadcast used to cost: ``model_dump(mode="json")``,
+``jsonable_encoder`` + ``json.dumps`` for the Redis publish, and one ``json.dumps`` per
+peer inside ``send_json``. "orjson" is ``model_dump()`` + one ``serialization.dumps``.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from collections.abc import Callable
+
+from fastapi.encoders import jsonable_encoder
+
+from fast_room_api import serialization
+from fast_room_api.models.ws import OutChatMessage, OutPresenceDiff, OutTypingMessage
+
+
+def _payloads() -> list:
+    return [
+        OutChatMessage(room="general", user="alice", message="hello world " * 8, message_id=123456),
+        OutTypingMessage(room="general", user="bob", isTyping=True),
+        OutPresenceDiff(room="general", join=["carol"]),
+    ]
+
+
+def previous_path(model, peers: int) -> None:
+    payload = model.model_dump(mode="json")
+    payload.setdefault("srv", "abc123")
+    json.dumps(jsonable_encoder(payload))  # redis publish
+    for _ in range(peers):  # starlette send_json per peer
+        json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+
+
+def orjson_path(model, peers: int) -> None:
+    payload = model.model_dump()
+    payload.setdefault("srv", "abc123")
+    data = serialization.dumps(payload)  # redis publish + every peer
+    data.decode()
+
+
+def _bench(fn: Callable, peers: int, rounds: int) -> list[float]:
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for model in _payloads():
+            fn(model, peers)
+        samples.append((time.perf_counter() - start) / 3)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--peers", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    for peers in (1, args.peers):
+        print(f"peers={peers}")
+        for name, fn in (("previous", previous_path), ("orjson", orjson_path)):
+            samples = _bench(fn, peers, args.rounds)
+            print(f"  {name:<9} median={statistics.median(samples) * 1e6:10.1f} us/broadcast")
+
+
+if __name__ == "__main__":
+    main()
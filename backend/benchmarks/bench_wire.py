@@ -0,0 +1,90 @@
+"""
+Wire format comparison: JSON text frames vs MessagePack envelopes.
+
+Run from ``backend/`` (needs the ``msgpack`` extra)::
+
+    uv run --extra msgpack python benchmarks/bench_wire.py [--events 20000] [--seed 1]
+
+The event mix approximates a busy room: mostly chat, then typing transitions, presence
+diffs/states, system lines and occasional history pages. For each format it reports
+bytes on the wire and encode/decode time per event (encode once, as fanout does).
+"""
+
+import argparse
+import random
+import time
+from typing import Any
+
+from fast_room_api import serialization
+from fast_room_api.api import wire
+from fast_room_api.models.ws import (
+    OutChatMessage,
+    OutPresenceDiff,
+    OutPresenceState,
+    OutSystemMessage,
+    OutTypingMessage,
+)
+
+WORDS = "hey so about that deploy lgtm ship it tomorrow maybe lunch ok thanks sounds good".split()
+
+
+def _event(rng: random.Random, i: int) -> dict[str, Any]:
+    room = f"room-{rng.randrange(20)}"
+    user = f"user{rng.randrange(500)}"
+    roll = rng.random()
+    if roll < 0.55:
+        text = " ".join(rng.choices(WORDS, k=rng.randint(2, 30)))
+        return OutChatMessage(room=room, user=user, message=text, message_id=i).model_dump()
+    if roll < 0.80:
+        return OutTypingMessage(room=room, user=user, isTyping=rng.random() < 0.5).model_dump()
+    if roll < 0.90:
+        return OutPresenceDiff(room=room, join=[user]).model_dump()
+    if roll < 0.95:
+        users = [f"user{n}" for n in rng.sample(range(500), rng.randint(5, 80))]
+        return OutPresenceState(room=room, users=users).model_dump()
+    if roll < 0.98:
+        return OutSystemMessage(room=room, message=f"{user} joined").model_dump()
+    messages = [
+        OutChatMessage(room=room, user=user, message=" ".join(rng.choices(WORDS, k=12)), message_id=n).model_dump()
+        for n in range(50)
+    ]
+    return {"type": "history", "room": room, "messages": messages}
+
+
+def _measure(events: list[dict[str, Any]], encode, decode) -> tuple[int, float, float]:
+    start = time.perf_counter()
+    encoded = [encode(e) for e in events]
+    encode_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decode_s = time.perf_counter() - start
+    return sum(len(d) for d in encoded), encode_s, decode_s
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not serialization.msgpack_available():
+        raise SystemExit("msgpack is not installed (uv sync --extra msgpack)")
+    rng = random.Random(args.seed)
+    events = [_event(rng, i) for i in range(args.events)]
+    formats = (
+        ("json", serialization.dumps, serialization.loads),
+        ("msgpack", wire.encode_envelope, wire.decode_envelope),
+    )
+    print(f"{args.events} events")
+    baseline = None
+    for name, encode, decode in formats:
+        size, enc, dec = _measure(events, encode, decode)
+        baseline = baseline or size
+        print(
+            f"  {name:<8} bytes={size:>10} ({size / baseline:6.1%})"
+            f"  encode={enc / len(events) * 1e6:6.2f} us/event  decode={dec / len(events) * 1e6:6.2f} us/event"
+        )
+
+
+if __name__ == "__main__":
+    main()
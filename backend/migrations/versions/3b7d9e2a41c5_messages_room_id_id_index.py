@@ -0,0 +1,32 @@
+"""messages (room_id, id) index for keyset pagination
+
+Revision ID: 3b7d9e2a41c5
+Revises: fe9b65378cc0
+Create Date: 2026-10-17 10:12:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7d9e2a41c5'
+down_revision = 'fe9b65378cc0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so a large messages table stays writable; the composite index
+    # covers every room_id lookup, so the single-column one is dropped afterwards.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_messages_room_id_id', 'messages', ['room_id', 'id'], unique=False, postgresql_concurrently=True
+        )
+        op.drop_index(op.f('ix_messages_room_id'), table_name='messages', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_messages_room_id'), 'messages', ['room_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_messages_room_id_id', table_name='messages', postgresql_concurrently=True)
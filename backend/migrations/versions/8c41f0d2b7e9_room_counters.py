@@ -0,0 +1,37 @@
+"""room member/message counters
+
+Revision ID: 8c41f0d2b7e9
+Revises: 3b7d9e2a41c5
+Create Date: 2026-10-17 14:03:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41f0d2b7e9'
+down_revision = '3b7d9e2a41c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('rooms', sa.Column('member_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('rooms', sa.Column('message_count', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('rooms', sa.Column('last_message_at', sa.DateTime(timezone=True), nullable=True))
+    # Backfill; writes landing between this and the app rollout are fixed by the reconcile job
+    op.execute(
+        """
+        UPDATE rooms SET
+            member_count = (SELECT count(*) FROM room_members WHERE room_members.room_id = rooms.id),
+            message_count = (SELECT count(*) FROM messages WHERE messages.room_id = rooms.id),
+            last_message_at = (SELECT max(created_at) FROM messages WHERE messages.room_id = rooms.id)
+        """
+    )
+
+
+def downgrade():
+    op.drop_column('rooms', 'last_message_at')
+    op.drop_column('rooms', 'message_count')
+    op.drop_column('rooms', 'member_count')
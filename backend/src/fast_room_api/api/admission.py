@@ -0,0 +1,102 @@
+"""
+Admission control for ``/ws``: caps on sockets per worker, sockets per user and rooms per socket.
+
+A reconnect storm (a deploy, a network blip) brings every client back at once, and each
+accepted socket costs an outbox, a writer task, presence entries and history frames. The
+endpoint takes a worker slot before doing anything else and a user slot once the token is
+verified, both before the handshake is accepted. Past a cap the socket is closed right
+after the handshake with an ``error`` frame carrying ``retryAfter`` (seconds) and a close
+code: ``1013`` (Try Again Later) when the worker is full, ``4429`` when the user already
+has too many sockets here. The hint is jittered up to twice ``WS_RETRY_AFTER_S`` so
+rejected clients don't all come back in the same second. A join past the room cap gets
+an ``error`` frame and the socket stays open.
+
+All counts are per worker process, so a user's cap applies to each worker on its own.
+A cap of 0 disables it.
+"""
+
+from __future__ import annotations
+
+import random
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from fast_room_api.models.config import settings
+
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_TOO_MANY_CONNECTIONS = 4429
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    rejected_worker: int = 0
+    rejected_user: int = 0
+    rejected_rooms: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class Admission:
+    def __init__(self, max_sockets: int, max_per_user: int, max_rooms: int, retry_after_s: int):
+        self.max_sockets = max_sockets
+        self.max_per_user = max_per_user
+        self.max_rooms = max_rooms
+        self.retry_after_s = retry_after_s
+        self.sockets = 0  # handshakes in progress included
+        self.per_user: Counter[str] = Counter()
+        self.stats = AdmissionStats()
+
+    def open(self) -> bool:
+        """Take a worker slot; False (nothing taken) if the worker is full."""
+        if self.max_sockets and self.sockets >= self.max_sockets:
+            self.stats.rejected_worker += 1
+            return False
+        self.sockets += 1
+        return True
+
+    def add_user(self, username: str) -> bool:
+        """Take a slot for ``username``; False (nothing taken) if it has ``max_per_user`` sockets already."""
+        if self.max_per_user and self.per_user[username] >= self.max_per_user:
+            self.stats.rejected_user += 1
+            return False
+        self.per_user[username] += 1
+        self.stats.admitted += 1
+        return True
+
+    def close(self, username: str | None = None) -> None:
+        """Give back the worker slot, and the user slot if one was taken."""
+        self.sockets -= 1
+        if username is not None:
+            self.per_user[username] -= 1
+            if self.per_user[username] <= 0:
+                del self.per_user[username]
+
+    def can_join(self, joined: int) -> bool:
+        if self.max_rooms and joined >= self.max_rooms:
+            self.stats.rejected_rooms += 1
+            return False
+        return True
+
+    def retry_after(self) -> int:
+        return self.retry_after_s + random.randint(0, self.retry_after_s)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "max_sockets": self.max_sockets,
+            "max_per_user": self.max_per_user,
+            "max_rooms": self.max_rooms,
+            "sockets": self.sockets,
+            "users": len(self.per_user),
+            **self.stats.as_dict(),
+        }
+
+
+admission = Admission(
+    settings.ws_max_sockets,
+    settings.ws_max_sockets_per_user,
+    settings.ws_max_rooms_per_socket,
+    settings.ws_retry_after_s,
+)
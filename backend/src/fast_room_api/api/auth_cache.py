@@ -0,0 +1,81 @@
+"""
+Verified access tokens and their users, cached in-process for ``get_current_user``.
+
+Clients call several endpoints per page load with the same bearer token, and each call used
+to verify the JWT (header parse, HMAC, payload validation) and load the user by name. Tokens
+are cached by their SHA-256, holding the validated payload until the token's own ``exp``, so
+a cached token can never outlive its validity. Users are cached by username as detached
+snapshots (column values only, no relationships) for ``USER_CACHE_TTL_MS``. A flush that
+changes a user (disabling it, say) or deletes it drops the entry in this process; the TTL
+bounds how long other processes keep serving the old state.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Any
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from fast_room_api.cache import TTLCache
+from fast_room_api.models.auth import TokenPayload
+from fast_room_api.models.config import settings
+from fast_room_api.models.db import UserORM
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class AuthCache:
+    def __init__(self, token_maxsize: int, user_maxsize: int, user_ttl_ms: int):
+        # Token entries get a per-entry TTL (until exp); the default only has to be non-zero
+        self.tokens = TTLCache(token_maxsize, ttl=1.0)
+        self.users = TTLCache(user_maxsize, ttl=user_ttl_ms / 1000)
+
+    def get_token(self, token: str) -> TokenPayload | None:
+        return self.tokens.get(_token_key(token))
+
+    def set_token(self, token: str, payload: TokenPayload) -> None:
+        remaining = payload.exp - time.time()
+        if remaining > 0:
+            self.tokens.set(_token_key(token), payload, ttl=remaining)
+
+    def get_user(self, username: str) -> UserORM | None:
+        return self.users.get(username)
+
+    def set_user(self, user: UserORM) -> None:
+        if self.users.enabled:
+            self.users.set(user.username, _detached_copy(user))
+
+    def invalidate_user(self, username: str) -> None:
+        self.users.pop(username)
+
+    def clear(self) -> None:
+        self.tokens.clear()
+        self.users.clear()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {"tokens": self.tokens.stats(), "users": self.users.stats()}
+
+
+def _detached_copy(user: UserORM) -> UserORM:
+    # Shared across requests, so it must not belong to (or be expired by) any request's session
+    columns = {attr.key: getattr(user, attr.key) for attr in inspect(UserORM).column_attrs}
+    copy = UserORM(**columns)
+    make_transient_to_detached(copy)
+    return copy
+
+
+auth_cache = AuthCache(settings.token_cache_size, settings.user_cache_size, settings.user_cache_ttl_ms)
+
+
+@event.listens_for(Session, "after_flush")
+def _drop_changed_users(session: Session, _flush_context: Any) -> None:
+    # Any flushed change (disabled, renamed, deleted, ...) evicts the user under its old and new name
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, UserORM):
+            for name in (obj.username, *inspect(obj).attrs.username.history.deleted):
+                auth_cache.invalidate_user(name)
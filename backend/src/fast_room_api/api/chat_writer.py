@@ -0,0 +1,200 @@
+"""
+Write-behind chat persistence with group commit.
+
+The WebSocket ``chat`` branch hands each validated message to :class:`ChatWriter` and goes
+back to reading its socket. A single writer task per process collects pending messages and
+inserts them with one multi-row ``INSERT ... RETURNING`` per batch, committing once. A batch
+is flushed as soon as it holds ``batch_size`` messages or ``flush_ms`` after its first
+message, whichever comes first; messages arriving while a batch is being written form the
+next one. Only once the commit succeeded is each message handed to ``on_saved`` (which
+fans it out, in submission order) with the id the database assigned. One row the database
+refuses (a deleted room, text it won't store) fails the whole statement, so such a batch
+is retried in halves until the offending messages are isolated. Only those go to
+``on_failed``: nothing is shown that wasn't stored, and one sender's bad message doesn't
+cost the rest of the batch theirs. If the database is down, the whole batch fails.
+The same transaction bumps each room's ``message_count`` / ``last_message_at`` once per batch.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from fast_room_api.api import room_counters
+from fast_room_api.models.db import MessageORM
+
+logger = logging.getLogger("fast_room_api.chat_writer")
+
+
+@dataclass
+class PendingMessage:
+    room: str
+    room_id: int
+    user_id: int
+    username: str
+    content: str
+    origin: Any = None  # the sender's socket, told if the write fails
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class ChatWriterStats:
+    batches: int = 0
+    messages: int = 0
+    failed: int = 0
+    splits: int = 0  # failed batches retried in halves
+    rejected: int = 0  # submit() refused because max_pending messages were already waiting
+    max_batch: int = 0
+    latency_ms_total: float = 0.0  # submit -> commit, summed over saved messages
+    latency_ms_max: float = 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "avg_batch": round(self.messages / self.batches, 2) if self.batches else None,
+            "avg_latency_ms": round(self.latency_ms_total / self.messages, 3) if self.messages else None,
+        }
+
+
+Saved = Callable[[PendingMessage, int, datetime], Awaitable[None]]
+Failed = Callable[[PendingMessage], Awaitable[None]]
+
+
+class ChatWriter:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker[AsyncSession],
+        on_saved: Saved,
+        on_failed: Failed,
+        batch_size: int = 100,
+        flush_ms: int = 5,
+        max_pending: int = 10_000,
+    ):
+        self.session_factory = session_factory
+        self.on_saved = on_saved
+        self.on_failed = on_failed
+        self.batch_size = max(1, batch_size)
+        self.flush_ms = flush_ms
+        self.max_pending = max_pending
+        self.pending: list[PendingMessage] = []
+        self.wake = asyncio.Event()  # something is pending
+        self.full = asyncio.Event()  # a whole batch is pending: don't wait out flush_ms
+        self.task: asyncio.Task | None = None
+        self.closing = False
+        self.stats = ChatWriterStats()
+
+    def submit(self, msg: PendingMessage) -> bool:
+        """Queue a message for the next batch; False if the writer is too far behind to take it."""
+        if self.closing or len(self.pending) >= self.max_pending:
+            self.stats.rejected += 1
+            return False
+        self.pending.append(msg)
+        self.wake.set()
+        if len(self.pending) >= self.batch_size:
+            self.full.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while not self.closing or self.pending:
+            await self.wake.wait()
+            if self.flush_ms and len(self.pending) < self.batch_size and not self.closing:
+                try:
+                    async with asyncio.timeout(self.flush_ms / 1000):
+                        await self.full.wait()
+                except TimeoutError:
+                    pass
+            await self._flush_once()
+
+    async def _flush_once(self) -> None:
+        batch = self.pending[: self.batch_size]
+        del self.pending[: self.batch_size]
+        if len(self.pending) < self.batch_size:
+            self.full.clear()
+        if not self.pending:
+            self.wake.clear()
+        if batch:
+            await self._write(batch)
+
+    async def _insert(self, batch: list[PendingMessage]) -> list[tuple[int, datetime]]:
+        rows = [{"room_id": m.room_id, "user_id": m.user_id, "content": m.content} for m in batch]
+        stmt = insert(MessageORM).returning(MessageORM.id, MessageORM.created_at, sort_by_parameter_order=True)
+        async with self.session_factory() as session:
+            saved = [(message_id, created_at) for message_id, created_at in (await session.execute(stmt, rows)).all()]
+            per_room: dict[int, tuple[int, datetime]] = {}
+            for msg, (_, created_at) in zip(batch, saved, strict=True):
+                count, last_at = per_room.get(msg.room_id, (0, created_at))
+                per_room[msg.room_id] = (count + 1, max(last_at, created_at))
+            for room_id in sorted(per_room):
+                await room_counters.add_messages(session, room_id, *per_room[room_id])
+            await session.commit()
+        return saved
+
+    async def _write(self, batch: list[PendingMessage]) -> None:
+        try:
+            saved = await self._insert(batch)
+        except (IntegrityError, DataError):
+            if len(batch) == 1:
+                logger.warning("chat message rejected room=%s user=%s", batch[0].room, batch[0].username, exc_info=True)
+                await self._fail(batch)
+                return
+            # A row the database refuses (deleted room, bad text): the halves keep submission order
+            self.stats.splits += 1
+            middle = len(batch) // 2
+            await self._write(batch[:middle])
+            await self._write(batch[middle:])
+            return
+        except Exception:
+            # Not about any one row (database down, say): retrying in pieces wouldn't help
+            logger.exception("chat batch insert failed size=%s", len(batch))
+            await self._fail(batch)
+            return
+        now = time.perf_counter()
+        self.stats.batches += 1
+        self.stats.messages += len(batch)
+        self.stats.max_batch = max(self.stats.max_batch, len(batch))
+        for msg, (message_id, created_at) in zip(batch, saved, strict=True):
+            latency_ms = (now - msg.enqueued_at) * 1000
+            self.stats.latency_ms_total += latency_ms
+            self.stats.latency_ms_max = max(self.stats.latency_ms_max, latency_ms)
+            await self._notify(self.on_saved(msg, message_id, created_at))
+
+    async def _fail(self, batch: list[PendingMessage]) -> None:
+        self.stats.failed += len(batch)
+        for msg in batch:
+            await self._notify(self.on_failed(msg))
+
+    @staticmethod
+    async def _notify(callback: Awaitable[None]) -> None:
+        # A failed fanout must not stall the messages behind it
+        try:
+            await callback
+        except Exception:
+            logger.exception("chat writer callback failed")
+
+    async def close(self) -> None:
+        """Stop taking messages and wait until everything already submitted is written."""
+        self.closing = True
+        self.wake.set()
+        self.full.set()
+        if self.task:
+            await self.task
+            self.task = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "batch_size": self.batch_size,
+            "flush_ms": self.flush_ms,
+            "pending": len(self.pending),
+            **self.stats.as_dict(),
+        }
@@ -1,23 +1,31 @@
+import asyncio
 import hashlib
+import logging
 import time
 import uuid
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterator, Callable
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime
 from typing import Annotated, Any, TypedDict
 
 import bcrypt
-from fastapi import Depends, FastAPI, HTTPException, WebSocket, status
+from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi.requests import HTTPConnection
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from pydantic import ValidationError
 from redis.asyncio import Redis
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from fast_room_api.api import room_counters, token_purge
+from fast_room_api.api.auth_cache import auth_cache
+from fast_room_api.api.password_pool import PasswordPoolBusy, password_pool
 from fast_room_api.models.auth import InvalidToken, TokenPayload
 from fast_room_api.models.config import settings
-from fast_room_api.models.db import RefreshTokenORM, UserORM, get_db
+from fast_room_api.models.db import RefreshTokenORM, SessionLocal, UserORM, get_db, get_session_factory, warm_pool
+
+logger = logging.getLogger("fast_room_api.dependencies")
 
 ALGO = "HS256"
 HEADER = {"typ": "JWT", "alg": ALGO}
@@ -79,11 +87,65 @@ async def persist_refresh_token(
 
 async def revoke_refresh_token(db: AsyncSession, token: str) -> None:
     h = hash_refresh_token(token)
-    result = await db.execute(select(RefreshTokenORM).where(RefreshTokenORM.token_hash == h))
-    rt = result.scalars().first()
-    if rt and not rt.revoked:
-        rt.revoked = True
-        await db.commit()
+    stmt = (
+        update(RefreshTokenORM)
+        .where(RefreshTokenORM.token_hash == h, RefreshTokenORM.revoked.is_(False))
+        .values(revoked=True)
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def rotate_refresh_token(
+    db: AsyncSession,
+    token: str,
+    user_agent: str | None = None,
+    ip: str | None = None,
+) -> tuple[str, str] | None:
+    """
+    Revoke a valid refresh token and store its replacement in one transaction.
+
+    Returns (username, new refresh token), or None if the token is invalid, expired, revoked,
+    or was just rotated by a concurrent request: the revoking UPDATE is conditional, so only
+    one of two refreshes racing with the same token gets a row back.
+    """
+    try:
+        payload = decode_token(token)
+    except InvalidToken:
+        return None
+    if payload.typ != "refresh":
+        return None
+    # A subquery rather than UPDATE ... FROM users: SQLite can't return columns of a FROM table
+    owner = select(UserORM.username).where(UserORM.id == RefreshTokenORM.user_id).scalar_subquery()
+    claim = (
+        update(RefreshTokenORM)
+        .where(
+            RefreshTokenORM.token_hash == hash_refresh_token(token),
+            RefreshTokenORM.revoked.is_(False),
+            RefreshTokenORM.expires_at > datetime.now(UTC),
+        )
+        .values(revoked=True)
+        .returning(RefreshTokenORM.user_id, owner)
+        .execution_options(synchronize_session=False)
+    )
+    row = (await db.execute(claim)).first()
+    username = row[1] if row else None
+    if row is None or username is None:
+        await db.rollback()
+        return None
+    user_id = row[0]
+    new_token = create_refresh_token(username=username)
+    new_row = {
+        "user_id": user_id,
+        "token_hash": hash_refresh_token(new_token),
+        # Our own token, just signed: no need to verify it again
+        "expires_at": datetime.fromtimestamp(jwt.get_unverified_claims(new_token)["exp"], tz=UTC),
+        "user_agent": user_agent,
+        "ip_address": ip,
+    }
+    await db.execute(insert(RefreshTokenORM).values(**new_row))
+    await db.commit()
+    return username, new_token
 
 
 async def validate_refresh_token(db: AsyncSession, token: str) -> UserORM | None:
@@ -134,15 +196,54 @@ class State(TypedDict):
     redis: Redis
 
 
+async def _warm_up(redis: Redis) -> None:
+    # Open pooled DB and Redis connections before traffic arrives; a failure here is only logged,
+    # the first requests then connect on demand as they would have anyway
+    try:
+        await warm_pool(settings.db_pool_warmup)
+    except Exception:
+        logger.exception("database pool warm-up failed")
+    try:
+        # Concurrent commands each take their own connection from the pool
+        await asyncio.gather(*(redis.ping() for _ in range(settings.redis_pool_warmup)))
+    except Exception:
+        logger.exception("redis pool warm-up failed")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[State]:
     redis = Redis.from_url(settings.redis_url, decode_responses=True)
+    await _warm_up(redis)
+    jobs = []
+    if settings.room_counters_reconcile_s > 0:
+        jobs.append(
+            asyncio.create_task(
+                room_counters.reconcile_forever(redis, SessionLocal, settings.room_counters_reconcile_s)
+            )
+        )
+    if settings.refresh_token_purge_s > 0:
+        jobs.append(
+            asyncio.create_task(
+                token_purge.purge_forever(
+                    redis, SessionLocal, settings.refresh_token_purge_s, settings.refresh_token_purge_batch
+                )
+            )
+        )
     yield {"redis": redis}
+    for job in jobs:
+        job.cancel()
+    await asyncio.gather(*jobs, return_exceptions=True)
+    manager = getattr(app.state, "ws_manager", None)
+    if manager is not None:
+        # Writes out pending chat messages, then stops its background tasks and Redis listeners
+        await manager.close()
+    password_pool.shutdown()
     await redis.close()
 
 
-async def get_ws_redis_client(websocket: WebSocket) -> Redis:
-    return websocket.state.redis
+async def get_ws_redis_client(conn: HTTPConnection) -> Redis:
+    # HTTPConnection covers both REST requests and WebSocket handshakes
+    return conn.state.redis
 
 
 async def get_user_by_username(db: AsyncSession, username: str) -> UserORM | None:
@@ -155,13 +256,19 @@ async def get_current_user(
     db: Annotated[AsyncSession, Depends(get_db)],
 ) -> UserORM:
     try:
-        token_payload = decode_token(token)
+        token_payload = auth_cache.get_token(token)
+        if token_payload is None:
+            token_payload = decode_token(token)
+            auth_cache.set_token(token, token_payload)
         if token_payload.typ != "access":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token type",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        orm_user = auth_cache.get_user(token_payload.sub)
+        if orm_user is not None:
+            return orm_user
         orm_user = await get_user_by_username(db, token_payload.sub)
         if not orm_user:
             raise HTTPException(
@@ -169,6 +276,7 @@ async def get_current_user(
                 detail="Invalid authentication credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        auth_cache.set_user(orm_user)
         return orm_user
     except InvalidToken as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Invalid token: {e}") from e
@@ -190,11 +298,27 @@ def get_password_hash(password: str) -> str:
     return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
 
+async def _in_password_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    try:
+        return await password_pool.run(fn, *args)
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password checks in progress, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def hash_password(password: str) -> str:
+    """:func:`get_password_hash` off the event loop (503 when the password pool is saturated)."""
+    return await _in_password_pool(get_password_hash, password)
+
+
 async def authenticate_user(db: AsyncSession, username: str, password: str) -> UserORM | None:
     orm_user = await get_user_by_username(db, username)
     if not orm_user:
         return None
-    if not verify_password(password, orm_user.hashed_password):
+    if not await _in_password_pool(verify_password, password, orm_user.hashed_password):
         return None
     return orm_user
 
@@ -202,3 +326,4 @@ async def authenticate_user(db: AsyncSession, username: str, password: str) -> U
 UserDeps = Annotated[UserORM, Depends(get_current_active_user)]
 RedisClient = Annotated[Redis, Depends(get_ws_redis_client)]
 DBSession = Annotated[AsyncSession, Depends(get_db)]
+SessionFactory = Annotated[async_sessionmaker[AsyncSession], Depends(get_session_factory)]
@@ -0,0 +1,356 @@
+"""
+Cross-node fanout backends.
+
+A backend carries room events between API nodes. The :class:`ConnectionManager` hands
+it every broadcast and receives remote events through a ``deliver`` callback.
+
+- :class:`PubSubFanout`: fire-and-forget ``PUBLISH`` on a channel per room (or per hash bucket)
+- :class:`StreamFanout`: capped per-room Redis Streams. Every event carries its stream id
+  (``sid``) and a reconnecting client can ask for the events after the last id it saw.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from redis.asyncio import Redis
+
+from fast_room_api import serialization
+from fast_room_api.api.outbox import Frame
+
+logger = logging.getLogger("fast_room_api.websocket.fanout")
+
+CHANNEL_PREFIX = "room:"
+BUCKET_CHANNEL_PREFIX = CHANNEL_PREFIX + "bucket:"
+STREAM_PREFIX = "stream:room:"
+STREAM_FIELD = "d"
+STREAM_BLOCK_MS = 1000  # XREAD block; a room added while blocked is picked up on the next call
+STREAM_READ_COUNT = 500
+# Ephemeral events not worth replaying: typing is stale by then and presence_state is resent on join
+REPLAY_SKIP_TYPES = frozenset({"typing", "presence_diff"})
+_STREAM_ID = re.compile(r"^\d+-\d+$")
+
+Deliver = Callable[[str, Frame], None]
+Active = Callable[[str], bool]
+
+
+def channel_for(room: str, buckets: int = 0) -> str:
+    """Pub/sub channel carrying ``room``: its own channel, or one of ``buckets`` shared hash-bucket channels."""
+    if buckets > 0:
+        # crc32 rather than hash(): must agree across processes regardless of PYTHONHASHSEED
+        return f"{BUCKET_CHANNEL_PREFIX}{zlib.crc32(room.encode()) % buckets}"
+    return CHANNEL_PREFIX + room
+
+
+def stream_key(room: str) -> str:
+    return STREAM_PREFIX + room
+
+
+def _parse_id(stream_id: str) -> tuple[int, int]:
+    ms, seq = stream_id.split("-")
+    return int(ms), int(seq)
+
+
+class FanoutBackend(ABC):
+    """
+    Interface shared by the fanout backends.
+
+    ``deliver(room, frame)`` is called for every event published by another node to a
+    room that still has local sockets (``active(room)``).
+    """
+
+    name = ""
+    # True if publish() returns a new frame (stamped with an id) that local peers must receive instead
+    assigns_ids = False
+
+    def __init__(self, redis: Redis, server_id: str, deliver: Deliver, active: Active):
+        self.redis = redis
+        self.server_id = server_id
+        self.deliver = deliver
+        self.active = active
+        # Set by HostFanout: False for the second copy of a same-host worker's event (see host_fanout.py)
+        self.first_copy: Callable[[str | None, str], bool] | None = None
+
+    def seen_locally(self, srv: str | None, key: str) -> bool:
+        """True for a same-host worker's event whose other copy was already delivered."""
+        return self.first_copy is not None and not self.first_copy(srv, key)
+
+    @abstractmethod
+    async def subscribe(self, room: str) -> None:
+        """Start receiving ``room``'s events from other nodes."""
+
+    @abstractmethod
+    async def unsubscribe_if_idle(self, room: str) -> None:
+        """Stop receiving ``room``'s events if it has no local sockets left."""
+
+    @abstractmethod
+    async def publish(self, room: str, frame: Frame) -> Frame:
+        """Hand ``frame`` to the other nodes; returns the frame local peers must get (see ``assigns_ids``)."""
+
+    async def replay(self, room: str, since: str) -> list[Frame] | None:
+        """Events after ``since``, or None if they can't be served (the caller falls back to DB history)."""
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    def stats(self) -> dict[str, Any]:
+        return {"backend": self.name}
+
+
+async def _stop(task: asyncio.Task | None) -> None:
+    """Cancel a reader task and wait for it to finish."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except (Exception, asyncio.CancelledError):
+        pass
+
+
+@dataclass
+class PubSubStats:
+    subscribes: int = 0
+    unsubscribes: int = 0
+    received: int = 0
+    filtered: int = 0  # messages for rooms without local sockets (bucket mode)
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class PubSubFanout(FanoutBackend):
+    name = "pubsub"
+
+    def __init__(self, redis: Redis, server_id: str, deliver: Deliver, active: Active, buckets: int = 0):
+        super().__init__(redis, server_id, deliver, active)
+        self.pubsub = redis.pubsub()
+        self.room_subscribed: set[str] = set()
+        self.task: asyncio.Task | None = None
+        # >0: rooms hash into this many shared channels, subscribed once for the process lifetime
+        self.buckets = buckets
+        self.buckets_subscribed = False
+        self.lock = asyncio.Lock()
+        self.counters = PubSubStats()
+
+    def _ensure_task(self) -> None:
+        if not self.task:
+            self.task = asyncio.create_task(self._reader())
+
+    async def _reader(self) -> None:
+        try:
+            async for msg in self.pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                self.counters.received += 1
+                raw = msg["data"]
+                data = serialization.loads(raw)
+                room = data.get("room")
+                if not room or data.get("srv") == self.server_id:
+                    continue
+                if not self.active(room):
+                    self.counters.filtered += 1
+                    continue
+                if self.seen_locally(data.get("srv"), raw):
+                    continue
+                # Reuse the received text as-is for every local socket
+                self.deliver(room, Frame(data, text=raw))
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("pubsub reader error")
+
+    async def subscribe(self, room: str) -> None:
+        if self.buckets:
+            # Bucket mode: joins never hit Redis or the lock once the buckets are subscribed
+            if not self.buckets_subscribed:
+                async with self.lock:
+                    if not self.buckets_subscribed:
+                        channels = [f"{BUCKET_CHANNEL_PREFIX}{b}" for b in range(self.buckets)]
+                        await self.pubsub.subscribe(*channels)
+                        self.counters.subscribes += len(channels)
+                        self.buckets_subscribed = True
+                        self._ensure_task()
+            return
+        async with self.lock:
+            if room not in self.room_subscribed:
+                await self.pubsub.subscribe(channel_for(room))
+                self.counters.subscribes += 1
+                self.room_subscribed.add(room)
+                self._ensure_task()
+
+    async def unsubscribe_if_idle(self, room: str) -> None:
+        if self.buckets:
+            return
+        async with self.lock:
+            if room in self.room_subscribed and not self.active(room):
+                await self.pubsub.unsubscribe(channel_for(room))
+                self.counters.unsubscribes += 1
+                self.room_subscribed.discard(room)
+
+    async def publish(self, room: str, frame: Frame) -> Frame:
+        await self.redis.publish(channel_for(room, self.buckets), frame.data)
+        return frame
+
+    async def close(self) -> None:
+        await _stop(self.task)
+        self.task = None
+        # Releases the subscribed connection (room or bucket channels alike)
+        await self.pubsub.aclose()  # type: ignore[attr-defined]  # missing from types-redis
+
+    def stats(self) -> dict[str, Any]:
+        return {"backend": self.name, "buckets": self.buckets, **self.counters.as_dict()}
+
+
+@dataclass
+class StreamStats:
+    appended: int = 0
+    received: int = 0
+    filtered: int = 0  # entries read for rooms whose last local socket left meanwhile
+    read_errors: int = 0
+    replays: int = 0
+    replayed_events: int = 0
+    replay_misses: int = 0  # gap trimmed away or too large; client got DB history instead
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class StreamFanout(FanoutBackend):
+    """
+    One capped stream per room (``XADD ... MAXLEN ~ maxlen``) read by a single ``XREAD``
+    loop per node over the rooms that have local sockets.
+
+    The reader keeps a cursor per room, so events appended while the node's Redis
+    connection was down are delivered once it comes back instead of being lost.
+    """
+
+    name = "streams"
+    assigns_ids = True
+
+    def __init__(
+        self,
+        redis: Redis,
+        server_id: str,
+        deliver: Deliver,
+        active: Active,
+        maxlen: int = 1000,
+        replay_limit: int = 500,
+        block_ms: int = STREAM_BLOCK_MS,
+    ):
+        super().__init__(redis, server_id, deliver, active)
+        self.maxlen = maxlen
+        self.replay_limit = replay_limit
+        self.block_ms = block_ms
+        # room -> id of the last entry this node has read
+        self.cursors: dict[str, str] = {}
+        self.task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self.counters = StreamStats()
+
+    @staticmethod
+    def stamp(frame: Frame, sid: str) -> Frame:
+        """Add ``sid`` to an encoded event by splicing bytes rather than re-serializing it."""
+        data = b'{"sid":"' + sid.encode() + b'",' + frame.data[1:]
+        return Frame({"sid": sid, **frame.obj}, data=data)
+
+    async def subscribe(self, room: str) -> None:
+        if room in self.cursors:
+            return
+        # Start from the current tail so only events from now on are read
+        last = await self.redis.xrevrange(stream_key(room), count=1)
+        self.cursors.setdefault(room, last[0][0] if last else "0-0")
+        self._wakeup.set()
+        if not self.task:
+            self.task = asyncio.create_task(self._reader())
+
+    async def unsubscribe_if_idle(self, room: str) -> None:
+        if not self.active(room):
+            self.cursors.pop(room, None)
+
+    async def publish(self, room: str, frame: Frame) -> Frame:
+        sid = await self.redis.xadd(stream_key(room), {STREAM_FIELD: frame.data}, maxlen=self.maxlen, approximate=True)
+        self.counters.appended += 1
+        return self.stamp(frame, sid)
+
+    async def _reader(self) -> None:
+        try:
+            while True:
+                if not self.cursors:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                try:
+                    await self._read_once()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    # Cursors are kept, so nothing appended meanwhile is lost once Redis is back
+                    self.counters.read_errors += 1
+                    logger.exception("stream reader error")
+                    await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            pass
+
+    async def _read_once(self) -> None:
+        streams = {stream_key(room): cursor for room, cursor in self.cursors.items()}
+        resp = await self.redis.xread(streams, count=STREAM_READ_COUNT, block=self.block_ms)
+        for key, entries in resp.items() if isinstance(resp, dict) else resp or []:
+            room = key[len(STREAM_PREFIX) :]
+            for sid, fields in entries:
+                if room in self.cursors:
+                    self.cursors[room] = sid
+                self.counters.received += 1
+                raw = fields[STREAM_FIELD]
+                data = serialization.loads(raw)
+                if data.get("srv") == self.server_id:
+                    continue
+                if not self.active(room):
+                    self.counters.filtered += 1
+                    continue
+                if self.seen_locally(data.get("srv"), sid):
+                    continue
+                self.deliver(room, self.stamp(Frame(data, text=raw), sid))
+
+    async def replay(self, room: str, since: str) -> list[Frame] | None:
+        if not _STREAM_ID.match(since):
+            return None
+        self.counters.replays += 1
+        key = stream_key(room)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xrange(key, count=1)
+        pipe.xrange(key, min="(" + since, count=self.replay_limit + 1)
+        oldest, entries = await pipe.execute()
+        # Entries right after ``since`` were trimmed (or the stream expired): the gap can't be served
+        if not oldest or _parse_id(oldest[0][0]) > _parse_id(since) or len(entries) > self.replay_limit:
+            self.counters.replay_misses += 1
+            return None
+        frames = []
+        for sid, fields in entries:
+            raw = fields[STREAM_FIELD]
+            data = serialization.loads(raw)
+            if data.get("type") in REPLAY_SKIP_TYPES:
+                continue
+            frames.append(self.stamp(Frame(data, text=raw), sid))
+        self.counters.replayed_events += len(frames)
+        return frames
+
+    async def close(self) -> None:
+        await _stop(self.task)
+        self.task = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": self.name,
+            "maxlen": self.maxlen,
+            "rooms": len(self.cursors),
+            **self.counters.as_dict(),
+        }
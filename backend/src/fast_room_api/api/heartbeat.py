@@ -0,0 +1,139 @@
+"""
+Centralized heartbeat refresh.
+
+One :class:`HeartbeatScheduler` per process replaces the per-(socket, room) sleeping
+tasks. Entries are placed in a timer wheel bucketed by second; a single ticker pops the
+due buckets and refreshes their entries in pipelined batches.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Hashable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+logger = logging.getLogger("fast_room_api.websocket.heartbeat")
+
+
+@dataclass
+class HeartbeatStats:
+    ticks: int = 0
+    batches: int = 0
+    keys_refreshed: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    last_lag_ms: float = 0.0
+    max_lag_ms: float = 0.0
+    errors: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class HeartbeatScheduler:
+    def __init__(
+        self,
+        redis: Redis,
+        interval: int,
+        refresh: Callable[[Pipeline, Any], None],
+        batch_size: int = 500,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.redis = redis
+        self.interval = max(1, interval)
+        # Queues the Redis command(s) refreshing one entry on the given pipeline
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.clock = clock
+        # Wheel of one-second slots; a key is due when the ticker reaches its slot.
+        self._slots: list[set[Hashable]] = [set() for _ in range(self.interval + 1)]
+        self._key_slot: dict[Hashable, int] = {}
+        self._next_second: int | None = None
+        self._task: asyncio.Task | None = None
+        self.stats = HeartbeatStats()
+
+    def __len__(self) -> int:
+        return len(self._key_slot)
+
+    def _slot_for(self, second: int) -> int:
+        return second % len(self._slots)
+
+    def add(self, key: Hashable) -> None:
+        """Schedule ``key`` for refresh every ``interval`` seconds (first refresh one interval from now)."""
+        self.remove(key)
+        slot = self._slot_for(int(self.clock()) + self.interval)
+        self._slots[slot].add(key)
+        self._key_slot[key] = slot
+
+    def remove(self, key: Hashable) -> None:
+        slot = self._key_slot.pop(key, None)
+        if slot is not None:
+            self._slots[slot].discard(key)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (Exception, asyncio.CancelledError):
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                now = self.clock()
+                await asyncio.sleep(1.0 - (now % 1.0))
+                try:
+                    await self.tick()
+                except Exception:
+                    self.stats.errors += 1
+                    logger.exception("heartbeat refresh failed")
+        except asyncio.CancelledError:
+            pass
+
+    async def tick(self) -> None:
+        """Refresh every key whose slot is due, catching up on seconds missed by a stalled loop."""
+        now = self.clock()
+        current = int(now)
+        start = self._next_second if self._next_second is not None else current
+        # Never sweep more than one full revolution, otherwise slots would be visited twice.
+        start = max(start, current - len(self._slots) + 1)
+        self._next_second = current + 1
+        self.stats.ticks += 1
+        for second in range(start, current + 1):
+            slot = self._slot_for(second)
+            due = self._slots[slot]
+            if not due:
+                continue
+            self._slots[slot] = set()
+            lag_ms = max(0.0, (now - second) * 1000)
+            self.stats.last_lag_ms = lag_ms
+            self.stats.max_lag_ms = max(self.stats.max_lag_ms, lag_ms)
+            next_slot = self._slot_for(current + self.interval)
+            for key in due:
+                self._slots[next_slot].add(key)
+                self._key_slot[key] = next_slot
+            await self._refresh(list(due))
+
+    async def _refresh(self, keys: list[Hashable]) -> None:
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i : i + self.batch_size]
+            pipe = self.redis.pipeline(transaction=False)
+            for key in batch:
+                self.refresh(pipe, key)
+            await pipe.execute()
+            self.stats.batches += 1
+            self.stats.keys_refreshed += len(batch)
+            self.stats.last_batch_size = len(batch)
+            self.stats.max_batch_size = max(self.stats.max_batch_size, len(batch))
@@ -0,0 +1,171 @@
+"""
+Recent chat history per room, kept in memory for rooms with local sockets.
+
+A join sends the last ``HISTORY_LIMIT`` messages; in a busy room many clients join at once
+and would all run the same query. :class:`HistoryCache` keeps the newest ``size`` messages
+of each room this node has sockets in, each one already encoded, plus the assembled
+``history`` frame. The first join fills it from the database; after that it follows the
+room's own events (``chat`` appends, ``message_updated`` edits, ``message_deleted`` drops
+the room so the next join refills it), which every node with sockets in the room receives.
+A room is dropped when its last local socket leaves, since its events stop arriving then.
+
+Events that land while a fill's query is in flight are merged into the result by message
+id (an edit or delete in that window makes the fill uncacheable instead).
+"""
+
+from __future__ import annotations
+
+import bisect
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from fast_room_api import serialization
+from fast_room_api.api.outbox import Frame
+
+
+@dataclass
+class HistoryStats:
+    hits: int = 0
+    misses: int = 0
+    fills: int = 0
+    appends: int = 0
+    edits: int = 0
+    drops: int = 0
+    older_hits: int = 0  # history_more pages served from memory
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class RoomHistory:
+    ids: list[int] = field(default_factory=list)  # ascending
+    entries: list[tuple[dict[str, Any], bytes]] = field(default_factory=list)  # (event, encoded), same order
+    exhausted: bool = False  # holds every message the room has (fewer than ``size`` when filled)
+    frame: Frame | None = None  # assembled ``history`` frame for joins, rebuilt lazily after a change
+
+    def insert(self, event: dict[str, Any]) -> bool:
+        message_id = event["message_id"]
+        at = bisect.bisect_left(self.ids, message_id)
+        if at < len(self.ids) and self.ids[at] == message_id:
+            return False
+        self.ids.insert(at, message_id)
+        self.entries.insert(at, (event, serialization.dumps(event)))
+        self.frame = None
+        return True
+
+    def trim(self, size: int) -> None:
+        if len(self.ids) > size:
+            del self.ids[:-size]
+            del self.entries[:-size]
+            self.exhausted = False
+
+
+@dataclass
+class _Loading:
+    appended: list[dict[str, Any]] = field(default_factory=list)
+    stale: bool = False
+
+
+class HistoryCache:
+    def __init__(self, size: int, limit: int):
+        # Messages kept per room; never fewer than a join page, or every cached join would come up short
+        self.size = max(size, limit) if size > 0 else 0
+        self.limit = limit  # messages per history / history_more page
+        self.rooms: dict[str, RoomHistory] = {}
+        self.loading: dict[str, _Loading] = {}
+        self.stats = HistoryStats()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def recent_frame(self, room: str) -> Frame | None:
+        """The join ``history`` frame, or None if the room isn't cached."""
+        history = self.rooms.get(room) if self.enabled else None
+        if history is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        if history.frame is None:
+            page = history.entries[-self.limit :]
+            header = {"type": "history", "room": room}
+            # Splice the already-encoded messages instead of re-serializing them
+            data = serialization.dumps(header)[:-1] + b',"messages":[' + b",".join(d for _, d in page) + b"]}"
+            history.frame = Frame({**header, "messages": [e for e, _ in page]}, data=data)
+        return history.frame
+
+    def older(self, room: str, before_id: int) -> tuple[list[dict[str, Any]], bool] | None:
+        """A ``history_more`` page (messages, more) if memory can answer it exactly, else None."""
+        history = self.rooms.get(room) if self.enabled else None
+        if history is None:
+            return None
+        end = bisect.bisect_left(history.ids, before_id)
+        if end < self.limit and not history.exhausted:
+            return None
+        self.stats.older_hits += 1
+        page = [e for e, _ in history.entries[max(0, end - self.limit) : end]]
+        return page, len(page) == self.limit
+
+    def begin_fill(self, room: str) -> None:
+        """Call before querying the database, so events arriving meanwhile aren't lost."""
+        if self.enabled:
+            self.loading.setdefault(room, _Loading())
+
+    def fill(self, room: str, events: list[dict[str, Any]], active: bool = True) -> None:
+        """Store the newest ``size`` messages (oldest first) just read for ``room``."""
+        loading = self.loading.pop(room, None)
+        if loading is None or loading.stale or not active:
+            return
+        history = RoomHistory(exhausted=len(events) < self.size)
+        for event in events + loading.appended:
+            history.insert(event)
+        history.trim(self.size)
+        self.rooms[room] = history
+        self.stats.fills += 1
+
+    def apply(self, room: str, event: dict[str, Any]) -> None:
+        """Follow a room event (local broadcast or received from another node)."""
+        etype = event.get("type")
+        if etype not in ("chat", "message_updated", "message_deleted"):
+            return
+        if not isinstance(event.get("message_id"), int):
+            return
+        loading = self.loading.get(room)
+        if loading is not None:
+            if etype == "chat" and len(loading.appended) < self.size:
+                loading.appended.append(self._entry(event))
+            else:
+                loading.stale = True
+        history = self.rooms.get(room)
+        if history is None:
+            return
+        if etype == "chat":
+            if history.insert(self._entry(event)):
+                history.trim(self.size)
+                self.stats.appends += 1
+        elif etype == "message_updated":
+            at = bisect.bisect_left(history.ids, event["message_id"])
+            if at < len(history.ids) and history.ids[at] == event["message_id"]:
+                updated = {**history.entries[at][0], "message": event.get("content", "")}
+                history.entries[at] = (updated, serialization.dumps(updated))
+                history.frame = None
+                self.stats.edits += 1
+        else:
+            # The page would come up one short; let the next join refill it
+            self.drop(room)
+
+    @staticmethod
+    def _entry(event: dict[str, Any]) -> dict[str, Any]:
+        # Same shape as the history rows: no fanout bookkeeping (srv, sid)
+        return {k: v for k, v in event.items() if k not in ("srv", "sid")}
+
+    def drop(self, room: str) -> None:
+        if self.rooms.pop(room, None) is not None:
+            self.stats.drops += 1
+        loading = self.loading.get(room)
+        if loading is not None:
+            loading.stale = True
+
+    def as_dict(self) -> dict[str, Any]:
+        return {"rooms": len(self.rooms), "size": self.size, **self.stats.as_dict()}
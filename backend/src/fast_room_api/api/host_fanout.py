@@ -0,0 +1,255 @@
+"""
+Fanout between the worker processes of one host over Unix sockets.
+
+``python -m fast_room_api.serve`` runs one worker per core. Left to the Redis backends, an
+event from one worker reaches its siblings on the same machine by way of Redis. Each
+worker also listens on ``{WS_LOCAL_FANOUT_DIR}/{SERVER_ID}.sock`` and writes every event
+it publishes to its siblings' sockets directly, framed as a 4-byte length plus the
+already-encoded payload.
+
+- Wrapping a Redis backend (``WS_LOCAL_FANOUT_DIR`` set): events still go through Redis for
+  the other hosts, so an event from a linked sibling arrives twice. Whichever copy comes
+  first is delivered and the other is dropped; the pairing is keyed by the event's bytes
+  (its stream id with the streams backend). An event that never comes over the socket
+  (the link dropped, or the sibling gave up on a backlog) is still delivered from Redis.
+- On its own (``WS_FANOUT_BACKEND=local``): Redis carries no room events at all. This only
+  suits deployments where every worker runs on one host.
+
+Siblings are found by listing the directory, at most every ``rescan_s``. A sibling whose
+socket stops draining has its link closed when more than ``max_buffer`` bytes are queued
+for it, so a stuck process can't grow this one's memory. Frames sent just as a link opens,
+or whose second copy shows up after ``dedupe_ttl_s``, may be delivered twice.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from redis.asyncio import Redis
+
+from fast_room_api import serialization
+from fast_room_api.api.fanout import Active, Deliver, FanoutBackend
+from fast_room_api.api.outbox import Frame
+from fast_room_api.cache import TTLCache
+
+logger = logging.getLogger("fast_room_api.websocket.host_fanout")
+
+DEFAULT_DIR = os.path.join(tempfile.gettempdir(), "fastroom-fanout")
+SOCKET_SUFFIX = ".sock"
+_LENGTH = 4
+
+
+@dataclass
+class HostFanoutStats:
+    sent: int = 0
+    received: int = 0
+    filtered: int = 0  # frames for rooms without local sockets
+    connect_errors: int = 0  # stale sockets of exited workers, mostly
+    overflows: int = 0  # links closed because the sibling stopped reading
+    duplicates: int = 0  # second copies (socket or Redis) of a sibling's event, dropped
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class HostFanout(FanoutBackend):
+    name = "host"
+
+    def __init__(
+        self,
+        redis: Redis,
+        server_id: str,
+        deliver: Deliver,
+        active: Active,
+        directory: str = DEFAULT_DIR,
+        remote: FanoutBackend | None = None,
+        rescan_s: float = 1.0,
+        max_buffer: int = 4 * 1024 * 1024,
+        dedupe_size: int = 10_000,
+        dedupe_ttl_s: float = 10.0,
+    ):
+        super().__init__(redis, server_id, deliver, active)
+        self.directory = directory
+        self.path = os.path.join(directory, server_id + SOCKET_SUFFIX)
+        self.remote = remote
+        # Stamped ids come from the remote backend, so local peers must see its frame
+        self.assigns_ids = bool(remote and remote.assigns_ids)
+        self.rescan_s = rescan_s
+        self.max_buffer = max_buffer
+        self.server: asyncio.AbstractServer | None = None
+        self.peers: dict[str, asyncio.StreamWriter] = {}  # sibling server id -> our link to it
+        self.known: set[str] = set()  # sibling server ids found in the directory
+        self.connecting: set[str] = set()
+        self.scanned_at = 0.0
+        # Siblings currently linked to us (a Counter: a reconnect may briefly overlap the old link)
+        self.linked: Counter[str] = Counter()
+        # Keys of sibling events delivered once already, waiting for their other copy
+        self.copies = TTLCache(dedupe_size, ttl=dedupe_ttl_s)
+        if remote is not None:
+            remote.first_copy = self._first_copy
+        self.lock = asyncio.Lock()
+        self.tasks: set[asyncio.Task] = set()
+        self.counters = HostFanoutStats()
+
+    async def _ensure_server(self) -> None:
+        if self.server is not None:
+            return
+        async with self.lock:
+            if self.server is None:
+                os.makedirs(self.directory, exist_ok=True)
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.path)  # left behind by a crashed worker with the same id
+                self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self.tasks.add(task)
+        origin = None
+        try:
+            origin = (await self._read(reader)).decode()
+            self.linked[origin] += 1
+            while True:
+                raw = await self._read(reader)
+                self.counters.received += 1
+                data = serialization.loads(raw)
+                room = data.get("room")
+                if not room:
+                    continue
+                if not self.active(room):
+                    self.counters.filtered += 1
+                    continue
+                frame = Frame(data, data=raw)
+                if self.remote is None or self._first_copy(origin, frame.obj.get("sid") or frame.text):
+                    self.deliver(room, frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("host fanout link error origin=%s", origin)
+        finally:
+            if origin is not None:
+                self.linked[origin] -= 1
+                if self.linked[origin] <= 0:
+                    del self.linked[origin]
+            writer.close()
+            if task is not None:
+                self.tasks.discard(task)
+
+    def _first_copy(self, srv: str | None, key: str) -> bool:
+        """Called for both copies of a sibling's event (socket and Redis); True only for the first."""
+        if self.copies.pop(key) is not None:
+            self.counters.duplicates += 1
+            return False
+        if srv in self.linked:
+            self.copies.set(key, True)
+        return True
+
+    @staticmethod
+    async def _read(reader: asyncio.StreamReader) -> bytes:
+        size = int.from_bytes(await reader.readexactly(_LENGTH), "big")
+        return await reader.readexactly(size)
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, data: bytes) -> None:
+        writer.writelines([len(data).to_bytes(_LENGTH, "big"), data])
+
+    def _scan(self) -> None:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        self.known = {
+            name[: -len(SOCKET_SUFFIX)]
+            for name in names
+            if name.endswith(SOCKET_SUFFIX) and name != self.server_id + SOCKET_SUFFIX
+        }
+        self.scanned_at = time.monotonic()
+
+    async def _connect(self) -> None:
+        if time.monotonic() - self.scanned_at >= self.rescan_s:
+            self._scan()
+        for sibling in self.known - self.peers.keys() - self.connecting:
+            self.connecting.add(sibling)
+            try:
+                _, writer = await asyncio.open_unix_connection(os.path.join(self.directory, sibling + SOCKET_SUFFIX))
+            except OSError:
+                # Gone (or not listening yet); forget it until the next scan
+                self.counters.connect_errors += 1
+                self.known.discard(sibling)
+                continue
+            finally:
+                self.connecting.discard(sibling)
+            self._write(writer, self.server_id.encode())
+            self.peers[sibling] = writer
+
+    async def _send(self, frame: Frame) -> None:
+        await self._connect()
+        for sibling, writer in list(self.peers.items()):
+            if writer.is_closing():
+                del self.peers[sibling]
+                continue
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                # From here on the sibling gets our events from Redis only; the socket's backlog is dropped
+                self.counters.overflows += 1
+                writer.close()
+                del self.peers[sibling]
+                continue
+            self._write(writer, frame.data)
+            self.counters.sent += 1
+
+    async def subscribe(self, room: str) -> None:
+        await self._ensure_server()
+        if self.remote is not None:
+            await self.remote.subscribe(room)
+
+    async def unsubscribe_if_idle(self, room: str) -> None:
+        if self.remote is not None:
+            await self.remote.unsubscribe_if_idle(room)
+
+    async def publish(self, room: str, frame: Frame) -> Frame:
+        if self.remote is not None and self.remote.assigns_ids:
+            frame = await self.remote.publish(room, frame)
+            await self._send(frame)
+            return frame
+        await self._send(frame)
+        if self.remote is not None:
+            await self.remote.publish(room, frame)
+        return frame
+
+    async def replay(self, room: str, since: str) -> list[Frame] | None:
+        return await self.remote.replay(room, since) if self.remote is not None else None
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+        for writer in self.peers.values():
+            writer.close()
+        self.peers.clear()
+        for task in list(self.tasks):
+            task.cancel()
+        if self.remote is not None:
+            await self.remote.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "backend": self.name,
+            "directory": self.directory,
+            "peers": len(self.peers),
+            "linked": len(self.linked),
+            "pending_copies": len(self.copies),
+            **self.counters.as_dict(),
+            "remote": self.remote.stats() if self.remote is not None else None,
+        }
@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from fast_room_api.api import ws_compression
+from fast_room_api.api.admission import admission
+from fast_room_api.api.auth_cache import auth_cache
 from fast_room_api.api.dependencies import lifespan
+from fast_room_api.api.password_pool import password_pool
 from fast_room_api.api.routers import auth, rooms, users, ws
 from fast_room_api.logging_config import setup_logging
 
@@ -29,6 +33,19 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/stats")
+def stats():
+    """Process-local runtime counters (WebSocket queues, etc.)."""
+    manager = getattr(app.state, "ws_manager", None)
+    return {
+        "ws": manager.stats() if manager else None,
+        "ws_compression": ws_compression.stats.as_dict(),
+        "auth_cache": auth_cache.as_dict(),
+        "password_pool": password_pool.as_dict(),
+        "ws_admission": admission.as_dict(),
+    }
+
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(rooms.router)
@@ -38,4 +55,10 @@ app.include_router(ws.router)
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("fast_room_api.api.main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "fast_room_api.api.main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        ws="fast_room_api.api.ws_compression:WebSocketProtocol",
+    )
@@ -0,0 +1,230 @@
+"""
+Per-connection bounded outbound queues.
+
+Every WebSocket gets an :class:`Outbox` drained by its own writer task, so fanout
+is a non-blocking enqueue and one slow client can no longer stall a whole room
+(or the sender's receive loop).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import asdict, dataclass
+from enum import IntEnum, StrEnum
+from typing import Any
+
+from fastapi import WebSocket
+from starlette.status import WS_1013_TRY_AGAIN_LATER
+
+from fast_room_api import serialization
+from fast_room_api.api import wire
+from fast_room_api.models.ws import OutBatch
+
+logger = logging.getLogger("fast_room_api.websocket.outbox")
+
+
+class OverflowPolicy(StrEnum):
+    DROP_OLDEST = "drop_oldest"
+    DROP_LOW_PRIORITY = "drop_low_priority"
+    DISCONNECT = "disconnect"
+
+
+class Priority(IntEnum):
+    LOW = 0  # safe to lose under pressure (typing indicators)
+    HIGH = 1
+
+
+class Frame:
+    """
+    An outbound payload that is serialized at most once.
+
+    The same Frame instance is queued for every local peer (and published to Redis),
+    so a broadcast to N sockets costs one encode instead of N.
+    """
+
+    __slots__ = ("obj", "_data", "_text", "_packed")
+
+    def __init__(self, obj: dict[str, Any], text: str | None = None, data: bytes | None = None):
+        self.obj = obj
+        self._text = text
+        self._data = data
+        self._packed: bytes | None = None
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            self._data = self._text.encode("utf-8") if self._text is not None else serialization.dumps(self.obj)
+        return self._data
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode("utf-8")
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        """MessagePack envelope for binary subprotocol clients (also encoded at most once)."""
+        if self._packed is None:
+            self._packed = wire.encode_envelope(self.obj)
+        return self._packed
+
+
+@dataclass
+class OutboxStats:
+    """Counters shared by all outboxes of a ConnectionManager."""
+
+    enqueued: int = 0
+    sent: int = 0
+    send_errors: int = 0
+    dropped_oldest: int = 0
+    dropped_low_priority: int = 0
+    disconnects: int = 0
+    max_depth: int = 0
+    batches: int = 0  # ``batch`` frames sent to sockets that negotiated a batch window
+    batched_events: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class Outbox:
+    def __init__(
+        self,
+        ws: WebSocket,
+        maxsize: int,
+        policy: OverflowPolicy,
+        stats: OutboxStats,
+        batch_ms: int = 0,
+        binary: bool = False,
+    ):
+        self.ws = ws
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.stats = stats
+        # >0: frames queued within this window go out as a single ``batch`` frame
+        self.batch_window = batch_ms / 1000
+        # Negotiated MessagePack subprotocol: binary frames instead of JSON text
+        self.binary = binary
+        self._queue: deque[tuple[Frame, Priority]] = deque()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._writer: asyncio.Task | None = None
+        self._close_task: asyncio.Task | None = None
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def start(self) -> None:
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._run())
+
+    def put(self, frame: Frame, priority: Priority = Priority.HIGH) -> bool:
+        """Enqueue without blocking. Returns False if the frame was dropped."""
+        if self._closed:
+            return False
+        if len(self._queue) >= self.maxsize and not self._make_room(priority):
+            return False
+        self._queue.append((frame, priority))
+        self.stats.enqueued += 1
+        if len(self._queue) > self.stats.max_depth:
+            self.stats.max_depth = len(self._queue)
+        self._ready.set()
+        return True
+
+    def _make_room(self, priority: Priority) -> bool:
+        if self.policy is OverflowPolicy.DROP_OLDEST:
+            self._queue.popleft()
+            self.stats.dropped_oldest += 1
+            return True
+        if self.policy is OverflowPolicy.DROP_LOW_PRIORITY:
+            for i, (_, queued_priority) in enumerate(self._queue):
+                if queued_priority is Priority.LOW:
+                    del self._queue[i]
+                    self.stats.dropped_low_priority += 1
+                    return True
+            if priority is Priority.LOW:
+                self.stats.dropped_low_priority += 1
+                return False
+            # Only high priority frames are queued: the client cannot keep up, cut it loose.
+        self._overflow_disconnect()
+        return False
+
+    def _overflow_disconnect(self) -> None:
+        logger.info("outbound queue overflow (depth=%s); disconnecting slow client", len(self._queue))
+        self.stats.disconnects += 1
+        self._closed = True
+        self._queue.clear()
+        if self._writer:
+            self._writer.cancel()
+        self._close_task = asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.ws.close(code=WS_1013_TRY_AGAIN_LATER, reason="slow consumer")
+        except Exception:
+            logger.debug("close after overflow failed", exc_info=True)
+
+    async def _send(self, frame: Frame) -> None:
+        if self.binary:
+            await self.ws.send_bytes(frame.packed)
+        else:
+            await self.ws.send_text(frame.text)
+
+    def _take(self) -> tuple[Frame, int]:
+        """Next frame to write and its event count (in batch mode: everything queued, as one ``batch`` frame)."""
+        if not self.batch_window or len(self._queue) == 1:
+            return self._queue.popleft()[0], 1
+        frames = [frame for frame, _ in self._queue]
+        self._queue.clear()
+        batch = OutBatch(events=[f.obj for f in frames]).model_dump()
+        if self.binary:
+            return Frame(batch), len(frames)
+        # Join the already-encoded events instead of re-serializing them
+        text = '{"type":"batch","events":[' + ",".join(f.text for f in frames) + "]}"
+        return Frame(batch, text=text), len(frames)
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                if not self._queue:
+                    self._ready.clear()
+                    await self._ready.wait()
+                    if self.batch_window:
+                        # Let the rest of the burst arrive before writing
+                        await asyncio.sleep(self.batch_window)
+                    continue
+                frame, count = self._take()
+                try:
+                    await self._send(frame)
+                    self.stats.sent += count
+                    if count > 1:
+                        self.stats.batches += 1
+                        self.stats.batched_events += count
+                except Exception:
+                    # Socket is gone; the receive loop will notice and clean up.
+                    self.stats.send_errors += 1
+                    logger.debug("outbound send failure", exc_info=True)
+                    self._closed = True
+                    self._queue.clear()
+                    return
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self) -> None:
+        self._closed = True
+        self._queue.clear()
+        if self._writer:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except (Exception, asyncio.CancelledError):
+                pass
+            self._writer = None
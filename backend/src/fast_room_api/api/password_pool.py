@@ -0,0 +1,106 @@
+"""
+bcrypt work (``/token`` checks, ``/register`` hashes) on a small dedicated thread pool.
+
+A bcrypt call takes tens to hundreds of milliseconds of CPU; run inline it blocks the event
+loop, and with it every socket served by this worker. bcrypt releases the GIL while it
+hashes, so threads run it in parallel with the loop. The pool admits at most ``workers``
+running plus ``max_queue`` waiting calls; past that :meth:`PasswordPool.run` raises
+:class:`PasswordPoolBusy` straight away (the endpoints answer 503 with ``Retry-After``)
+rather than letting a login storm queue up unboundedly. Time spent waiting for a thread is
+recorded separately from the hashing itself.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Any, TypeVar
+
+from fast_room_api.models.config import settings
+
+T = TypeVar("T")
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when ``workers + max_queue`` calls are already in flight."""
+
+
+@dataclass
+class PasswordPoolStats:
+    completed: int = 0
+    rejected: int = 0
+    peak_in_flight: int = 0
+    queue_wait_ms_total: float = 0.0  # submit -> a thread picks it up
+    queue_wait_ms_max: float = 0.0
+    run_ms_total: float = 0.0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "avg_queue_wait_ms": round(self.queue_wait_ms_total / self.completed, 3) if self.completed else None,
+            "avg_run_ms": round(self.run_ms_total / self.completed, 3) if self.completed else None,
+        }
+
+
+class PasswordPool:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.stats = PasswordPoolStats()
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self.in_flight >= self.workers + self.max_queue:
+            self.stats.rejected += 1
+            raise PasswordPoolBusy
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="password")
+        self.in_flight += 1
+        self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.in_flight)
+        submitted = time.perf_counter()
+
+        def job() -> tuple[T, float, float]:
+            started = time.perf_counter()
+            return fn(*args), started, time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        work = self._executor.submit(job)
+        # A cancelled caller doesn't stop the thread, so the slot is only freed once the call itself is done
+        work.add_done_callback(partial(self._release, loop))
+        result, started, finished = await asyncio.wrap_future(work)
+        wait_ms = (started - submitted) * 1000
+        self.stats.completed += 1
+        self.stats.queue_wait_ms_total += wait_ms
+        self.stats.queue_wait_ms_max = max(self.stats.queue_wait_ms_max, wait_ms)
+        self.stats.run_ms_total += (finished - started) * 1000
+        return result
+
+    def _release(self, loop: asyncio.AbstractEventLoop, _work: Future[Any]) -> None:
+        # Runs on the worker thread: hand the decrement to the loop that owns the counter
+        with suppress(RuntimeError):  # loop already closed at shutdown
+            loop.call_soon_threadsafe(self._done)
+
+    def _done(self) -> None:
+        self.in_flight -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            **self.stats.as_dict(),
+        }
+
+
+password_pool = PasswordPool(settings.password_hash_workers, settings.password_hash_max_queue)
@@ -0,0 +1,159 @@
+"""
+Per-room presence index in Redis.
+
+Each room keeps two keys, maintained atomically by Lua scripts:
+
+- ``presence:z:{room}``: sorted set of ``{username}:{conn_id}`` scored by expiry (epoch ms)
+- ``presence:u:{room}``: hash of ``username -> live connection count``
+
+Join/leave and the "first / last connection of this user" checks are O(log n) in the
+room size, and the presence state is a single range read over unexpired members. Both
+scripts first sweep members whose expiry has passed (connections of a crashed node), and
+both keys carry a TTL that joins and heartbeats push forward.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from fast_room_api.cache import TTLCache
+
+PRESENCE_ZSET_PREFIX = "presence:z:"
+PRESENCE_USERS_PREFIX = "presence:u:"
+# Stale members (from a crashed node) swept per join / leave; keeps the scripts O(log n + k).
+PRUNE_LIMIT = 100
+# Both keys expire this many member TTLs after the last join or heartbeat, so a room
+# abandoned by every node (all of them crashed) doesn't keep its keys forever.
+KEY_TTL_FACTOR = 2
+
+# Shared prologue. KEYS: zset, users hash. ARGV[1]: now_ms, ARGV[2]: prune_limit
+_PRUNE = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, m in ipairs(expired) do
+  redis.call('ZREM', KEYS[1], m)
+  local u = string.match(m, '^(.*):[^:]*$')
+  if redis.call('HINCRBY', KEYS[2], u, -1) <= 0 then
+    redis.call('HDEL', KEYS[2], u)
+  end
+end
+"""
+
+# ARGV: now_ms, prune_limit, expiry_ms, username, member, key_ttl_ms
+# Returns 1 if this is the user's first live connection in the room.
+JOIN_SCRIPT = (
+    _PRUNE
+    + """
+local first = 0
+if redis.call('ZADD', KEYS[1], ARGV[3], ARGV[5]) == 1 then
+  if redis.call('HINCRBY', KEYS[2], ARGV[4], 1) == 1 then
+    first = 1
+  end
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+redis.call('PEXPIRE', KEYS[2], ARGV[6])
+return first
+"""
+)
+
+# ARGV: now_ms, prune_limit, username, member
+# Returns 1 if the user has no live connection left in the room. Pruning first means a
+# connection left behind by a crashed node doesn't keep the user "present" forever.
+LEAVE_SCRIPT = (
+    _PRUNE
+    + """
+if redis.call('ZREM', KEYS[1], ARGV[4]) == 1 then
+  if redis.call('HINCRBY', KEYS[2], ARGV[3], -1) <= 0 then
+    redis.call('HDEL', KEYS[2], ARGV[3])
+  end
+end
+if redis.call('HEXISTS', KEYS[2], ARGV[3]) == 0 then
+  return 1
+end
+return 0
+"""
+)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def zset_key(room: str) -> str:
+    return PRESENCE_ZSET_PREFIX + room
+
+
+def users_key(room: str) -> str:
+    return PRESENCE_USERS_PREFIX + room
+
+
+def member_id(username: str, conn_id: str) -> str:
+    return f"{username}:{conn_id}"
+
+
+def _users(members: list[Any]) -> list[str]:
+    return sorted({m.rsplit(":", 1)[0] for m in members})
+
+
+class PresenceIndex:
+    def __init__(self, redis: Redis, ttl_ms: int, cache_ttl_ms: int = 0, cache_size: int = 10_000):
+        self.redis = redis
+        self.ttl_ms = ttl_ms
+        self.key_ttl_ms = ttl_ms * KEY_TTL_FACTOR
+        # Short-lived read cache for polling clients (REST); WebSocket joins always read live
+        self.cache = TTLCache(cache_size, cache_ttl_ms / 1000)
+        self._join = redis.register_script(JOIN_SCRIPT)
+        self._leave = redis.register_script(LEAVE_SCRIPT)
+
+    async def join(self, room: str, username: str, conn_id: str) -> bool:
+        """Register a live connection; True if it is the user's first one in ``room``."""
+        now = _now_ms()
+        first = await self._join(
+            keys=[zset_key(room), users_key(room)],
+            args=[now, PRUNE_LIMIT, now + self.ttl_ms, username, member_id(username, conn_id), self.key_ttl_ms],
+        )
+        return bool(first)
+
+    async def leave(self, room: str, username: str, conn_id: str) -> bool:
+        """Drop a connection; True if the user has no live connection left in ``room``."""
+        last = await self._leave(
+            keys=[zset_key(room), users_key(room)],
+            args=[_now_ms(), PRUNE_LIMIT, username, member_id(username, conn_id)],
+        )
+        return bool(last)
+
+    async def users(self, room: str) -> list[str]:
+        members: list[Any] = await self.redis.zrangebyscore(zset_key(room), _now_ms(), "+inf")
+        users = _users(members)
+        self.cache.set(room, users)
+        return users
+
+    async def users_many(self, rooms: list[str], cached: bool = False) -> dict[str, list[str]]:
+        """Presence for several rooms in one pipelined round trip; ``cached`` serves recent reads from memory."""
+        out: dict[str, list[str]] = {}
+        missing: list[str] = []
+        for room in rooms:
+            users = self.cache.get(room) if cached else None
+            if users is None:
+                missing.append(room)
+            else:
+                out[room] = users
+        if missing:
+            now = _now_ms()
+            pipe = self.redis.pipeline(transaction=False)
+            for room in missing:
+                pipe.zrangebyscore(zset_key(room), now, "+inf")
+            for room, members in zip(missing, await pipe.execute(), strict=True):
+                out[room] = _users(members)
+                self.cache.set(room, out[room])
+        return out
+
+    def refresh(self, pipe: Pipeline, entry: tuple[str, str]) -> None:
+        """Heartbeat: push the expiry of a still-registered member (XX never resurrects a left one) and the key TTLs."""
+        room, member = entry
+        pipe.zadd(zset_key(room), {member: _now_ms() + self.ttl_ms}, xx=True)
+        pipe.pexpire(zset_key(room), self.key_ttl_ms)
+        pipe.pexpire(users_key(room), self.key_ttl_ms)
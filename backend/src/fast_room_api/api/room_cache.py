@@ -0,0 +1,253 @@
+"""
+In-process cache of room rows and memberships, shared by the REST handlers and the WebSocket endpoint.
+
+Rooms are looked up by name on every ``chat`` / ``history_more`` frame and by id on most
+REST calls, but almost never change. Entries are immutable :class:`CachedRoom` snapshots
+(never ORM objects, which are bound to a session) kept in two LRU/TTL maps, by id and by
+name. A node that renames or deletes a room drops its own entries and publishes the change
+on :data:`CONTROL_CHANNEL`; every node listens there and drops the same entries, and the
+TTL bounds staleness if an invalidation is ever missed (e.g. while Redis was unreachable).
+
+Membership flags (``(room_id, user_id) -> ban / mute / moderator``) are checked on every chat
+message. They are refreshed from the database on every WebSocket ``join`` and then kept current
+by the ``member_update`` events the moderation toggles already broadcast, which reach every node
+with sockets in the room; leaving a room goes over the control channel.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any
+
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from fast_room_api import serialization
+from fast_room_api.cache import TTLCache
+from fast_room_api.models.db import RoomMemberORM, RoomORM
+
+logger = logging.getLogger("fast_room_api.room_cache")
+
+# Deliberately outside the ``room:`` namespace used for per-room fanout channels
+CONTROL_CHANNEL = "ctl:rooms"
+
+
+@dataclass(frozen=True)
+class CachedRoom:
+    id: int
+    name: str
+    is_private: bool
+    created_at: datetime
+
+    @classmethod
+    def from_orm(cls, room: RoomORM) -> CachedRoom:
+        return cls(id=room.id, name=room.name, is_private=room.is_private, created_at=room.created_at)
+
+
+@dataclass(frozen=True)
+class MemberFlags:
+    is_moderator: bool = False
+    is_banned: bool = False
+    is_muted: bool = False
+
+    @classmethod
+    def from_orm(cls, member: RoomMemberORM) -> MemberFlags:
+        return cls(is_moderator=member.is_moderator, is_banned=member.is_banned, is_muted=member.is_muted)
+
+
+@dataclass
+class InvalidationStats:
+    sent: int = 0
+    received: int = 0
+    dropped_loads: int = 0  # loads discarded because an invalidation landed while they were in flight
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class RoomCache:
+    def __init__(
+        self,
+        redis: Redis,
+        server_id: str,
+        maxsize: int = 10_000,
+        ttl_ms: int = 60_000,
+        member_maxsize: int = 100_000,
+    ):
+        self.redis = redis
+        self.server_id = server_id
+        self.by_id = TTLCache(maxsize, ttl_ms / 1000)
+        self.by_name = TTLCache(maxsize, ttl_ms / 1000)
+        self.members = TTLCache(member_maxsize, ttl_ms / 1000)
+        self.pubsub: PubSub | None = None
+        self.task: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+        # Bumped on every invalidation; a load that started before one is not stored
+        self.generation = 0
+        self.counters = InvalidationStats()
+
+    @property
+    def enabled(self) -> bool:
+        return self.by_id.enabled
+
+    async def get(self, db: AsyncSession, room_id: int) -> CachedRoom | None:
+        room = self.by_id.get(room_id) if self.enabled else None
+        if room is None:
+            room = await self._load(db, RoomORM.id == room_id)
+        return room
+
+    async def get_by_name(self, db: AsyncSession, name: str) -> CachedRoom | None:
+        room = self.by_name.get(name) if self.enabled else None
+        if room is None:
+            room = await self._load(db, RoomORM.name == name)
+        return room
+
+    async def _load(self, db: AsyncSession, where: Any) -> CachedRoom | None:
+        if self.enabled:
+            # Only cache once we're listening, so no invalidation can be missed in between
+            await self._ensure_listener()
+        generation = self.generation
+        orm = (await db.execute(select(RoomORM).where(where))).scalars().first()
+        if orm is None:
+            return None  # misses aren't cached: a room created elsewhere must show up immediately
+        room = CachedRoom.from_orm(orm)
+        if self.generation != generation:
+            self.counters.dropped_loads += 1
+        else:
+            self.by_id.set(room.id, room)
+            self.by_name.set(room.name, room)
+        return room
+
+    async def get_member(self, db: AsyncSession, room_id: int, user_id: int) -> MemberFlags | None:
+        """Flags of a room member, or None if the user isn't one."""
+        flags = self.members.get((room_id, user_id)) if self.enabled else None
+        if flags is not None:
+            return flags
+        return await self.load_member(db, room_id, user_id)
+
+    async def load_member(self, db: AsyncSession, room_id: int, user_id: int) -> MemberFlags | None:
+        """Read a member's flags from the database and cache them, e.g. on join once the room's events arrive."""
+        if self.enabled:
+            await self._ensure_listener()
+        generation = self.generation
+        stmt = select(RoomMemberORM).where(RoomMemberORM.room_id == room_id, RoomMemberORM.user_id == user_id)
+        member = (await db.execute(stmt)).scalars().first()
+        if member is None:
+            self.members.pop((room_id, user_id))
+            return None
+        flags = MemberFlags.from_orm(member)
+        if self.generation != generation:
+            self.counters.dropped_loads += 1
+        else:
+            self.members.set((room_id, user_id), flags)
+        return flags
+
+    def apply_member_update(self, event: dict[str, Any]) -> None:
+        """Apply a ``member_update`` event, whether broadcast here or received from another node."""
+        room_id, user_id = event.get("room_id"), event.get("user_id")
+        if not isinstance(room_id, int) or not isinstance(user_id, int):
+            return
+        self.generation += 1
+        self.members.set(
+            (room_id, user_id),
+            MemberFlags(
+                is_moderator=bool(event.get("is_moderator")),
+                is_banned=bool(event.get("is_banned")),
+                is_muted=bool(event.get("is_muted")),
+            ),
+        )
+
+    async def invalidate_member(self, room_id: int, user_id: int) -> None:
+        """Forget a membership (e.g. the user left the room) here and on every other node."""
+        self.generation += 1
+        self.members.pop((room_id, user_id))
+        await self._publish({"srv": self.server_id, "id": room_id, "user_id": user_id})
+
+    def discard(self, room_id: int, names: list[str]) -> None:
+        self.generation += 1
+        self.by_id.pop(room_id)
+        for name in names:
+            self.by_name.pop(name)
+
+    async def invalidate(self, room_id: int, *names: str) -> None:
+        """Drop a room (under each of ``names``, e.g. old and new on rename) here and on every other node."""
+        self.discard(room_id, list(names))
+        await self._publish({"srv": self.server_id, "id": room_id, "names": list(names)})
+
+    async def _publish(self, payload: dict[str, Any]) -> None:
+        try:
+            await self.redis.publish(CONTROL_CHANNEL, serialization.dumps(payload))
+            self.counters.sent += 1
+        except Exception:
+            logger.exception("room invalidation publish failed payload=%s", payload)
+
+    async def _ensure_listener(self) -> None:
+        if self.task is not None:
+            return
+        async with self.lock:
+            if self.task is None:
+                self.pubsub = self.redis.pubsub()
+                await self.pubsub.subscribe(CONTROL_CHANNEL)
+                self.task = asyncio.create_task(self._listen(self.pubsub))
+
+    async def _listen(self, pubsub: PubSub) -> None:
+        try:
+            async for msg in pubsub.listen():
+                if msg.get("type") != "message":
+                    continue
+                data = serialization.loads(msg["data"])
+                if data.get("srv") == self.server_id:
+                    continue  # already dropped locally
+                self.counters.received += 1
+                if "user_id" in data:
+                    self.generation += 1
+                    self.members.pop((int(data["id"]), int(data["user_id"])))
+                else:
+                    self.discard(int(data["id"]), [str(n) for n in data.get("names", [])])
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("room invalidation listener error; cache cleared")
+            # Whatever was missed can't be replayed: start over and resubscribe on the next load
+            self.clear()
+            self.task = None
+            if self.pubsub is pubsub:
+                self.pubsub = None
+            await self._close_pubsub(pubsub)
+
+    @staticmethod
+    async def _close_pubsub(pubsub: PubSub) -> None:
+        # Hands its connection back to the pool; a dead one may fail to disconnect cleanly
+        try:
+            await pubsub.aclose()  # type: ignore[attr-defined]  # missing from types-redis
+        except Exception:
+            logger.warning("room invalidation pubsub close failed", exc_info=True)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.by_id.clear()
+        self.by_name.clear()
+        self.members.clear()
+
+    async def close(self) -> None:
+        if self.task:
+            task, self.task = self.task, None
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self.pubsub is not None:
+            pubsub, self.pubsub = self.pubsub, None
+            await self._close_pubsub(pubsub)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "listening": self.task is not None,
+            "by_id": self.by_id.stats(),
+            "by_name": self.by_name.stats(),
+            "members": self.members.stats(),
+            "invalidations": self.counters.as_dict(),
+        }
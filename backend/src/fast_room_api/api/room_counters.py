@@ -0,0 +1,149 @@
+"""
+Denormalized per-room counters: ``member_count``, ``message_count`` and ``last_message_at``.
+
+The list endpoints used to run a ``count(*)`` next to every page. The counts now live on the
+``rooms`` row and every write path bumps them in the same transaction as the rows it adds
+or removes: joins and leaves, message deletes, and the chat writer once per room per batch
+(so a busy room's row is updated once per group commit, not once per message). Rows touched
+by a batch are updated in id order so concurrent writers take the row locks in one order.
+
+Anything that changes rows behind the API's back (cascades from a deleted user, manual
+cleanup, a write that raced a crash) makes the counters drift; :func:`reconcile` recomputes
+them and fixes the rooms that are off. The counting runs without locks; each fix is a
+compare-and-set on the counters the count saw, so a chat batch that bumped the room in
+between makes the fix miss (the next run picks the room up) instead of being overwritten.
+:func:`reconcile_forever` runs it periodically on one node at a time (a Redis lock), or run
+it once with ``python -m fast_room_api.api.room_counters``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+from redis.asyncio import Redis
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from fast_room_api.models.db import MessageORM, RoomMemberORM, RoomORM
+
+logger = logging.getLogger("fast_room_api.room_counters")
+
+RECONCILE_LOCK = "lock:room-counters"
+RECONCILE_BATCH = 500  # rooms counted per statement
+
+
+@dataclass(frozen=True, slots=True)
+class RoomCounters:
+    member_count: int
+    message_count: int
+    last_message_at: datetime | None
+
+
+async def get(db: AsyncSession, room_id: int) -> RoomCounters | None:
+    """The room's counters (a primary-key read), or None if it doesn't exist."""
+    stmt = select(RoomORM.member_count, RoomORM.message_count, RoomORM.last_message_at).where(RoomORM.id == room_id)
+    row = (await db.execute(stmt)).first()
+    return RoomCounters(*row) if row else None
+
+
+async def add_members(db: AsyncSession, room_id: int, delta: int) -> None:
+    """Bump ``member_count``; call in the transaction that adds or removes the membership."""
+    await db.execute(update(RoomORM).where(RoomORM.id == room_id).values(member_count=RoomORM.member_count + delta))
+
+
+async def add_messages(db: AsyncSession, room_id: int, delta: int, last_at: datetime | None = None) -> None:
+    """Bump ``message_count`` (and move ``last_message_at`` forward to ``last_at``) in the writing transaction."""
+    values = {"message_count": RoomORM.message_count + delta}
+    if last_at is not None:
+        # Batches from different nodes can commit out of order; never move it backwards
+        newer = or_(RoomORM.last_message_at.is_(None), RoomORM.last_message_at < last_at)
+        values["last_message_at"] = case((newer, last_at), else_=RoomORM.last_message_at)
+    await db.execute(update(RoomORM).where(RoomORM.id == room_id).values(**values))
+
+
+async def drifted(session: AsyncSession, low: int, high: int) -> list[tuple[int, RoomCounters, RoomCounters]]:
+    """Rooms ``low <= id < high`` whose counters are off, as (id, stored, recounted); takes no locks."""
+    members = select(func.count()).where(RoomMemberORM.room_id == RoomORM.id).scalar_subquery()
+    messages = select(func.count()).where(MessageORM.room_id == RoomORM.id).scalar_subquery()
+    last_at = select(func.max(MessageORM.created_at)).where(MessageORM.room_id == RoomORM.id).scalar_subquery()
+    # One statement, so the stored and recounted values come from the same snapshot
+    stmt = select(
+        RoomORM.id, RoomORM.member_count, RoomORM.message_count, RoomORM.last_message_at, members, messages, last_at
+    ).where(
+        RoomORM.id >= low,
+        RoomORM.id < high,
+        or_(
+            RoomORM.member_count != members,
+            RoomORM.message_count != messages,
+            RoomORM.last_message_at.is_distinct_from(last_at),
+        ),
+    )
+    return [(row[0], RoomCounters(*row[1:4]), RoomCounters(*row[4:7])) for row in await session.execute(stmt)]
+
+
+async def fix(session: AsyncSession, room_id: int, stored: RoomCounters, recounted: RoomCounters) -> bool:
+    """Write ``recounted`` if the row still holds ``stored``; False if a writer bumped it since the count."""
+    stmt = (
+        update(RoomORM)
+        .where(
+            RoomORM.id == room_id,
+            RoomORM.member_count == stored.member_count,
+            RoomORM.message_count == stored.message_count,
+            RoomORM.last_message_at.is_not_distinct_from(stored.last_message_at),
+        )
+        .values(
+            member_count=recounted.member_count,
+            message_count=recounted.message_count,
+            last_message_at=recounted.last_message_at,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return bool(result.rowcount)  # type: ignore[attr-defined]
+
+
+async def reconcile(session_factory: async_sessionmaker[AsyncSession], batch: int = RECONCILE_BATCH) -> int:
+    """Recompute every room's counters from the rows; returns how many rooms were corrected."""
+    fixed = missed = 0
+    async with session_factory() as session:
+        top = (await session.execute(select(func.max(RoomORM.id)))).scalar_one() or 0
+        for low in range(0, top + 1, batch):
+            rooms = await drifted(session, low, low + batch)
+            # End the read before writing: the fixes lock only their own rows, one primary-key update each
+            await session.commit()
+            if not rooms:
+                continue
+            for room_id, stored, recounted in rooms:
+                if await fix(session, room_id, stored, recounted):
+                    fixed += 1
+                else:
+                    missed += 1
+            await session.commit()
+    if fixed:
+        logger.warning("room counters drifted rooms=%s", fixed)
+    if missed:
+        logger.info("room counters changed while being recounted rooms=%s; retried next run", missed)
+    return fixed
+
+
+async def reconcile_forever(redis: Redis, session_factory: async_sessionmaker[AsyncSession], interval_s: float) -> None:
+    """Run :func:`reconcile` every ``interval_s`` on whichever node takes the lock first."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            # Held for most of the interval so the other nodes skip this round
+            if await redis.set(RECONCILE_LOCK, "1", nx=True, ex=max(1, int(interval_s * 0.9))):
+                await reconcile(session_factory)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("room counter reconcile failed")
+
+
+if __name__ == "__main__":
+    from fast_room_api.models.db import SessionLocal
+
+    print(f"corrected {asyncio.run(reconcile(SessionLocal))} rooms")
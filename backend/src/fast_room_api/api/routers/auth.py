@@ -12,10 +12,10 @@ from fast_room_api.api.dependencies import (
     authenticate_user,
     create_access_token,
     create_refresh_token,
-    get_password_hash,
+    hash_password,
     persist_refresh_token,
     revoke_refresh_token,
-    validate_refresh_token,
+    rotate_refresh_token,
 )
 from fast_room_api.models.auth import RefreshRequest, TokenPair
 from fast_room_api.models.db import UserORM
@@ -60,7 +60,7 @@ async def register_user(
     db_user = await db.execute(select(UserORM).where(UserORM.username == sanitized_username))
     if db_user.scalars().first():
         raise HTTPException(status_code=409, detail="username already exists")
-    hashed_pw = get_password_hash(password)
+    hashed_pw = await hash_password(password)
     user = UserORM(
         username=sanitized_username,
         email=email,
@@ -112,25 +112,11 @@ async def login_for_access_token(
 
 @router.post("/refresh", response_model=TokenPair)
 async def refresh_tokens(db: DBSession, payload: RefreshRequest) -> TokenPair:
-    user = await validate_refresh_token(db, payload.refresh_token)
-    if not user:
+    rotated = await rotate_refresh_token(db, payload.refresh_token)
+    if not rotated:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
-    access_token = create_access_token(username=user.username)
-    new_refresh = create_refresh_token(username=user.username)
-    try:
-        # Persist new refresh first (atomicity not guaranteed; could wrap in transaction if needed)
-        await persist_refresh_token(
-            db,
-            username=user.username,
-            refresh_token=new_refresh,
-            user_agent=None,
-            ip=None,
-        )
-        # Revoke of old token
-        await revoke_refresh_token(db, payload.refresh_token)
-    except Exception:
-        logger.exception("refresh token persistence failed")
-    return TokenPair(access_token=access_token, refresh_token=new_refresh)
+    username, new_refresh = rotated
+    return TokenPair(access_token=create_access_token(username=username), refresh_token=new_refresh)
 
 
 @router.post("/logout", status_code=204)
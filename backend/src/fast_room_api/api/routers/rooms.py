@@ -1,13 +1,14 @@
-import json
+import base64
 import logging
-from collections.abc import Awaitable
 
 from fastapi import APIRouter, HTTPException, Query
 from sqlalchemy import asc, desc, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from fast_room_api.api.dependencies import DBSession, RedisClient, UserDeps
-from fast_room_api.api.routers.ws import CHANNEL_PREFIX, SERVER_ID
+from fast_room_api.api import room_counters
+from fast_room_api.api.dependencies import DBSession, UserDeps
+from fast_room_api.api.room_cache import CachedRoom, RoomCache
+from fast_room_api.api.routers.ws import Manager, Rooms
 from fast_room_api.models.db import MessageORM, RoomMemberORM, RoomORM, UserORM
 from fast_room_api.models.rooms import (
     Message,
@@ -19,6 +20,7 @@ from fast_room_api.models.rooms import (
     RoomMember,
     RoomMembersPage,
     RoomsPage,
+    RoomSummary,
     RoomUpdate,
 )
 from fast_room_api.models.ws import OutMemberUpdate, OutMessageDeleted, OutMessageUpdated
@@ -26,16 +28,40 @@ from fast_room_api.models.ws import OutMemberUpdate, OutMessageDeleted, OutMessa
 logger = logging.getLogger("fast_room_api.rooms")
 router = APIRouter(prefix="/rooms", tags=["rooms"])
 
+MAX_PRESENCE_BATCH = 500
+
 
 # ---------- Helpers ---------- #
 
 
-async def _get_room_by_name(db: AsyncSession, name: str) -> RoomORM | None:
-    result = await db.execute(select(RoomORM).where(RoomORM.name == name))
-    return result.scalars().first()
+async def _get_room_by_name(db: AsyncSession, rooms: RoomCache, name: str) -> CachedRoom | None:
+    return await rooms.get_by_name(db, name)
+
+
+async def _get_room(db: AsyncSession, rooms: RoomCache, room_id: int) -> CachedRoom | None:
+    return await rooms.get(db, room_id)
+
 
+def _encode_cursor(direction: str, message_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{direction}:{message_id}".encode()).decode().rstrip("=")
 
-async def _get_room(db: AsyncSession, room_id: int) -> RoomORM | None:
+
+def _decode_cursor(cursor: str) -> tuple[int | None, int | None]:
+    """Opaque page cursor -> (before_id, after_id)."""
+    try:
+        direction, _, raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().partition(":")
+        message_id = int(raw)
+    except ValueError:  # covers binascii.Error and UnicodeDecodeError
+        raise HTTPException(status_code=422, detail="invalid cursor")
+    if direction == "b" and message_id > 0:
+        return message_id, None
+    if direction == "a" and message_id >= 0:
+        return None, message_id
+    raise HTTPException(status_code=422, detail="invalid cursor")
+
+
+async def _load_room(db: AsyncSession, room_id: int) -> RoomORM | None:
+    # Writes work on the live row; reads go through the room cache
     result = await db.execute(select(RoomORM).where(RoomORM.id == room_id))
     return result.scalars().first()
 
@@ -50,6 +76,7 @@ async def list_rooms(
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
     order: str = Query("desc", pattern="^(asc|desc)$"),
+    include_total: bool = Query(False, description="Count the visible rooms (an extra query)"),
 ):
     """
     List all public rooms and private rooms the current user is a member of.
@@ -62,13 +89,16 @@ async def list_rooms(
         select(RoomORM)
         .where(visibility_filter)
         .order_by(desc(RoomORM.created_at) if order == "desc" else asc(RoomORM.created_at))
-        .limit(limit)
+        .limit(limit + 1)  # one extra row tells whether there is another page
         .offset(offset)
     )
-    result = await db.execute(stmt)
-    items = [Room.model_validate(r) for r in result.scalars().all()]
-    total = (await db.execute(select(func.count()).select_from(RoomORM).where(visibility_filter))).scalar_one()
-    next_offset = offset + limit if offset + limit < total else None
+    rows = list((await db.execute(stmt)).scalars().all())
+    has_more = len(rows) > limit
+    items = [RoomSummary.model_validate(r) for r in rows[:limit]]
+    total = None
+    if include_total:
+        total = (await db.execute(select(func.count()).select_from(RoomORM).where(visibility_filter))).scalar_one()
+    next_offset = offset + limit if has_more else None
     return RoomsPage(
         items=items,
         total=total,
@@ -80,11 +110,11 @@ async def list_rooms(
 
 
 @router.post("/", response_model=Room, status_code=201)
-async def create_room(db: DBSession, current_user: UserDeps, payload: RoomCreate):
-    existing = await _get_room_by_name(db, payload.name)
+async def create_room(db: DBSession, rooms: Rooms, current_user: UserDeps, payload: RoomCreate):
+    existing = await _get_room_by_name(db, rooms, payload.name)
     if existing:
         raise HTTPException(status_code=409, detail="room name exists")
-    room = RoomORM(name=payload.name, is_private=payload.is_private)
+    room = RoomORM(name=payload.name, is_private=payload.is_private, member_count=1)
     db.add(room)
     await db.flush()
     db.add(RoomMemberORM(room_id=room.id, user_id=current_user.id, is_moderator=True))
@@ -93,17 +123,43 @@ async def create_room(db: DBSession, current_user: UserDeps, payload: RoomCreate
     return Room.model_validate(room)
 
 
+@router.get("/presence", response_model=list[PresenceState])
+async def get_rooms_presence(
+    db: DBSession,
+    manager: Manager,
+    ids: str = Query(..., description="Comma-separated room ids (max 500)"),
+):
+    """
+    Occupancy for many rooms in one request (unknown ids are omitted).
+    """
+    try:
+        room_ids = list(dict.fromkeys(int(part) for part in ids.split(",") if part.strip()))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be comma-separated integers")
+    if not room_ids or len(room_ids) > MAX_PRESENCE_BATCH:
+        raise HTTPException(status_code=422, detail=f"between 1 and {MAX_PRESENCE_BATCH} ids required")
+    rows = (await db.execute(select(RoomORM.id, RoomORM.name).where(RoomORM.id.in_(room_ids)))).all()
+    names = {room_id: name for room_id, name in rows}
+    presence = await manager.presence.users_many(list(names.values()), cached=True)
+    out: list[PresenceState] = []
+    for room_id in room_ids:
+        if room_id in names:
+            users = presence[names[room_id]]
+            out.append(PresenceState(room_id=room_id, room=names[room_id], users=users, count=len(users)))
+    return out
+
+
 @router.get("/{room_id}", response_model=Room)
-async def get_room(room_id: int, db: DBSession):
-    room = await _get_room(db, room_id)
+async def get_room(room_id: int, db: DBSession, rooms: Rooms):
+    room = await _get_room(db, rooms, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     return Room.model_validate(room)
 
 
 @router.patch("/{room_id}", response_model=Room)
-async def update_room(room_id: int, payload: RoomUpdate, db: DBSession, current_user: UserDeps):
-    room = await _get_room(db, room_id)
+async def update_room(room_id: int, payload: RoomUpdate, db: DBSession, rooms: Rooms, current_user: UserDeps):
+    room = await _load_room(db, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     mod_stmt = select(RoomMemberORM).where(
@@ -115,8 +171,9 @@ async def update_room(room_id: int, payload: RoomUpdate, db: DBSession, current_
     if not is_mod:
         raise HTTPException(status_code=403, detail="not moderator")
     changed = False
+    old_name = room.name
     if payload.name and payload.name != room.name:
-        conflict = await _get_room_by_name(db, payload.name)
+        conflict = await _get_room_by_name(db, rooms, payload.name)
         if conflict:
             raise HTTPException(status_code=409, detail="room name exists")
         room.name = payload.name
@@ -127,12 +184,13 @@ async def update_room(room_id: int, payload: RoomUpdate, db: DBSession, current_
     if changed:
         await db.commit()
         await db.refresh(room)
+        await rooms.invalidate(room.id, old_name, room.name)
     return Room.model_validate(room)
 
 
 @router.delete("/{room_id}", status_code=204)
-async def delete_room(room_id: int, db: DBSession, current_user: UserDeps):
-    room = await _get_room(db, room_id)
+async def delete_room(room_id: int, db: DBSession, rooms: Rooms, current_user: UserDeps):
+    room = await _load_room(db, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     mod_stmt = select(RoomMemberORM).where(
@@ -145,6 +203,7 @@ async def delete_room(room_id: int, db: DBSession, current_user: UserDeps):
         raise HTTPException(status_code=403, detail="not moderator")
     await db.delete(room)
     await db.commit()
+    await rooms.invalidate(room_id, room.name)
     return None
 
 
@@ -155,19 +214,20 @@ async def list_room_members(
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
 ):
-    room = await _get_room(db, room_id)
-    if not room:
+    counters = await room_counters.get(db, room_id)
+    if not counters:
         raise HTTPException(status_code=404, detail="room not found")
     stmt = (
         select(RoomMemberORM, UserORM.username)
         .join(UserORM, UserORM.id == RoomMemberORM.user_id)
         .where(RoomMemberORM.room_id == room_id)
         .order_by(asc(RoomMemberORM.joined_at))
-        .limit(limit)
+        .limit(limit + 1)
         .offset(offset)
     )
-    result = await db.execute(stmt)
-    rows = result.all()
+    rows = list((await db.execute(stmt)).all())
+    has_more = len(rows) > limit
+    del rows[limit:]
     out: list[RoomMember] = [
         RoomMember(
             user_id=member.user_id,
@@ -179,13 +239,10 @@ async def list_room_members(
         )
         for member, username in rows
     ]
-    total = (
-        await db.execute(select(func.count()).select_from(RoomMemberORM).where(RoomMemberORM.room_id == room_id))
-    ).scalar_one()
-    next_offset = offset + limit if offset + limit < total else None
+    next_offset = offset + limit if has_more else None
     return RoomMembersPage(
         items=out,
-        total=total,
+        total=counters.member_count,
         limit=limit,
         offset=offset,
         has_more=next_offset is not None,
@@ -194,8 +251,8 @@ async def list_room_members(
 
 
 @router.post("/{room_id}/join", response_model=RoomMember, status_code=201)
-async def join_room(room_id: int, db: DBSession, current_user: UserDeps):
-    room = await _get_room(db, room_id)
+async def join_room(room_id: int, db: DBSession, rooms: Rooms, current_user: UserDeps):
+    room = await _get_room(db, rooms, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     if room.is_private:
@@ -207,6 +264,7 @@ async def join_room(room_id: int, db: DBSession, current_user: UserDeps):
         raise HTTPException(status_code=409, detail="already member")
     member = RoomMemberORM(room_id=room_id, user_id=current_user.id)
     db.add(member)
+    await room_counters.add_members(db, room_id, 1)
     await db.commit()
     await db.refresh(member)
     # Response includes username
@@ -221,8 +279,8 @@ async def join_room(room_id: int, db: DBSession, current_user: UserDeps):
 
 
 @router.delete("/{room_id}/leave", status_code=204)
-async def leave_room(room_id: int, db: DBSession, current_user: UserDeps):
-    room = await _get_room(db, room_id)
+async def leave_room(room_id: int, db: DBSession, rooms: Rooms, current_user: UserDeps):
+    room = await _get_room(db, rooms, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     stmt = select(RoomMemberORM).where(RoomMemberORM.room_id == room_id, RoomMemberORM.user_id == current_user.id)
@@ -230,7 +288,9 @@ async def leave_room(room_id: int, db: DBSession, current_user: UserDeps):
     if not existing:
         raise HTTPException(status_code=404, detail="membership not found")
     await db.delete(existing)
+    await room_counters.add_members(db, room_id, -1)
     await db.commit()
+    await rooms.invalidate_member(room_id, current_user.id)
     return None
 
 
@@ -240,20 +300,44 @@ async def list_room_messages(
     db: DBSession,
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    before_id: int | None = Query(None, ge=1, description="Keyset: messages older than this id"),
+    after_id: int | None = Query(None, ge=0, description="Keyset: messages newer than this id"),
+    cursor: str | None = Query(None, description="next_cursor of a previous page"),
 ):
-    room = await _get_room(db, room_id)
-    if not room:
+    """
+    A page of messages, oldest first within the page.
+
+    Without ``before_id`` / ``after_id`` / ``cursor`` this is the newest page (offset pages count back
+    from it). Keyset pages seek on the ``(room_id, id)`` index, so every page costs the same however
+    deep it is; follow ``next_cursor`` to keep going in the same direction.
+    """
+    counters = await room_counters.get(db, room_id)
+    if not counters:
         raise HTTPException(status_code=404, detail="room not found")
+    if cursor is not None:
+        before_id, after_id = _decode_cursor(cursor)
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=422, detail="before_id and after_id are mutually exclusive")
+    keyset = before_id is not None or after_id is not None
+    if keyset and offset:
+        raise HTTPException(status_code=422, detail="offset cannot be combined with a cursor")
     stmt = (
         select(MessageORM, UserORM.username)
         .join(UserORM, UserORM.id == MessageORM.user_id, isouter=True)
         .where(MessageORM.room_id == room_id)
-        .order_by(desc(MessageORM.id))
-        .limit(limit)
-        .offset(offset)
+        .limit(limit + 1)  # one extra row tells whether there is another page
     )
-    result = await db.execute(stmt)
-    rows = list(reversed(result.all()))
+    if after_id is not None:
+        stmt = stmt.where(MessageORM.id > after_id).order_by(asc(MessageORM.id))
+    else:
+        if before_id is not None:
+            stmt = stmt.where(MessageORM.id < before_id)
+        stmt = stmt.order_by(desc(MessageORM.id)).offset(offset)
+    rows = list((await db.execute(stmt)).all())
+    has_more = len(rows) > limit
+    del rows[limit:]
+    if after_id is None:
+        rows.reverse()
     items = [
         Message(
             id=m.id,
@@ -264,17 +348,18 @@ async def list_room_messages(
         )
         for m, uname in rows
     ]
-    total = (
-        await db.execute(select(func.count()).select_from(MessageORM).where(MessageORM.room_id == room_id))
-    ).scalar_one()
-    next_offset = offset + limit if offset + limit < total else None
+    next_cursor = None
+    if has_more and items:
+        next_cursor = _encode_cursor("a", items[-1].id) if after_id is not None else _encode_cursor("b", items[0].id)
+    next_offset = offset + limit if has_more and not keyset else None
     return MessagesPage(
         items=items,
-        total=total,
+        total=counters.message_count,
         limit=limit,
         offset=offset,
-        has_more=next_offset is not None,
+        has_more=has_more,
         next_offset=next_offset,
+        next_cursor=next_cursor,
     )
 
 
@@ -284,10 +369,11 @@ async def edit_message(
     message_id: int,
     payload: MessageUpdate,
     db: DBSession,
+    rooms: Rooms,
     current_user: UserDeps,
-    redis_client: RedisClient,
+    manager: Manager,
 ):
-    room = await _get_room(db, room_id)
+    room = await _get_room(db, rooms, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     stmt = select(MessageORM).where(MessageORM.id == message_id, MessageORM.room_id == room_id)
@@ -316,9 +402,8 @@ async def edit_message(
     uname = (await db.execute(select(UserORM.username).where(UserORM.id == msg_obj.user_id))).scalar_one_or_none()
     # Broadcast websocket event
     room_name = room.name
-    evt = OutMessageUpdated(room=room_name, message_id=msg_obj.id, content=msg_obj.content).model_dump(mode="json")
-    evt.setdefault("srv", SERVER_ID)
-    await redis_client.publish(CHANNEL_PREFIX + room_name, json.dumps(evt))
+    evt = OutMessageUpdated(room=room_name, message_id=msg_obj.id, content=msg_obj.content)
+    await manager.broadcast(room_name, evt.model_dump())
     return Message(
         id=msg_obj.id,
         user_id=msg_obj.user_id,
@@ -330,7 +415,12 @@ async def edit_message(
 
 @router.delete("/{room_id}/messages/{message_id}", status_code=204)
 async def delete_message(
-    room_id: int, message_id: int, db: DBSession, current_user: UserDeps, redis_client: RedisClient
+    room_id: int,
+    message_id: int,
+    db: DBSession,
+    rooms: Rooms,
+    current_user: UserDeps,
+    manager: Manager,
 ):
     stmt = select(MessageORM).where(MessageORM.id == message_id, MessageORM.room_id == room_id)
     msg_obj = (await db.execute(stmt)).scalars().first()
@@ -352,36 +442,30 @@ async def delete_message(
     )
     if not (is_mine or is_mod):
         raise HTTPException(status_code=403, detail="not permitted")
-    room = await _get_room(db, room_id)
+    room = await _get_room(db, rooms, room_id)
     room_name = room.name if room else str(room_id)
     await db.delete(msg_obj)
+    await room_counters.add_messages(db, room_id, -1)
     await db.commit()
-    evt = OutMessageDeleted(room=room_name, message_id=message_id).model_dump(mode="json")
-    evt.setdefault("srv", SERVER_ID)
-    await redis_client.publish(CHANNEL_PREFIX + room_name, json.dumps(evt))
+    evt = OutMessageDeleted(room=room_name, message_id=message_id)
+    await manager.broadcast(room_name, evt.model_dump())
     return None
 
 
 @router.get("/by-name/{room_name}", response_model=Room)
-async def get_room_by_name(room_name: str, db: DBSession):
-    room = await _get_room_by_name(db, room_name)
+async def get_room_by_name(room_name: str, db: DBSession, rooms: Rooms):
+    room = await _get_room_by_name(db, rooms, room_name)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
     return Room.model_validate(room)
 
 
 @router.get("/{room_id}/presence", response_model=PresenceState)
-async def get_room_presence(room_id: int, db: DBSession, redis_client: RedisClient):
-    room = await _get_room(db, room_id)
+async def get_room_presence(room_id: int, db: DBSession, rooms: Rooms, manager: Manager):
+    room = await _get_room(db, rooms, room_id)
     if not room:
         raise HTTPException(status_code=404, detail="room not found")
-    from fast_room_api.api.routers.ws import HEARTBEAT_KEY_PREFIX  # local import to avoid cycle
-
-    key = HEARTBEAT_KEY_PREFIX + room.name
-    users_map: Awaitable[dict] | dict = redis_client.hgetall(key)
-    if isinstance(users_map, Awaitable):
-        users_map = await users_map
-    users = sorted(users_map.keys())
+    users = (await manager.presence.users_many([room.name], cached=True))[room.name]
     return PresenceState(room_id=room.id, room=room.name, users=users, count=len(users))
 
 
@@ -414,8 +498,9 @@ async def toggle_moderator(
     room_id: int,
     target_user_id: int,
     db: DBSession,
+    rooms: Rooms,
     current_user: UserDeps,
-    redis_client: RedisClient,
+    manager: Manager,
 ):
     await _require_moderator(db, room_id, current_user.id)
     stmt = (
@@ -434,18 +519,18 @@ async def toggle_moderator(
     member.is_moderator = not member.is_moderator
     await db.commit()
     await db.refresh(member)
-    room = await _get_room(db, room_id)
+    room = await _get_room(db, rooms, room_id)
     if room:
         evt = OutMemberUpdate(
             room=room.name,
+            room_id=room.id,
             user_id=member.user_id,
             username=username,
             is_moderator=member.is_moderator,
             is_banned=member.is_banned,
             is_muted=member.is_muted,
-        ).model_dump(mode="json")
-        evt.setdefault("srv", SERVER_ID)
-        await redis_client.publish(CHANNEL_PREFIX + room.name, json.dumps(evt))
+        )
+        await manager.broadcast(room.name, evt.model_dump())
     return _member_to_schema(member, username)
 
 
@@ -454,8 +539,9 @@ async def toggle_ban(
     room_id: int,
     target_user_id: int,
     db: DBSession,
+    rooms: Rooms,
     current_user: UserDeps,
-    redis_client: RedisClient,
+    manager: Manager,
 ):
     await _require_moderator(db, room_id, current_user.id)
     stmt = (
@@ -474,18 +560,18 @@ async def toggle_ban(
     member.is_banned = not member.is_banned
     await db.commit()
     await db.refresh(member)
-    room = await _get_room(db, room_id)
+    room = await _get_room(db, rooms, room_id)
     if room:
         evt = OutMemberUpdate(
             room=room.name,
+            room_id=room.id,
             user_id=member.user_id,
             username=username,
             is_moderator=member.is_moderator,
             is_banned=member.is_banned,
             is_muted=member.is_muted,
-        ).model_dump(mode="json")
-        evt.setdefault("srv", SERVER_ID)
-        await redis_client.publish(CHANNEL_PREFIX + room.name, json.dumps(evt))
+        )
+        await manager.broadcast(room.name, evt.model_dump())
     return _member_to_schema(member, username)
 
 
@@ -494,8 +580,9 @@ async def toggle_mute(
     room_id: int,
     target_user_id: int,
     db: DBSession,
+    rooms: Rooms,
     current_user: UserDeps,
-    redis_client: RedisClient,
+    manager: Manager,
 ):
     await _require_moderator(db, room_id, current_user.id)
     stmt = (
@@ -514,16 +601,16 @@ async def toggle_mute(
     member.is_muted = not member.is_muted
     await db.commit()
     await db.refresh(member)
-    room = await _get_room(db, room_id)
+    room = await _get_room(db, rooms, room_id)
     if room:
         evt = OutMemberUpdate(
             room=room.name,
+            room_id=room.id,
             user_id=member.user_id,
             username=username,
             is_moderator=member.is_moderator,
             is_banned=member.is_banned,
             is_muted=member.is_muted,
-        ).model_dump(mode="json")
-        evt.setdefault("srv", SERVER_ID)
-        await redis_client.publish(CHANNEL_PREFIX + room.name, json.dumps(evt))
+        )
+        await manager.broadcast(room.name, evt.model_dump())
     return _member_to_schema(member, username)
@@ -1,118 +1,303 @@
 import asyncio
-import json
 import logging
 import os
 import time
 import uuid
 from collections import defaultdict
-from typing import Any
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Annotated, Any
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from fastapi.requests import HTTPConnection
 from redis.asyncio import Redis
 from sqlalchemy import desc, select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from fast_room_api.api.dependencies import DBSession, RedisClient, get_current_user
-from fast_room_api.models.db import MessageORM, RoomMemberORM, RoomORM, UserORM
+from fast_room_api import serialization
+from fast_room_api.api import room_counters, wire
+from fast_room_api.api.admission import CLOSE_TOO_MANY_CONNECTIONS, CLOSE_TRY_AGAIN_LATER, admission
+from fast_room_api.api.chat_writer import ChatWriter, PendingMessage
+from fast_room_api.api.dependencies import RedisClient, SessionFactory, get_current_user
+from fast_room_api.api.fanout import FanoutBackend, PubSubFanout, StreamFanout
+from fast_room_api.api.heartbeat import HeartbeatScheduler
+from fast_room_api.api.history_cache import HistoryCache
+from fast_room_api.api.host_fanout import DEFAULT_DIR, HostFanout
+from fast_room_api.api.outbox import Frame, Outbox, OutboxStats, OverflowPolicy, Priority
+from fast_room_api.api.presence import PresenceIndex, member_id
+from fast_room_api.api.room_cache import CachedRoom, RoomCache
+from fast_room_api.api.typing_state import TypingTracker
+from fast_room_api.models.config import settings
+from fast_room_api.models.db import MessageORM, RoomMemberORM, UserORM, get_session_factory
 from fast_room_api.models.ws import (
     OutChatMessage,
     OutPresenceDiff,
     OutPresenceState,
     OutSystemMessage,
     OutTypingMessage,
+    OutTypingState,
 )
 
 logger = logging.getLogger("fast_room_api.websocket")
 router = APIRouter()
 
 SERVER_ID = os.environ.get("SERVER_ID", uuid.uuid4().hex[:6])
-CHANNEL_PREFIX = "room:"
-HEARTBEAT_KEY_PREFIX = "presence:hb:"
 HISTORY_LIMIT = 50  # number of recent chat messages to send on join
 HEARTBEAT_INTERVAL = int(os.environ.get("WS_HEARTBEAT_INTERVAL", "25"))  # seconds
 HEARTBEAT_TTL_MS = int(os.environ.get("WS_HEARTBEAT_TTL_MS", str((HEARTBEAT_INTERVAL + 5) * 1000)))  # ms
 HEARTBEAT_ONLY = True  # Only heartbeat presence is used
 
 
+@dataclass
+class PublishBatchStats:
+    flushes: int = 0
+    events: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
 class ConnectionManager:
-    def __init__(self, redis_client: Redis):
+    def __init__(self, redis_client: Redis, sessions: async_sessionmaker[AsyncSession] | None = None):
         self.redis = redis_client
         self.rooms: dict[str, set[WebSocket]] = defaultdict(set)
         self.conn_rooms: dict[WebSocket, set[str]] = defaultdict(set)
         self.ws_username: dict[WebSocket, str] = {}
-        self.pubsub = self.redis.pubsub()
-        self.room_subscribed: set[str] = set()
-        self.pubsub_task: asyncio.Task | None = None
+        # Cross-node delivery (Redis pub/sub or Redis Streams), short-cut between workers of one host
+        remote: FanoutBackend | None = None
+        if settings.ws_fanout_backend == "streams":
+            remote = StreamFanout(
+                self.redis,
+                SERVER_ID,
+                self._deliver,
+                self._active,
+                maxlen=settings.ws_stream_maxlen,
+                replay_limit=settings.ws_replay_limit,
+            )
+        elif settings.ws_fanout_backend == "pubsub":
+            remote = PubSubFanout(
+                self.redis, SERVER_ID, self._deliver, self._active, buckets=settings.ws_pubsub_buckets
+            )
+        self.fanout: FanoutBackend
+        if remote is None or settings.ws_local_fanout_dir:
+            self.fanout = HostFanout(
+                self.redis,
+                SERVER_ID,
+                self._deliver,
+                self._active,
+                directory=settings.ws_local_fanout_dir or DEFAULT_DIR,
+                remote=remote,
+            )
+        else:
+            self.fanout = remote
         # self.reconcile_task removed
-        self.lock = asyncio.Lock()
-        # Heartbeat tasks keyed by (ws, room)
-        self.heartbeat_tasks: dict[tuple[WebSocket, str], asyncio.Task] = {}
+        # Per-room presence index; each (ws, room) entry's expiry is pushed by a single per-process scheduler
+        self.presence = PresenceIndex(self.redis, HEARTBEAT_TTL_MS, cache_ttl_ms=settings.presence_cache_ttl_ms)
+        self.heartbeat_entries: dict[tuple[WebSocket, str], tuple[str, str]] = {}
+        # Room rows for REST handlers and chat/history frames; invalidated across nodes on rename/delete
+        self.room_cache = RoomCache(
+            self.redis,
+            SERVER_ID,
+            maxsize=settings.room_cache_size,
+            ttl_ms=settings.room_cache_ttl_ms,
+            member_maxsize=settings.room_member_cache_size,
+        )
+        self.heartbeats = HeartbeatScheduler(self.redis, HEARTBEAT_INTERVAL, self.presence.refresh)
         # Connection ids per websocket (stable for its lifetime)
         self.ws_conn_id: dict[WebSocket, str] = {}
+        # Bounded outbound queue + writer task per websocket
+        self.outboxes: dict[WebSocket, Outbox] = {}
+        self.outbox_stats = OutboxStats()
+        self.send_queue_size = settings.ws_send_queue_size
+        self.overflow_policy = OverflowPolicy(settings.ws_send_overflow_policy)
+        # Broadcasts per room waiting to be published together (see ws_publish_batch_ms)
+        self.publish_batch_ms = settings.ws_publish_batch_ms
+        self.publish_buffers: dict[str, list[Frame]] = {}
+        self.publish_batch_stats = PublishBatchStats()
+        self._flush_tasks: set[asyncio.Task] = set()
+        # Recent messages of rooms with local sockets, kept current by the rooms' own events
+        self.history = HistoryCache(settings.ws_history_cache_size, HISTORY_LIMIT)
+        # Chat messages are persisted in group-committed batches, then fanned out
+        self.chat_writer = ChatWriter(
+            sessions or get_session_factory(),
+            self._chat_saved,
+            self._chat_failed,
+            batch_size=settings.ws_chat_batch_size,
+            flush_ms=settings.ws_chat_flush_ms,
+            max_pending=settings.ws_chat_max_pending,
+        )
+        # Typing state: only transitions reach sockets; large rooms get periodic snapshots instead
+        self.typing = TypingTracker(settings.ws_typing_ttl_ms / 1000)
+        self.typing_snapshot_min_sockets = settings.ws_typing_snapshot_min_sockets
+        self.typing_snapshot_ms = settings.ws_typing_snapshot_ms
+        self.typing_dirty: set[str] = set()
+        self.typing_task: asyncio.Task | None = None
+
+    def _deliver(self, room: str, frame: Frame):
+        # Event from another node; coalesced publishes are unpacked so each socket batches on its own terms
+        if frame.obj.get("type") == "batch":
+            for event in frame.obj.get("events", []):
+                self._deliver(room, Frame(event))
+            return
+        self._observe(room, frame.obj)
+        if frame.obj.get("type") == "typing":
+            user, is_typing = frame.obj.get("user"), bool(frame.obj.get("isTyping"))
+            if isinstance(user, str) and self.typing.observe(room, user, is_typing):
+                self._typing_changed(room, user, is_typing)
+            return
+        self.broadcast_local(room, frame, priority=_priority_for(frame.obj))
+
+    def _active(self, room: str) -> bool:
+        return bool(self.rooms.get(room))
 
-    async def ensure_pubsub_task(self):
-        if not self.pubsub_task:
-            self.pubsub_task = asyncio.create_task(self._pubsub_reader())
+    def _observe(self, room: str, event: dict[str, Any]):
+        # Room events that also update this node's caches, whichever node they came from
+        if event.get("type") == "member_update":
+            self.room_cache.apply_member_update(event)
+        else:
+            self.history.apply(room, event)
 
-    async def _pubsub_reader(self):
+    async def _chat_saved(self, msg: PendingMessage, message_id: int, created_at: datetime):
+        out = OutChatMessage(
+            room=msg.room, user=msg.username, message=msg.content, message_id=message_id, ts=created_at
+        )
+        await self.broadcast(msg.room, out.model_dump())
+
+    async def _chat_failed(self, msg: PendingMessage):
+        self.send(msg.origin, {"type": "error", "message": "message not saved"})
+
+    # ---------------- Outbound Queues -----------------
+    def connect(self, ws: WebSocket, batch_ms: int = 0, binary: bool = False) -> Outbox:
+        outbox = self.outboxes.get(ws)
+        if outbox is None:
+            outbox = Outbox(
+                ws, self.send_queue_size, self.overflow_policy, self.outbox_stats, batch_ms=batch_ms, binary=binary
+            )
+            outbox.start()
+            self.outboxes[ws] = outbox
+        return outbox
+
+    async def disconnect(self, ws: WebSocket):
+        outbox = self.outboxes.pop(ws, None)
+        if outbox:
+            await outbox.close()
+
+    def send(self, ws: WebSocket, payload: dict[str, Any] | Frame, priority: Priority = Priority.HIGH) -> bool:
+        outbox = self.outboxes.get(ws)
+        if outbox is None:
+            return False
+        frame = payload if isinstance(payload, Frame) else Frame(payload)
+        return outbox.put(frame, priority)
+
+    def broadcast_local(
+        self,
+        room: str,
+        payload: dict[str, Any] | Frame,
+        exclude: WebSocket | None = None,
+        priority: Priority = Priority.HIGH,
+    ):
+        frame = payload if isinstance(payload, Frame) else Frame(payload)
+        for peer in list(self.rooms.get(room, [])):
+            if peer is not exclude:
+                self.send(peer, frame, priority)
+
+    async def broadcast(
+        self,
+        room: str,
+        payload: dict[str, Any],
+        exclude: WebSocket | None = None,
+        priority: Priority = Priority.HIGH,
+    ) -> Frame:
+        """Serialize once, then deliver to local peers and publish the same buffer to other nodes."""
+        payload.setdefault("srv", SERVER_ID)
+        self._observe(room, payload)
+        frame = Frame(payload)
+        if self.fanout.assigns_ids:
+            # Local peers must see the same stream id as remote ones, so append first
+            frame = await self.fanout.publish(room, frame)
+            self.broadcast_local(room, frame, exclude=exclude, priority=priority)
+        else:
+            self.broadcast_local(room, frame, exclude=exclude, priority=priority)
+            if self.publish_batch_ms:
+                self._buffer_publish(room, frame)
+            else:
+                await self.fanout.publish(room, frame)
+        return frame
+
+    def _buffer_publish(self, room: str, frame: Frame):
+        buffer = self.publish_buffers.get(room)
+        if buffer is None:
+            self.publish_buffers[room] = [frame]
+            task = asyncio.create_task(self._flush_publish(room))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+        else:
+            buffer.append(frame)
+
+    async def _flush_publish(self, room: str):
+        await asyncio.sleep(self.publish_batch_ms / 1000)
+        frames = self.publish_buffers.pop(room, [])
+        if not frames:
+            return
+        frame = frames[0]
+        if len(frames) > 1:
+            header = {"type": "batch", "room": room, "srv": SERVER_ID}
+            # Splice the already-encoded events into the envelope instead of re-serializing them
+            data = serialization.dumps(header)[:-1] + b',"events":[' + b",".join(f.data for f in frames) + b"]}"
+            frame = Frame({**header, "events": [f.obj for f in frames]}, data=data)
+        self.publish_batch_stats.flushes += 1
+        self.publish_batch_stats.events += len(frames)
         try:
-            async for msg in self.pubsub.listen():
-                if msg.get("type") != "message":
-                    continue
-                data = json.loads(msg["data"])
-                if data.get("srv") == SERVER_ID:
-                    continue
-                room = data.get("room")
-                if not room:
-                    continue
-                # Broadcast to local sockets in that room
-                for ws in list(self.rooms.get(room, [])):
-                    try:
-                        await ws.send_json(data)
-                    except Exception:
-                        logger.debug("failed to send pubsub msg", exc_info=True)
-        except asyncio.CancelledError:
-            pass
+            await self.fanout.publish(room, frame)
         except Exception:
-            logger.exception("pubsub reader error")
+            logger.exception("coalesced publish failed room=%s events=%s", room, len(frames))
 
-    async def subscribe_room(self, room: str):
-        async with self.lock:
-            if room not in self.room_subscribed:
-                await self.pubsub.subscribe(CHANNEL_PREFIX + room)
-                self.room_subscribed.add(room)
-                await self.ensure_pubsub_task()
+    async def close(self):
+        """Shutdown: stop every task this manager started, in dependency order."""
+        # Queued chat messages are written and fanned out first, then the last coalesced publishes
+        await self.chat_writer.close()
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.heartbeats.stop()
+        if self.typing_task:
+            self.typing_task.cancel()
+            await asyncio.gather(self.typing_task, return_exceptions=True)
+            self.typing_task = None
+        for ws in list(self.outboxes):
+            await self.disconnect(ws)
+        await self.fanout.close()
+        await self.room_cache.close()
 
-    async def unsubscribe_room_if_empty(self, room: str):
-        async with self.lock:
-            if room in self.room_subscribed and not self.rooms.get(room):
-                await self.pubsub.unsubscribe(CHANNEL_PREFIX + room)
-                self.room_subscribed.discard(room)
+    def stats(self) -> dict[str, Any]:
+        return {
+            "sockets": len(self.outboxes),
+            "rooms": len(self.rooms),
+            "queue_depth": sum(o.depth for o in self.outboxes.values()),
+            "queue_size": self.send_queue_size,
+            "overflow_policy": self.overflow_policy.value,
+            **self.outbox_stats.as_dict(),
+            "heartbeat": {"entries": len(self.heartbeats), **self.heartbeats.stats.as_dict()},
+            "presence_cache": self.presence.cache.stats(),
+            "room_cache": self.room_cache.stats(),
+            "fanout": self.fanout.stats(),
+            "typing": {"entries": len(self.typing), **self.typing.stats.as_dict()},
+            "chat_writer": self.chat_writer.as_dict(),
+            "history_cache": self.history.as_dict(),
+            "publish_batching": {"window_ms": self.publish_batch_ms, **self.publish_batch_stats.as_dict()},
+        }
 
     def in_room(self, ws: WebSocket, room: str) -> bool:
         return room in self.conn_rooms.get(ws, set())
 
     async def join(self, room: str, ws: WebSocket, username: str) -> bool:
-        await self.subscribe_room(room)
+        await self.fanout.subscribe(room)
         self.rooms[room].add(ws)
         self.conn_rooms[ws].add(room)
         self.ws_username[ws] = username
         if ws not in self.ws_conn_id:
             self.ws_conn_id[ws] = uuid.uuid4().hex
-        # Determine if this user already has any heartbeat key for this room
-        pattern_user = f"{HEARTBEAT_KEY_PREFIX}{room}:{username}:*"
-        cursor = 0
-        seen = False
-        while True:
-            cursor, keys = await self.redis.scan(cursor=cursor, match=pattern_user, count=50)
-            if keys:
-                seen = True
-                break
-            if cursor == 0:
-                break
-        first_global = not seen
-        await self._start_heartbeat(room, ws, username)
+        # Registers the connection in the room's presence index; True if it's the user's first one
+        first_global = await self.presence.join(room, username, self.ws_conn_id[ws])
+        self._start_heartbeat(room, ws, username)
         return first_global
 
     async def leave(self, room: str, ws: WebSocket) -> tuple[bool, str | None]:
@@ -121,23 +306,19 @@ class ConnectionManager:
             if not self.rooms[room]:
                 self.rooms.pop(room, None)
         self.conn_rooms[ws].discard(room)
-        await self._stop_heartbeat(room, ws)
+        self._stop_heartbeat(room, ws)
         username = self.ws_username.get(ws)
+        conn_id = self.ws_conn_id.get(ws)
         removed = False
-        if username:
-            # Check if any heartbeat key remains for this (room, user)
-            pattern_user = f"{HEARTBEAT_KEY_PREFIX}{room}:{username}:*"
-            cursor = 0
-            any_left = False
-            while True:
-                cursor, keys = await self.redis.scan(cursor=cursor, match=pattern_user, count=50)
-                if keys:
-                    any_left = True
-                    break
-                if cursor == 0:
-                    break
-            removed = not any_left
-        await self.unsubscribe_room_if_empty(room)
+        if username and conn_id:
+            # Remove immediately instead of waiting for expiry (otherwise users "linger" after switching rooms)
+            removed = await self.presence.leave(room, username, conn_id)
+        if removed and username and self.typing.discard(room, username):
+            self._typing_changed(room, username, False)
+            await self.publish(room, OutTypingMessage(room=room, user=username, isTyping=False).model_dump())
+        await self.fanout.unsubscribe_if_idle(room)
+        if not self._active(room):
+            self.history.drop(room)  # its events stop arriving here
         return removed, username
 
     async def leave_all(self, ws: WebSocket):
@@ -149,24 +330,13 @@ class ConnectionManager:
         self.conn_rooms.pop(ws, None)
         username = self.ws_username.pop(ws, None)
         self.ws_conn_id.pop(ws, None)
+        await self.disconnect(ws)
         # Emit presence diffs + system messages for implicit disconnect leaves.
         # Without this, manual disconnect (socket close) would rely on heartbeat TTL expiry to update peers.
         for room, uname in removed_events:
             try:
-                diff_payload = OutPresenceDiff(room=room, leave=[uname]).model_dump(mode="json")
-                for peer in list(self.rooms.get(room, [])):
-                    try:
-                        await peer.send_json(diff_payload)
-                    except Exception:
-                        logger.debug("presence diff (implicit leave) local send failure", exc_info=True)
-                await self.publish(room, diff_payload)
-                sys_payload = OutSystemMessage(room=room, message=f"{uname} left").model_dump(mode="json")
-                for peer in list(self.rooms.get(room, [])):
-                    try:
-                        await peer.send_json(sys_payload)
-                    except Exception:
-                        logger.debug("system leave (implicit) local send failure", exc_info=True)
-                await self.publish(room, sys_payload)
+                await self.broadcast(room, OutPresenceDiff(room=room, leave=[uname]).model_dump())
+                await self.broadcast(room, OutSystemMessage(room=room, message=f"{uname} left").model_dump())
             except Exception:
                 logger.debug(
                     "failed broadcasting implicit leave for room=%s user=%s",
@@ -175,79 +345,121 @@ class ConnectionManager:
                     exc_info=True,
                 )
 
-    async def publish(self, room: str, data: dict[str, Any]):
-        data.setdefault("srv", SERVER_ID)
-        # Ensure all values (e.g. datetime) are JSON serializable
-        enc = jsonable_encoder(data)
-        await self.redis.publish(CHANNEL_PREFIX + room, json.dumps(enc))
+    async def publish(self, room: str, data: dict[str, Any] | Frame) -> Frame:
+        if isinstance(data, Frame):
+            frame = data
+        else:
+            data.setdefault("srv", SERVER_ID)
+            frame = Frame(data)
+        return await self.fanout.publish(room, frame)
 
-    # ---------------- Heartbeat Management -----------------
-    def _heartbeat_key(self, room: str, username: str, conn_id: str) -> str:
-        return f"{HEARTBEAT_KEY_PREFIX}{room}:{username}:{conn_id}"
+    async def replay(self, room: str, since: str) -> list[Frame] | None:
+        """Events published to ``room`` after stream id ``since`` (None: not available, use DB history)."""
+        return await self.fanout.replay(room, since)
 
-    async def _start_heartbeat(self, room: str, ws: WebSocket, username: str):
-        key = (ws, room)
-        if key in self.heartbeat_tasks:
+    # ---------------- Typing -----------------
+    async def set_typing(self, room: str, username: str, is_typing: bool):
+        """A local user's typing event: local sockets see transitions, other nodes transitions + keepalives."""
+        changed = self.typing.observe(room, username, is_typing)
+        if changed:
+            self._typing_changed(room, username, is_typing)
+        if self.typing.should_publish(room, username, is_typing, changed):
+            await self.publish(room, OutTypingMessage(room=room, user=username, isTyping=is_typing).model_dump())
+        self._ensure_typing_task()
+
+    def _typing_changed(self, room: str, username: str, is_typing: bool):
+        if len(self.rooms.get(room, ())) >= self.typing_snapshot_min_sockets:
+            # Large room: coalesced into the next typing_state snapshot
+            self.typing_dirty.add(room)
             return
-        conn_id = self.ws_conn_id.get(ws)
-        if not conn_id:
-            conn_id = uuid.uuid4().hex
-            self.ws_conn_id[ws] = conn_id
-        # Generate the heartbeat key once (stable for this (ws, room) pair)
-        hb_key = self._heartbeat_key(room, username, conn_id)
-        # IMPORTANT: Set the key immediately (synchronously) so that a subsequent
-        # presence_state scan performed right after join already sees this user.
-        try:
-            await self.redis.psetex(hb_key, HEARTBEAT_TTL_MS, "1")
-        except Exception:
-            logger.exception("failed to set initial heartbeat key room=%s user=%s", room, username)
+        payload = OutTypingMessage(room=room, user=username, isTyping=is_typing).model_dump()
+        self.broadcast_local(room, payload, priority=Priority.LOW)
 
-        async def beat():
-            try:
-                while True:
-                    await asyncio.sleep(HEARTBEAT_INTERVAL)
-                    await self.redis.psetex(hb_key, HEARTBEAT_TTL_MS, "1")
-            except asyncio.CancelledError:
-                # Let key expire naturally. Optionally could delete.
-                pass
-            except Exception:
-                logger.exception("heartbeat task error room=%s user=%s", room, username)
+    def _ensure_typing_task(self):
+        if not self.typing_task:
+            self.typing_task = asyncio.create_task(self._typing_loop())
+
+    async def _typing_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(self.typing_snapshot_ms / 1000)
+                try:
+                    await self._typing_tick()
+                except Exception:
+                    logger.exception("typing tick failed")
+        except asyncio.CancelledError:
+            pass
 
-        task = asyncio.create_task(beat())
-        self.heartbeat_tasks[key] = task
+    async def _typing_tick(self):
+        for room, username, local in self.typing.expire():
+            self._typing_changed(room, username, False)
+            if local:
+                # Other nodes would time it out too, but an explicit stop clears it right away
+                await self.publish(room, OutTypingMessage(room=room, user=username, isTyping=False).model_dump())
+        dirty, self.typing_dirty = self.typing_dirty, set()
+        for room in dirty:
+            self.typing.stats.snapshots += 1
+            snapshot = OutTypingState(room=room, users=self.typing.users(room)).model_dump()
+            self.broadcast_local(room, snapshot, priority=Priority.LOW)
 
-    async def _stop_heartbeat(self, room: str, ws: WebSocket):
+    # ---------------- Heartbeat Management -----------------
+    def _start_heartbeat(self, room: str, ws: WebSocket, username: str):
         key = (ws, room)
-        task = self.heartbeat_tasks.pop(key, None)
-        if task:
-            task.cancel()
-            try:
-                await task
-            except (Exception, asyncio.CancelledError):
-                pass
-        # Proactively delete the heartbeat key so presence updates immediately instead of
-        # waiting for TTL expiry (otherwise users appear to "linger" in a room after switching).
-        try:
-            username = self.ws_username.get(ws)
-            conn_id = self.ws_conn_id.get(ws)
-            if username and conn_id:
-                hb_key = self._heartbeat_key(room, username, conn_id)
-                await self.redis.delete(hb_key)
-        except Exception:
-            logger.debug("failed to delete heartbeat key on stop", exc_info=True)
+        if key in self.heartbeat_entries:
+            return
+        entry = (room, member_id(username, self.ws_conn_id[ws]))
+        self.heartbeat_entries[key] = entry
+        self.heartbeats.add(entry)
+        self.heartbeats.start()
+
+    def _stop_heartbeat(self, room: str, ws: WebSocket):
+        entry = self.heartbeat_entries.pop((ws, room), None)
+        if entry:
+            self.heartbeats.remove(entry)
 
 
-def get_manager(app, redis_client: Redis) -> ConnectionManager:
+def _priority_for(payload: dict[str, Any]) -> Priority:
+    # Typing indicators are ephemeral and superseded by the next one; everything else must arrive.
+    return Priority.LOW if payload.get("type") in ("typing", "typing_state") else Priority.HIGH
+
+
+def _negotiate_batch_ms(requested: str | None) -> int:
+    try:
+        batch_ms = int(requested or 0)
+    except ValueError:
+        return 0
+    return max(0, min(batch_ms, settings.ws_batch_max_ms))
+
+
+def get_manager(
+    app, redis_client: Redis, sessions: async_sessionmaker[AsyncSession] | None = None
+) -> ConnectionManager:
+    # One per process; ``sessions`` (the resolved SessionFactory) is what its chat writer writes with
     mgr = getattr(app.state, "ws_manager", None)
     if mgr is None:
-        mgr = ConnectionManager(redis_client)
+        mgr = ConnectionManager(redis_client, sessions)
         app.state.ws_manager = mgr
     return mgr
 
 
-async def ensure_room_and_membership(db: AsyncSession, room: str, user: UserORM) -> RoomORM:
-    result = await db.execute(select(RoomORM).where(RoomORM.name == room))
-    room_obj = result.scalars().first()
+async def get_connection_manager(
+    conn: HTTPConnection, redis_client: RedisClient, sessions: SessionFactory
+) -> ConnectionManager:
+    return get_manager(conn.app, redis_client, sessions)
+
+
+Manager = Annotated[ConnectionManager, Depends(get_connection_manager)]
+
+
+async def get_room_cache(manager: Manager) -> RoomCache:
+    return manager.room_cache
+
+
+Rooms = Annotated[RoomCache, Depends(get_room_cache)]
+
+
+async def ensure_room_and_membership(db: AsyncSession, rooms: RoomCache, room: str, user: UserORM) -> CachedRoom:
+    room_obj = await rooms.get_by_name(db, room)
     if not room_obj:
         raise ValueError("room not found")
     # Private rooms require existing membership
@@ -281,206 +493,236 @@ async def ensure_room_and_membership(db: AsyncSession, room: str, user: UserORM)
         .first()
     )
     if not member:
-        db.add(RoomMemberORM(room_id=room_obj.id, user_id=user.id))
+        member = RoomMemberORM(room_id=room_obj.id, user_id=user.id)
+        db.add(member)
+        await room_counters.add_members(db, room_obj.id, 1)
         await db.commit()
     return room_obj
 
 
+async def _reject(ws: WebSocket, subprotocol: str | None, code: int, message: str) -> None:
+    """Complete the handshake only to say why: browsers can't see the status of a refused upgrade."""
+    retry_after = admission.retry_after()
+    await ws.accept(subprotocol=subprotocol)
+    await ws.send_json({"type": "error", "message": message, "retryAfter": retry_after})
+    await ws.close(code=code, reason=f"retry after {retry_after}s")
+
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     ws: WebSocket,
     redis_client: RedisClient,
-    db: DBSession,
+    sessions: SessionFactory,
 ):
-    await ws.accept()
+    # No session is held for the socket's lifetime: each DB operation below opens its own and returns
+    # the connection to the pool right after, so idle sockets hold none. (A session only checks out a
+    # connection on its first query; lookups answered by the room cache don't touch the pool at all.)
+    subprotocol = wire.negotiate(ws.scope.get("subprotocols", []), settings.ws_msgpack_enabled)
+    # Admission and authentication happen before the handshake is accepted (see api/admission.py)
+    if not admission.open():
+        await _reject(ws, subprotocol, CLOSE_TRY_AGAIN_LATER, "server busy")
+        return
     try:
-        user = await get_current_user(ws.query_params.get("access_token", ""), db)
+        async with sessions() as db:
+            user = await get_current_user(ws.query_params.get("access_token", ""), db)
     except Exception as e:
         logger.error("user auth failed", exc_info=e)
-        await ws.close(code=4400)
-        return
+        user = None
     if not user or user.disabled:
-        await ws.send_json({"type": "error", "message": "unauthorized"})
+        admission.close()
+        # Closing before accept answers the upgrade request with HTTP 403
         await ws.close(code=4400)
         return
-    manager = get_manager(ws.app, redis_client)
-    await ws.send_json(
-        {
-            "type": "system",
-            "message": f"connected as {user.username}",
-            # Provide heartbeat interval hint (seconds) so client can adapt its ping schedule
-            "heartbeatInterval": HEARTBEAT_INTERVAL,
-            "presenceMode": "heartbeat",
-        }
-    )
-    logger.debug("ws connected user=%s token_ok=1", user.username)
+    if not admission.add_user(user.username):
+        admission.close()
+        await _reject(ws, subprotocol, CLOSE_TOO_MANY_CONNECTIONS, "too many connections")
+        return
     try:
+        await ws.accept(subprotocol=subprotocol)
+    except Exception:
+        admission.close(user.username)
+        raise
+    # From here on the slot and everything get_manager / connect set up are released in the finally below
+    manager: ConnectionManager | None = None
+    try:
+        manager = get_manager(ws.app, redis_client, sessions)
+        batch_ms = _negotiate_batch_ms(ws.query_params.get("batch_ms"))
+        manager.connect(ws, batch_ms=batch_ms, binary=subprotocol == wire.MSGPACK_SUBPROTOCOL)
+        manager.send(
+            ws,
+            {
+                "type": "system",
+                "message": f"connected as {user.username}",
+                # Provide heartbeat interval hint (seconds) so client can adapt its ping schedule
+                "heartbeatInterval": HEARTBEAT_INTERVAL,
+                "presenceMode": "heartbeat",
+                # Batch window actually granted (0: events are sent one per frame)
+                "batchMs": batch_ms,
+            },
+        )
+        logger.debug("ws connected user=%s token_ok=1", user.username)
         while True:
-            raw = await ws.receive_text()
-            try:
-                msg = json.loads(raw)
-            except Exception:
-                await ws.send_json({"type": "error", "message": "invalid json"})
+            incoming = await ws.receive()
+            if incoming["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(incoming.get("code", 1000), incoming.get("reason"))
+            if incoming.get("bytes") is not None:
+                # Binary frame: MessagePack envelope
+                try:
+                    msg = wire.decode_envelope(incoming["bytes"])
+                except ValueError:
+                    manager.send(ws, {"type": "error", "message": "invalid envelope"})
+                    continue
+            else:
+                try:
+                    msg = serialization.loads(incoming.get("text") or "")
+                except serialization.JSONDecodeError:
+                    manager.send(ws, {"type": "error", "message": "invalid json"})
+                    continue
+            if not isinstance(msg, dict):
+                manager.send(ws, {"type": "error", "message": "invalid message"})
                 continue
             mtype = msg.get("type")
-            logger.debug("ws msg type=%s user=%s raw=%s", mtype, user.username, raw[:500])
+            logger.debug("ws msg type=%s user=%s msg=%s", mtype, user.username, str(msg)[:500])
             if mtype == "join":
                 room = msg.get("room")
                 if not isinstance(room, str):
-                    await ws.send_json({"type": "error", "message": "room required"})
+                    manager.send(ws, {"type": "error", "message": "room required"})
+                    continue
+                if not manager.in_room(ws, room) and not admission.can_join(len(manager.conn_rooms.get(ws, ()))):
+                    manager.send(ws, {"type": "error", "message": "too many rooms", "limit": admission.max_rooms})
                     continue
                 try:
-                    room_obj = await ensure_room_and_membership(db, room, user)
+                    async with sessions() as db:
+                        room_obj = await ensure_room_and_membership(db, manager.room_cache, room, user)
                 except ValueError:
-                    await ws.send_json({"type": "error", "message": "room not found"})
+                    manager.send(ws, {"type": "error", "message": "room not found"})
                     continue
                 except PermissionError:
-                    await ws.send_json({"type": "error", "message": "room is private"})
+                    manager.send(ws, {"type": "error", "message": "room is private"})
                     continue
                 first_global = await manager.join(room, ws, user.username)
+                # Refresh the flags the chat path checks only now: a ban published before this node
+                # subscribed to the room is in the row, and any later one arrives as a member_update
+                async with sessions() as db:
+                    await manager.room_cache.load_member(db, room_obj.id, user.id)
+                # Reconnecting client: only the events after the last stream id it saw, if still retained
+                since = msg.get("since")
+                replayed = await manager.replay(room, since) if isinstance(since, str) else None
                 # explicit join ack for frontend
-                await ws.send_json({"type": "joined", "room": room})
-                # Send full presence state
-                # Gather users from heartbeat keys
-                pattern = f"{HEARTBEAT_KEY_PREFIX}{room}:*"
-                cursor = 0
-                user_set: set[str] = set()
-                while True:
-                    cursor, keys = await redis_client.scan(cursor=cursor, match=pattern, count=100)
-                    for k in keys:
-                        parts = k.split(":")
-                        if len(parts) >= 5:
-                            user_set.add(parts[3])
-                    if cursor == 0:
-                        break
-                users_list = sorted(user_set)
-                await ws.send_json(OutPresenceState(room=room, users=users_list).model_dump(mode="json"))
-                # Fetch recent message history (most recent first, then reverse to chronological)
-                history_stmt = (
-                    select(MessageORM, UserORM.username)
-                    .join(UserORM, MessageORM.user_id == UserORM.id, isouter=True)
-                    .where(MessageORM.room_id == room_obj.id)
-                    .order_by(desc(MessageORM.created_at))
-                    .limit(HISTORY_LIMIT)
-                )
-                hist_result = await db.execute(history_stmt)
-                rows = hist_result.all()
-                if rows:
-                    initial_messages = []
-                    for msg_row, uname in reversed(rows):  # chronological
-                        initial_messages.append(
-                            OutChatMessage(
-                                room=room,
-                                user=uname or "",  # empty if user deleted
-                                message=msg_row.content,
-                                message_id=msg_row.id,
-                                ts=msg_row.created_at,
-                            ).model_dump(mode="json")
+                manager.send(ws, {"type": "joined", "room": room, "resumed": replayed is not None})
+                # Send full presence state (single range read over the room's presence index)
+                users_list = await manager.presence.users(room)
+                manager.send(ws, OutPresenceState(room=room, users=users_list).model_dump())
+                if replayed is not None:
+                    for frame in replayed:
+                        manager.send(ws, frame)
+                else:
+                    history_frame = manager.history.recent_frame(room)
+                    if history_frame is None:
+                        # Fetch recent message history (most recent first, then reverse to chronological)
+                        manager.history.begin_fill(room)
+                        history_stmt = (
+                            select(MessageORM, UserORM.username)
+                            .join(UserORM, MessageORM.user_id == UserORM.id, isouter=True)
+                            .where(MessageORM.room_id == room_obj.id)
+                            .order_by(desc(MessageORM.id))
+                            .limit(max(HISTORY_LIMIT, manager.history.size))
+                        )
+                        async with sessions() as db:
+                            rows = (await db.execute(history_stmt)).all()
+                        initial_messages = []
+                        for msg_row, uname in reversed(rows):  # chronological
+                            initial_messages.append(
+                                OutChatMessage(
+                                    room=room,
+                                    user=uname or "",  # empty if user deleted
+                                    message=msg_row.content,
+                                    message_id=msg_row.id,
+                                    ts=msg_row.created_at,
+                                ).model_dump()
+                            )
+                        manager.history.fill(room, initial_messages, active=manager.in_room(ws, room))
+                        history_frame = Frame(
+                            {"type": "history", "room": room, "messages": initial_messages[-HISTORY_LIMIT:]}
                         )
-                    await ws.send_json({"type": "history", "room": room, "messages": initial_messages})
+                    if history_frame.obj["messages"]:
+                        manager.send(ws, history_frame)
                 # Broadcast presence diff if first global appearance
                 if first_global:
-                    diff_payload = OutPresenceDiff(room=room, join=[user.username]).model_dump(mode="json")
-                    # Immediately deliver presence_diff + system line to local peers (excluding the joining socket)
-                    for peer in list(manager.rooms.get(room, [])):
-                        if peer is ws:
-                            continue  # joining client already handles its own joined + presence_state
-                        try:
-                            await peer.send_json(diff_payload)
-                        except Exception:
-                            logger.debug("presence diff local send failure", exc_info=True)
-                    await manager.publish(room, diff_payload)
-                    sys_payload = OutSystemMessage(room=room, message=f"{user.username} joined").model_dump(mode="json")
-                    for peer in list(manager.rooms.get(room, [])):
-                        if peer is ws:
-                            continue
-                        try:
-                            await peer.send_json(sys_payload)
-                        except Exception:
-                            logger.debug("system join local send failure", exc_info=True)
-                    await manager.publish(room, sys_payload)
+                    diff_payload = OutPresenceDiff(room=room, join=[user.username]).model_dump()
+                    # Immediately deliver presence_diff + system line to local peers (excluding the joining socket,
+                    # which already handles its own joined + presence_state)
+                    await manager.broadcast(room, diff_payload, exclude=ws)
+                    sys_payload = OutSystemMessage(room=room, message=f"{user.username} joined").model_dump()
+                    await manager.broadcast(room, sys_payload, exclude=ws)
             elif mtype == "leave":
                 room = msg.get("room")
                 if isinstance(room, str) and manager.in_room(ws, room):
                     removed, uname = await manager.leave(room, ws)
                     if removed and uname:
-                        diff_payload = OutPresenceDiff(room=room, leave=[uname]).model_dump(mode="json")
+                        diff_payload = OutPresenceDiff(room=room, leave=[uname]).model_dump()
                         # Broadcast locally first so connected peers update immediately, then publish for others.
-                        for peer in list(manager.rooms.get(room, [])):
-                            try:
-                                await peer.send_json(diff_payload)
-                            except Exception:
-                                logger.debug("presence diff (leave) local send failure", exc_info=True)
-                        await manager.publish(room, diff_payload)
-                        sys_payload = OutSystemMessage(room=room, message=f"{uname} left").model_dump(mode="json")
-                        for peer in list(manager.rooms.get(room, [])):
-                            try:
-                                await peer.send_json(sys_payload)
-                            except Exception:
-                                logger.debug("system leave local send failure", exc_info=True)
-                        await manager.publish(room, sys_payload)
+                        await manager.broadcast(room, diff_payload)
+                        sys_payload = OutSystemMessage(room=room, message=f"{uname} left").model_dump()
+                        await manager.broadcast(room, sys_payload)
             elif mtype == "chat":
                 room = msg.get("room")
                 content = msg.get("message")
                 if not (isinstance(room, str) and isinstance(content, str) and manager.in_room(ws, room)):
-                    await ws.send_json({"type": "error", "message": "invalid chat"})
+                    manager.send(ws, {"type": "error", "message": "invalid chat"})
                     continue
-                result = await db.execute(select(RoomORM).where(RoomORM.name == room))
-                chat_room_obj = result.scalars().first()
+                if "\x00" in content:
+                    # Postgres text can't hold NUL; refuse it here rather than fail the batch it lands in
+                    manager.send(ws, {"type": "error", "message": "invalid chat"})
+                    continue
+                async with sessions() as db:
+                    chat_room_obj = await manager.room_cache.get_by_name(db, room)
+                    member = None
+                    if chat_room_obj:
+                        # Enforce membership + ban/mute status (cached; kept current by member_update events)
+                        member = await manager.room_cache.get_member(db, chat_room_obj.id, user.id)
                 if not chat_room_obj:
-                    await ws.send_json({"type": "error", "message": "room missing"})
+                    manager.send(ws, {"type": "error", "message": "room missing"})
                     continue
-                # Enforce membership + ban/mute status
-                member_stmt = select(RoomMemberORM).where(
-                    RoomMemberORM.room_id == chat_room_obj.id,
-                    RoomMemberORM.user_id == user.id,
-                )
-                member = (await db.execute(member_stmt)).scalars().first()
                 if not member:
-                    await ws.send_json({"type": "error", "message": "not a member"})
+                    manager.send(ws, {"type": "error", "message": "not a member"})
                     continue
                 if member.is_banned:
-                    await ws.send_json({"type": "error", "message": "banned"})
+                    manager.send(ws, {"type": "error", "message": "banned"})
                     continue
                 if member.is_muted:
-                    await ws.send_json({"type": "error", "message": "muted"})
+                    manager.send(ws, {"type": "error", "message": "muted"})
                     continue
-                message_obj = MessageORM(room_id=chat_room_obj.id, user_id=user.id, content=content)
-                db.add(message_obj)
-                await db.flush()
-                await db.commit()
-                out = OutChatMessage(room=room, user=user.username, message=content, message_id=message_obj.id)
-                payload = out.model_dump(mode="json")
-                for peer in list(manager.rooms.get(room, [])):
-                    try:
-                        await peer.send_json(payload)
-                    except Exception:
-                        logger.debug("send failure", exc_info=True)
-                await manager.publish(room, payload)
+                # Written with the next batch; fanned out (the sender's ack included) once it is committed
+                pending = PendingMessage(room, chat_room_obj.id, user.id, user.username, content, origin=ws)
+                if not manager.chat_writer.submit(pending):
+                    manager.send(ws, {"type": "error", "message": "server busy"})
             elif mtype == "history_more":
                 room = msg.get("room")
                 before_id = msg.get("before_id")
                 if not (isinstance(room, str) and isinstance(before_id, int) and manager.in_room(ws, room)):
-                    await ws.send_json({"type": "error", "message": "invalid history_more"})
+                    manager.send(ws, {"type": "error", "message": "invalid history_more"})
                     continue
-                # Fetch room id
-                result = await db.execute(select(RoomORM).where(RoomORM.name == room))
-                history_room_obj = result.scalars().first()
+                async with sessions() as db:
+                    history_room_obj = await manager.room_cache.get_by_name(db, room)
                 if not history_room_obj:
-                    await ws.send_json({"type": "error", "message": "room missing"})
+                    manager.send(ws, {"type": "error", "message": "room missing"})
                     continue
-                # Older messages have id < before_id
-                history_stmt = (
-                    select(MessageORM, UserORM.username)
-                    .join(UserORM, MessageORM.user_id == UserORM.id, isouter=True)
-                    .where(MessageORM.room_id == history_room_obj.id, MessageORM.id < before_id)
-                    .order_by(desc(MessageORM.created_at))
-                    .limit(HISTORY_LIMIT)
-                )
-                hist_result = await db.execute(history_stmt)
-                rows = hist_result.all()
-                older_messages: list[dict[str, Any]] = []
-                if rows:
+                cached_page = manager.history.older(room, before_id)
+                if cached_page is not None:
+                    older_messages, more = cached_page
+                else:
+                    # Older messages have id < before_id
+                    history_stmt = (
+                        select(MessageORM, UserORM.username)
+                        .join(UserORM, MessageORM.user_id == UserORM.id, isouter=True)
+                        .where(MessageORM.room_id == history_room_obj.id, MessageORM.id < before_id)
+                        .order_by(desc(MessageORM.id))
+                        .limit(HISTORY_LIMIT)
+                    )
+                    async with sessions() as db:
+                        rows = (await db.execute(history_stmt)).all()
+                    older_messages = []
                     for msg_row, uname in reversed(rows):  # reverse back to chronological (oldest first)
                         older_messages.append(
                             OutChatMessage(
@@ -489,32 +731,26 @@ async def websocket_endpoint(
                                 message=msg_row.content,
                                 message_id=msg_row.id,
                                 ts=msg_row.created_at,
-                            ).model_dump(mode="json")
+                            ).model_dump()
                         )
-                more = len(rows) == HISTORY_LIMIT
-                await ws.send_json({"type": "history_more", "room": room, "messages": older_messages, "more": more})
+                    more = len(rows) == HISTORY_LIMIT
+                manager.send(ws, {"type": "history_more", "room": room, "messages": older_messages, "more": more})
             elif mtype == "typing":
                 room = msg.get("room")
                 is_typing = bool(msg.get("isTyping"))
                 if not (isinstance(room, str) and manager.in_room(ws, room)):
-                    await ws.send_json({"type": "error", "message": "invalid typing"})
+                    manager.send(ws, {"type": "error", "message": "invalid typing"})
                     continue
-                typing_payload = OutTypingMessage(room=room, user=user.username, isTyping=is_typing).model_dump(
-                    mode="json"
-                )
-                # Broadcast to local sockets (sender & peers) immediately; Redis pubsub skips same server messages
-                for peer in list(manager.rooms.get(room, [])):
-                    try:
-                        await peer.send_json(typing_payload)
-                    except Exception:
-                        logger.debug("typing send failure", exc_info=True)
-                await manager.publish(room, typing_payload)
+                # Repeated keystrokes only push the expiry; peers (and the sender) see start/stop transitions
+                await manager.set_typing(room, user.username, is_typing)
             elif mtype == "ping":
-                await ws.send_json({"type": "pong", "ts": time.time()})
+                manager.send(ws, {"type": "pong", "ts": time.time()})
             else:
-                await ws.send_json({"type": "error", "message": "unknown type"})
+                manager.send(ws, {"type": "error", "message": "unknown type"})
     except WebSocketDisconnect:
         logger.debug("ws disconnect user=%s", getattr(user, "username", "?"))
     finally:
-        await manager.leave_all(ws)
+        admission.close(user.username)
+        if manager is not None:
+            await manager.leave_all(ws)
         logger.debug("ws cleanup done user=%s", getattr(user, "username", "?"))
@@ -0,0 +1,70 @@
+"""
+Deletes expired and revoked ``refresh_tokens`` rows in bounded batches.
+
+Every login and every refresh adds a row and nothing used to remove them, so the table and
+its indexes grew without bound. :func:`purge_refresh_tokens` deletes dead rows ``batch`` at
+a time, committing after each batch so no transaction holds many row locks or a long
+snapshot. :func:`purge_forever` runs it periodically on one node at a time (a Redis lock),
+or run it once with ``python -m fast_room_api.api.token_purge``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import UTC, datetime
+
+from redis.asyncio import Redis
+from sqlalchemy import delete, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from fast_room_api.models.db import RefreshTokenORM
+
+logger = logging.getLogger("fast_room_api.token_purge")
+
+PURGE_LOCK = "lock:refresh-token-purge"
+
+
+async def purge_refresh_tokens(session_factory: async_sessionmaker[AsyncSession], batch: int = 1000) -> int:
+    """Delete refresh tokens that are expired or revoked; returns how many rows went."""
+    deleted = 0
+    while True:
+        dead = (
+            select(RefreshTokenORM.id)
+            .where(or_(RefreshTokenORM.revoked.is_(True), RefreshTokenORM.expires_at <= datetime.now(UTC)))
+            .limit(batch)
+        )
+        async with session_factory() as session:
+            result = await session.execute(
+                delete(RefreshTokenORM)
+                .where(RefreshTokenORM.id.in_(dead.scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        deleted += result.rowcount  # type: ignore[attr-defined]
+        if result.rowcount < batch:  # type: ignore[attr-defined]
+            break
+    if deleted:
+        logger.info("purged refresh tokens rows=%s", deleted)
+    return deleted
+
+
+async def purge_forever(
+    redis: Redis, session_factory: async_sessionmaker[AsyncSession], interval_s: float, batch: int
+) -> None:
+    """Run :func:`purge_refresh_tokens` every ``interval_s`` on whichever node takes the lock first."""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            if await redis.set(PURGE_LOCK, "1", nx=True, ex=max(1, int(interval_s * 0.9))):
+                await purge_refresh_tokens(session_factory, batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("refresh token purge failed")
+
+
+if __name__ == "__main__":
+    from fast_room_api.models.db import SessionLocal
+
+    print(f"deleted {asyncio.run(purge_refresh_tokens(SessionLocal))} refresh tokens")
@@ -0,0 +1,101 @@
+"""
+Typing indicator state.
+
+Clients send ``typing`` on every keystroke. The :class:`TypingTracker` keeps who is
+typing in each room with an expiry, so only start/stop transitions reach sockets and
+other nodes. While a user keeps typing, their node republishes a keepalive every
+``ttl / 2`` so remote nodes' copies of the state don't expire; a node that dies simply
+stops sending them and its users' indicators time out everywhere.
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class TypingStats:
+    received: int = 0  # typing events observed (local keystrokes and remote events)
+    transitions: int = 0
+    suppressed: int = 0  # repeats that only pushed the expiry
+    keepalives: int = 0  # repeats republished so other nodes keep the state alive
+    expired: int = 0
+    snapshots: int = 0
+
+    def as_dict(self) -> dict[str, int]:
+        return asdict(self)
+
+
+class TypingTracker:
+    def __init__(self, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.keepalive = ttl / 2
+        self.clock = clock
+        # room -> username -> expires_at
+        self._rooms: dict[str, dict[str, float]] = {}
+        # (room, username) typing on this node -> when it was last published
+        self._published: dict[tuple[str, str], float] = {}
+        self.stats = TypingStats()
+
+    def __len__(self) -> int:
+        return sum(len(typing) for typing in self._rooms.values())
+
+    def users(self, room: str) -> list[str]:
+        return sorted(self._rooms.get(room, ()))
+
+    def observe(self, room: str, username: str, is_typing: bool) -> bool:
+        """Record a typing event; True if it changed whether ``username`` is typing in ``room``."""
+        self.stats.received += 1
+        typing = self._rooms.setdefault(room, {})
+        was_typing = username in typing
+        if is_typing:
+            typing[username] = self.clock() + self.ttl
+        else:
+            typing.pop(username, None)
+        if not typing:
+            del self._rooms[room]
+        if was_typing == is_typing:
+            self.stats.suppressed += 1
+            return False
+        self.stats.transitions += 1
+        return True
+
+    def should_publish(self, room: str, username: str, is_typing: bool, changed: bool) -> bool:
+        """Whether a local user's event goes to other nodes: transitions always, repeats only as a keepalive."""
+        key = (room, username)
+        if not is_typing:
+            self._published.pop(key, None)
+            return changed
+        now = self.clock()
+        if changed or now - self._published.get(key, 0.0) >= self.keepalive:
+            if not changed:
+                self.stats.keepalives += 1
+            self._published[key] = now
+            return True
+        return False
+
+    def discard(self, room: str, username: str) -> bool:
+        """Forget ``username`` in ``room`` (they left); True if they were typing."""
+        self._published.pop((room, username), None)
+        typing = self._rooms.get(room)
+        if not typing or typing.pop(username, None) is None:
+            return False
+        if not typing:
+            del self._rooms[room]
+        return True
+
+    def expire(self) -> list[tuple[str, str, bool]]:
+        """Drop expired entries; returns ``(room, username, local)`` for each, ``local`` if typed on this node."""
+        now = self.clock()
+        expired = []
+        for room, typing in list(self._rooms.items()):
+            for username, expires_at in list(typing.items()):
+                if expires_at <= now:
+                    del typing[username]
+                    expired.append((room, username, self._published.pop((room, username), None) is not None))
+            if not typing:
+                del self._rooms[room]
+        self.stats.expired += len(expired)
+        return expired
@@ -0,0 +1,59 @@
+"""
+WebSocket wire formats.
+
+JSON text frames are the default. A client that offers the ``fastroom.msgpack.v1``
+subprotocol (``Sec-WebSocket-Protocol``) exchanges binary MessagePack frames instead,
+each carrying one :class:`~fast_room_api.models.ws.Envelope`: the event's ``type`` and
+``room`` become ``type`` / ``topic`` and the remaining fields go in ``payload``.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import Any
+
+from fast_room_api import serialization
+from fast_room_api.models.ws import Envelope
+
+JSON_SUBPROTOCOL = "fastroom.json"
+MSGPACK_SUBPROTOCOL = "fastroom.msgpack.v1"
+ENVELOPE_VERSION = 1
+
+
+def negotiate(offered: Sequence[str], msgpack_enabled: bool = True) -> str | None:
+    """Subprotocol to accept from the client's offer; None keeps plain JSON without echoing one."""
+    if MSGPACK_SUBPROTOCOL in offered and msgpack_enabled and serialization.msgpack_available():
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in offered:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def to_envelope(event: dict[str, Any]) -> dict[str, Any]:
+    payload = {k: v for k, v in event.items() if k not in ("type", "room")}
+    envelope: dict[str, Any] = {"version": ENVELOPE_VERSION, "type": event.get("type", "")}
+    if "room" in event:
+        envelope["topic"] = event["room"]
+    envelope["payload"] = payload
+    return envelope
+
+
+def from_envelope(envelope: Envelope) -> dict[str, Any]:
+    event = dict(envelope.payload or {})
+    event["type"] = envelope.type
+    if envelope.topic is not None:
+        event["room"] = envelope.topic
+    return event
+
+
+def encode_envelope(event: dict[str, Any]) -> bytes:
+    return serialization.packb(to_envelope(event))
+
+
+def decode_envelope(data: bytes) -> dict[str, Any]:
+    """Inbound binary frame -> the same dict a JSON client would have sent. Raises ValueError if malformed."""
+    try:
+        raw = serialization.unpackb(data)
+    except Exception as e:
+        raise ValueError("invalid msgpack frame") from e
+    return from_envelope(Envelope.model_validate(raw))
@@ -0,0 +1,115 @@
+"""
+WebSocket per-message compression with a size threshold.
+
+Run uvicorn with ``--ws fast_room_api.api.ws_compression:WebSocketProtocol`` to use it.
+``permessage-deflate`` is then negotiated according to ``WS_COMPRESSION*``. Unlike
+uvicorn's built-in option, messages smaller than ``WS_COMPRESSION_MIN_SIZE`` are sent
+uncompressed. RFC 7692 allows this per message (RSV1 unset), so a history page gets
+deflated and a typing frame does not pay for zlib. Counters are process-wide and reported
+under ``ws_compression`` in ``GET /stats``.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections.abc import Sequence
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol
+from websockets.extensions.base import Extension
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CONT, CTRL_OPCODES, Frame
+from websockets.server import ServerProtocol
+from websockets.typing import ExtensionParameter
+
+from fast_room_api.models.config import settings
+
+
+@dataclass
+class CompressionStats:
+    compressed_messages: int = 0
+    skipped_messages: int = 0  # below the size threshold
+    raw_bytes: int = 0  # payload bytes of compressed messages before deflate
+    compressed_bytes: int = 0  # ...and after
+    skipped_bytes: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        saved = self.raw_bytes - self.compressed_bytes
+        return {
+            **asdict(self),
+            "ratio": round(self.compressed_bytes / self.raw_bytes, 4) if self.raw_bytes else None,
+            "bytes_saved": saved,
+        }
+
+
+stats = CompressionStats()
+
+
+class ThresholdPerMessageDeflate(PerMessageDeflate):
+    """``permessage-deflate`` that leaves messages under ``min_size`` bytes uncompressed."""
+
+    def __init__(self, *args: Any, min_size: int = 0, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.min_size = min_size
+        self._skipping = False
+
+    def encode(self, frame: Frame) -> Frame:
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not CONT:
+            # Decided once per message, on its first frame (starlette never fragments, so that's the whole message)
+            self._skipping = frame.fin and len(frame.data) < self.min_size
+        if self._skipping:
+            stats.skipped_messages += frame.opcode is not CONT
+            stats.skipped_bytes += len(frame.data)
+            return frame
+        encoded = super().encode(frame)
+        stats.compressed_messages += frame.opcode is not CONT
+        stats.raw_bytes += len(frame.data)
+        stats.compressed_bytes += len(encoded.data)
+        return encoded
+
+
+class ThresholdDeflateFactory(ServerPerMessageDeflateFactory):
+    def __init__(self, min_size: int = 0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.min_size = min_size
+
+    def process_request_params(
+        self,
+        params: Sequence[ExtensionParameter],
+        accepted_extensions: Sequence[Extension],
+    ) -> tuple[list[ExtensionParameter], PerMessageDeflate]:
+        response, ext = super().process_request_params(params, accepted_extensions)
+        return response, ThresholdPerMessageDeflate(
+            ext.remote_no_context_takeover,
+            ext.local_no_context_takeover,
+            ext.remote_max_window_bits,
+            ext.local_max_window_bits,
+            ext.compress_settings,
+            min_size=self.min_size,
+        )
+
+
+def deflate_factory() -> ThresholdDeflateFactory:
+    return ThresholdDeflateFactory(
+        min_size=settings.ws_compression_min_size,
+        # Same window / memory trade-off as uvicorn's default deflate setup
+        server_max_window_bits=12,
+        client_max_window_bits=12,
+        compress_settings={"level": settings.ws_compression_level, "memLevel": 5},
+    )
+
+
+class WebSocketProtocol(WebSocketsSansIOProtocol):
+    """uvicorn's default (sans-I/O websockets) protocol with compression driven by settings."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # Rebuilt before any byte is received, so only the negotiated extensions differ
+        self.conn = ServerProtocol(
+            extensions=[deflate_factory()] if settings.ws_compression else [],
+            max_size=self.config.ws_max_size,
+            logger=logging.getLogger("uvicorn.error"),
+        )
@@ -4,10 +4,13 @@ Database setup and ORM models (async SQLAlchemy).
 
 from __future__ import annotations
 
+import asyncio
 from collections.abc import AsyncIterator
 from datetime import datetime
+from typing import Any
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, String, Text, func
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Index, QueuePool, String, Text, func, make_url, text
+from sqlalchemy.engine import URL
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
@@ -44,6 +47,10 @@ class RoomORM(Base):
     # Simple flags; can extend with description/topic, visibility, etc.
     is_private: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    # Denormalized counters, bumped by the write paths and corrected by api/room_counters.reconcile
+    member_count: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
+    message_count: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", nullable=False)
+    last_message_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
 
     # Relationships
     members: Mapped[list[RoomMemberORM]] = relationship(back_populates="room", cascade="all, delete-orphan")
@@ -68,9 +75,11 @@ class RoomMemberORM(Base):
 
 class MessageORM(Base):
     __tablename__ = "messages"
+    # Keyset pagination and history pages seek (room_id, id); it also serves plain room_id lookups
+    __table_args__ = (Index("ix_messages_room_id_id", "room_id", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"), index=True)
+    room_id: Mapped[int] = mapped_column(ForeignKey("rooms.id", ondelete="CASCADE"))
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True)
     content: Mapped[str] = mapped_column(Text)
     # Basic moderation / audit flags
@@ -97,7 +106,29 @@ class RefreshTokenORM(Base):
     user: Mapped[UserORM] = relationship()
 
 
-engine = create_async_engine(settings.database_url, echo=settings.debug)
+def _is_sqlite_memory(url: URL) -> bool:
+    if url.get_backend_name() != "sqlite":
+        return False
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
+def _engine_options() -> dict[str, Any]:
+    options: dict[str, Any] = {
+        "echo": settings.db_echo,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_s,
+    }
+    url = make_url(settings.database_url)
+    if not _is_sqlite_memory(url):  # in-memory SQLite gets a StaticPool, which takes no sizing
+        options["pool_size"] = settings.db_pool_size
+        options["max_overflow"] = settings.db_max_overflow
+        options["pool_timeout"] = settings.db_pool_timeout_s
+    if url.get_driver_name() == "asyncpg":
+        options["connect_args"] = {"statement_cache_size": settings.db_statement_cache_size}
+    return options
+
+
+engine = create_async_engine(settings.database_url, **_engine_options())
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 
@@ -106,6 +137,24 @@ async def get_db() -> AsyncIterator[AsyncSession]:
         yield session
 
 
+def get_session_factory() -> async_sessionmaker[AsyncSession]:
+    # For handlers that outlive a request (WebSockets): open a short session per operation instead
+    # of holding one, and with it a pooled connection, for the socket's lifetime
+    return SessionLocal
+
+
+async def warm_pool(connections: int) -> None:
+    """Open up to ``connections`` pooled connections now (they go back to the pool idle)."""
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+
+    async def _touch() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    # Concurrently, so each one checks out (and so creates) a separate connection
+    await asyncio.gather(*(_touch() for _ in range(min(connections, size))))
+
+
 async def init_db(create: bool = True) -> None:
     """Initialize database (create tables if not exist)."""
     if not create:
@@ -11,6 +11,13 @@ class Room(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class RoomSummary(Room):
+    # Read from the room row on list pages; single-room lookups come from the room cache, which has no counters
+    member_count: int
+    message_count: int
+    last_message_at: datetime | None
+
+
 class RoomCreate(BaseModel):
     name: str
     is_private: bool = False
@@ -50,8 +57,8 @@ class PresenceState(BaseModel):
 
 
 class RoomsPage(BaseModel):
-    items: list[Room]
-    total: int
+    items: list[RoomSummary]
+    total: int | None  # only with include_total
     limit: int
     offset: int
     has_more: bool
@@ -60,7 +67,7 @@ class RoomsPage(BaseModel):
 
 class RoomMembersPage(BaseModel):
     items: list[RoomMember]
-    total: int
+    total: int  # rooms.member_count
     limit: int
     offset: int
     has_more: bool
@@ -69,8 +76,9 @@ class RoomMembersPage(BaseModel):
 
 class MessagesPage(BaseModel):
     items: list[Message]
-    total: int
+    total: int  # rooms.message_count
     limit: int
     offset: int
     has_more: bool
     next_offset: int | None = None
+    next_cursor: str | None = None  # opaque; pass back as ``cursor`` for the next page in the same direction
@@ -1,5 +1,5 @@
 from datetime import UTC, datetime
-from typing import Literal
+from typing import Any, Literal
 
 from pydantic import BaseModel, Field
 
@@ -45,6 +45,15 @@ class OutTypingMessage(BaseModel):
     ts: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 
+class OutTypingState(BaseModel):
+    """Everyone currently typing in a (large) room, sent instead of individual ``typing`` events."""
+
+    type: Literal["typing_state"] = "typing_state"
+    room: str
+    users: list[str]
+    ts: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
 class OutPresenceState(BaseModel):
     type: Literal["presence_state"] = "presence_state"
     room: str
@@ -94,6 +103,7 @@ class OutMessageDeleted(BaseModel):
 class OutMemberUpdate(BaseModel):
     type: Literal["member_update"] = "member_update"
     room: str
+    room_id: int | None = None
     user_id: int
     username: str
     is_moderator: bool
@@ -102,6 +112,13 @@ class OutMemberUpdate(BaseModel):
     ts: datetime = Field(default_factory=lambda: datetime.now(UTC))
 
 
+class OutBatch(BaseModel):
+    """Events coalesced into one frame for a connection that negotiated ``batch_ms``."""
+
+    type: Literal["batch"] = "batch"
+    events: list[dict[str, Any]]
+
+
 class Envelope(BaseModel):
     version: int
     type: str
@@ -0,0 +1,70 @@
+"""
+JSON serialization for WebSocket and pub/sub traffic (orjson backed).
+
+``dumps`` returns bytes and natively handles datetimes, UUIDs, dataclasses and
+pydantic models, so payloads no longer need ``model_dump(mode="json")`` or
+``jsonable_encoder`` before being encoded.
+
+``packb`` / ``unpackb`` are the MessagePack counterparts used by the binary WebSocket
+subprotocol; they need the optional ``msgpack`` extra.
+"""
+
+from datetime import date, datetime
+from typing import Any
+from uuid import UUID
+
+import orjson
+from pydantic import BaseModel
+
+try:
+    import msgpack
+except ImportError:  # optional: binary subprotocol is simply not offered
+    msgpack = None
+
+# UTC datetimes are rendered with a trailing "Z", matching pydantic's JSON mode.
+_DUMPS_OPTIONS = orjson.OPT_UTC_Z
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, set | frozenset):
+        return list(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default, option=_DUMPS_OPTIONS)
+
+
+def loads(data: str | bytes | bytearray | memoryview) -> Any:
+    return orjson.loads(data)
+
+
+JSONDecodeError = orjson.JSONDecodeError
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def _msgpack_default(obj: Any) -> Any:
+    # Same shapes as the JSON encoding, so clients share one code path per event type
+    if isinstance(obj, datetime):
+        text = obj.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(obj, date | UUID):
+        return str(obj)
+    return _default(obj)
+
+
+def packb(obj: Any) -> bytes:
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(obj, default=_msgpack_default)
+
+
+def unpackb(data: bytes) -> Any:
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.unpackb(data)
@@ -0,0 +1,133 @@
+"""
+Production entry point: one uvicorn worker process per core, all accepting on one port.
+
+    python -m fast_room_api.serve --port 8000 --workers 4
+
+A single worker tops out at one core. This binds the listening socket once and starts
+``--workers`` processes that all accept on it. The supervisor restarts a worker that dies
+and stops them all on SIGINT / SIGTERM. Each worker gets its own ``SERVER_ID``
+(``{host id}-{index}``, stable across restarts), so fanout can tell the workers apart.
+Each worker also gets ``WS_LOCAL_FANOUT_DIR``, so same-host workers pass room events to
+one another over Unix sockets and Redis only carries them to other hosts (see
+``api/host_fanout.py``). Workers run on uvloop and httptools when those are installed
+(``uvicorn[standard]`` pulls them in), and fall back to asyncio and h11 otherwise.
+
+Nothing from the app is imported here: the per-worker environment has to be in place
+before the worker imports the settings.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import importlib.util
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+import uvicorn
+
+APP = "fast_room_api.api.main:app"
+WS_PROTOCOL = "fast_room_api.api.ws_compression:WebSocketProtocol"
+RESTART_BACKOFF_S = 1.0  # a worker that dies this soon after starting is restarted after a pause
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def worker_env(host_id: str, index: int, fanout_dir: str | None) -> dict[str, str]:
+    env = {"SERVER_ID": f"{host_id}-{index}"}
+    if fanout_dir:
+        env["WS_LOCAL_FANOUT_DIR"] = fanout_dir
+    return env
+
+
+def _config(host: str, port: int, **kwargs: Any) -> uvicorn.Config:
+    return uvicorn.Config(APP, host=host, port=port, loop=event_loop(), http=http_protocol(), ws=WS_PROTOCOL, **kwargs)
+
+
+def _run_worker(env: dict[str, str], host: str, port: int, sock: socket.socket) -> None:
+    os.environ.update(env)
+    uvicorn.Server(_config(host, port)).run(sockets=[sock])
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host-id", default=os.environ.get("SERVER_ID") or socket.gethostname())
+    parser.add_argument(
+        "--fanout-dir",
+        default=os.environ.get("WS_LOCAL_FANOUT_DIR"),
+        help="directory for the workers' fanout sockets (default: a per-port temp dir)",
+    )
+    parser.add_argument("--no-local-fanout", action="store_true", help="leave all fanout to Redis")
+    args = parser.parse_args(argv)
+
+    # Bind first: a second instance on the same port exits here, before touching the live one's fanout sockets
+    sock = _config(args.host, args.port).bind_socket()
+    fanout_dir = None
+    if not args.no_local_fanout:
+        fanout_dir = args.fanout_dir or os.path.join(tempfile.gettempdir(), f"fastroom-{args.port}")
+        os.makedirs(fanout_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(fanout_dir, "*.sock")):
+            os.unlink(stale)
+
+    ctx = multiprocessing.get_context("spawn")
+    workers: dict[int, tuple[BaseProcess, float]] = {}
+
+    def start(index: int) -> None:
+        env = worker_env(args.host_id, index, fanout_dir)
+        process = ctx.Process(target=_run_worker, args=(env, args.host, args.port, sock), name=f"worker-{index}")
+        process.start()
+        workers[index] = (process, time.monotonic())
+        logger.info("started worker %s pid=%s server_id=%s", index, process.pid, env["SERVER_ID"])
+
+    stopping = False
+
+    def stop(_signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info("loop=%s http=%s workers=%s fanout_dir=%s", event_loop(), http_protocol(), args.workers, fanout_dir)
+    for index in range(args.workers):
+        start(index)
+
+    while not stopping:
+        wait([process.sentinel for process, _ in workers.values()], timeout=0.5)
+        for index, (process, started) in list(workers.items()):
+            if process.is_alive() or stopping:
+                continue
+            logger.warning("worker %s exited code=%s; restarting", index, process.exitcode)
+            if time.monotonic() - started < RESTART_BACKOFF_S:
+                time.sleep(RESTART_BACKOFF_S)
+            start(index)
+
+    for process, _ in workers.values():
+        process.terminate()  # SIGTERM: uvicorn drains and closes its connections
+    for process, _ in workers.values():
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,8 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine as _create_async_engine
 
 from fast_room_api.api import dependencies as deps
+from fast_room_api.api import presence as presence_index
+from fast_room_api.api.auth_cache import auth_cache
 from fast_room_api.api.main import app as real_app
 from fast_room_api.models import db as models_db
 from fast_room_api.models.db import Base, UserORM
@@ -82,7 +84,7 @@ class _FakePubSub:
     def __init__(self, parent: FakeRedis) -> None:
         self.parent = parent
         self._subscribed: set[str] = set()
-        self._queue: asyncio.Queue[dict[str, Any]] = asyncio.Queue()
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue()
         self._listening = True
 
     async def subscribe(self, *channels: str) -> None:
@@ -94,40 +96,100 @@ class _FakePubSub:
             self._subscribed.discard(ch)
 
     async def listen(self):  # async generator
+        # Plain get() rather than wait_for(): on 3.11 a cancel racing the timeout can be swallowed,
+        # leaving the reader task impossible to cancel at loop teardown.
         while self._listening:
-            try:
-                msg = await asyncio.wait_for(self._queue.get(), timeout=0.05)
-                yield {"type": "message", "data": msg}
-            except TimeoutError:
-                if not self._subscribed:  # idle and nothing subscribed
-                    await asyncio.sleep(0.01)
-
-    async def push(self, channel: str, data: dict[str, Any] | str) -> None:
+            msg = await self._queue.get()
+            if msg is None:  # close() sentinel
+                break
+            yield {"type": "message", "data": msg}
+
+    async def push(self, channel: str, data: str | bytes) -> None:
         if channel in self._subscribed:
-            if isinstance(data, str):
-                import json as _json
-
-                try:
-                    parsed = _json.loads(data)
-                except Exception:
-                    parsed = {"raw": data}
-                if isinstance(parsed, dict):
-                    await self._queue.put(parsed)
-                else:
-                    await self._queue.put({"data": parsed})
-            else:
-                await self._queue.put(data)
-
-    async def close(self):
+            # Mirror redis-py with decode_responses=True: subscribers always receive str
+            await self._queue.put(data.decode() if isinstance(data, bytes) else data)
+
+    async def aclose(self):
         self._listening = False
+        self._queue.put_nowait(None)
+
+
+class _FakePipeline:
+    def __init__(self, parent: FakeRedis) -> None:
+        self.parent = parent
+        self._commands: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def __getattr__(self, name: str):
+        def _queue(*args: Any, **kwargs: Any) -> _FakePipeline:
+            self._commands.append((name, args, kwargs))
+            return self
+
+        return _queue
+
+    async def execute(self) -> list[Any]:
+        results = [await getattr(self.parent, name)(*args, **kwargs) for name, args, kwargs in self._commands]
+        self._commands.clear()
+        return results
+
+
+def _fake_presence_prune(r: FakeRedis, zkey: str, hkey: str, now: Any, limit: Any) -> None:
+    zset = r._zsets.setdefault(zkey, {})
+    for m in [m for m, score in zset.items() if score <= now][: int(limit)]:
+        del zset[m]
+        uname = m.rsplit(":", 1)[0]
+        if r._hincr(hkey, uname, -1) <= 0:
+            r._hashes[hkey].pop(uname, None)
+
+
+def _fake_presence_join(r: FakeRedis, keys: list[str], args: list[Any]) -> int:
+    zkey, hkey = keys
+    now, limit, expiry, username, member, key_ttl = args
+    _fake_presence_prune(r, zkey, hkey, now, limit)
+    zset = r._zsets[zkey]
+    added = member not in zset
+    zset[member] = float(expiry)
+    first = int(added and r._hincr(hkey, username, 1) == 1)
+    r._ttls[zkey] = r._ttls[hkey] = int(key_ttl)
+    return first
+
+
+def _fake_presence_leave(r: FakeRedis, keys: list[str], args: list[Any]) -> int:
+    zkey, hkey = keys
+    now, limit, username, member = args
+    _fake_presence_prune(r, zkey, hkey, now, limit)
+    if r._zsets.get(zkey, {}).pop(member, None) is not None:
+        if r._hincr(hkey, username, -1) <= 0:
+            r._hashes[hkey].pop(username, None)
+    return int(username not in r._hashes.get(hkey, {}))
+
+
+# Python stand-ins for the Lua scripts registered by the code under test
+_FAKE_SCRIPTS: dict[str, Callable[[FakeRedis, list[str], list[Any]], Any]] = {
+    presence_index.JOIN_SCRIPT: _fake_presence_join,
+    presence_index.LEAVE_SCRIPT: _fake_presence_leave,
+}
+
+
+class _FakeScript:
+    def __init__(self, parent: FakeRedis, fn: Callable[[FakeRedis, list[str], list[Any]], Any]) -> None:
+        self.parent = parent
+        self.fn = fn
+
+    async def __call__(self, keys: list[str] | None = None, args: list[Any] | None = None, client: Any = None):
+        return self.fn(self.parent, list(keys or []), list(args or []))
 
 
 class FakeRedis:
     def __init__(self) -> None:
         self._data: dict[str, str] = {}
         self._hashes: dict[str, dict[str, str]] = {}
-        self._pubsub = _FakePubSub(self)
-        self._published: list[tuple[str, str]] = []  # (channel, payload)
+        self._zsets: dict[str, dict[str, float]] = {}
+        self._ttls: dict[str, int] = {}  # key -> last PEXPIRE (ms)
+        self._pubsub = _FakePubSub(self)  # the first pubsub() handed out (fanout)
+        self._pubsubs: list[_FakePubSub] = []
+        self._published: list[tuple[str, str | bytes]] = []  # (channel, payload)
+        self._streams: dict[str, list[tuple[str, dict[str, str]]]] = {}
+        self._stream_seq = 0
 
     # Presence / heartbeat related
     async def psetex(self, key: str, ttl_ms: int, value: str) -> None:
@@ -136,6 +198,10 @@ class FakeRedis:
     async def delete(self, key: str) -> None:
         self._data.pop(key, None)
 
+    async def pexpire(self, key: str, ttl_ms: int) -> bool:
+        self._ttls[key] = int(ttl_ms)
+        return True
+
     async def scan(self, cursor: int, match: str, count: int = 50):
         # naive pattern: match must be prefix*
         prefix = match[:-1] if match.endswith("*") else match
@@ -145,13 +211,94 @@ class FakeRedis:
     async def hgetall(self, key: str) -> dict[str, str]:
         return self._hashes.get(key, {})
 
+    def _hincr(self, key: str, field: str, amount: int) -> int:
+        h = self._hashes.setdefault(key, {})
+        h[field] = str(int(h.get(field, "0")) + amount)
+        return int(h[field])
+
+    async def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        return self._hincr(key, field, amount)
+
+    # Sorted sets
+    async def zadd(self, key: str, mapping: dict[str, float], xx: bool = False) -> int:
+        zset = self._zsets.setdefault(key, {})
+        added = 0
+        for member, score in mapping.items():
+            if xx and member not in zset:
+                continue
+            added += member not in zset
+            zset[member] = float(score)
+        return added
+
+    async def zrangebyscore(self, key: str, min: float | str, max: float | str) -> list[str]:
+        lo, hi = float(min), float(max)
+        items = sorted(self._zsets.get(key, {}).items(), key=lambda kv: kv[1])
+        return [m for m, score in items if lo <= score <= hi]
+
+    # Streams (ids are "{n}-0" from a counter; trimming is exact)
+    def _stream_range(self, key: str, lo: tuple[int, int], hi: tuple[int, int]) -> list[tuple[str, dict[str, str]]]:
+        def sid(entry_id: str) -> tuple[int, int]:
+            ms, seq = entry_id.split("-")
+            return int(ms), int(seq)
+
+        return [(i, f) for i, f in self._streams.get(key, []) if lo <= sid(i) <= hi]
+
+    @staticmethod
+    def _bound(value: str, low: bool) -> tuple[int, int]:
+        if value in ("-", "+"):
+            return (0, 0) if value == "-" else (2**63, 0)
+        exclusive = value.startswith("(")
+        ms, seq = value.lstrip("(").split("-")
+        bound = (int(ms), int(seq))
+        if exclusive:
+            bound = (bound[0], bound[1] + 1) if low else (bound[0], bound[1] - 1)
+        return bound
+
+    async def xadd(self, key: str, fields: dict[str, Any], maxlen: int | None = None, approximate: bool = True) -> str:
+        self._stream_seq += 1
+        entry_id = f"{self._stream_seq}-0"
+        entries = self._streams.setdefault(key, [])
+        entries.append((entry_id, {k: v.decode() if isinstance(v, bytes) else str(v) for k, v in fields.items()}))
+        if maxlen is not None:
+            del entries[: max(0, len(entries) - maxlen)]
+        return entry_id
+
+    async def xrange(self, key: str, min: str = "-", max: str = "+", count: int | None = None):
+        return self._stream_range(key, self._bound(min, True), self._bound(max, False))[:count]
+
+    async def xrevrange(self, key: str, max: str = "+", min: str = "-", count: int | None = None):
+        return list(reversed(self._stream_range(key, self._bound(min, True), self._bound(max, False))))[:count]
+
+    async def xread(self, streams: dict[str, str], count: int | None = None, block: int | None = None):
+        deadline = asyncio.get_running_loop().time() + (block or 0) / 1000
+        while True:
+            resp = []
+            for key, last in streams.items():
+                entries = await self.xrange(key, "(" + last, count=count)
+                if entries:
+                    resp.append([key, entries])
+            if resp or block is None or asyncio.get_running_loop().time() >= deadline:
+                return resp
+            await asyncio.sleep(0.005)
+
+    # Scripting
+    def register_script(self, script: str) -> _FakeScript:
+        return _FakeScript(self, _FAKE_SCRIPTS[script])
+
+    def pipeline(self, transaction: bool = True) -> _FakePipeline:
+        return _FakePipeline(self)
+
     # Pub/Sub & publishing
     def pubsub(self):
-        return self._pubsub
+        # Like redis-py, each call is its own connection with its own subscriptions
+        pubsub = _FakePubSub(self) if self._pubsubs else self._pubsub
+        self._pubsubs.append(pubsub)
+        return pubsub
 
-    async def publish(self, channel: str, payload: str) -> None:
+    async def publish(self, channel: str, payload: str | bytes) -> None:
         self._published.append((channel, payload))
-        await self._pubsub.push(channel, payload)
+        for pubsub in self._pubsubs or [self._pubsub]:
+            await pubsub.push(channel, payload)
 
     # Compatibility helpers
     @classmethod
@@ -159,7 +306,8 @@ class FakeRedis:
         return cls()
 
     async def close(self):  # used in lifespan
-        await self._pubsub.close()
+        for pubsub in self._pubsubs or [self._pubsub]:
+            await pubsub.aclose()
 
 
 @pytest.fixture(scope="session")
@@ -214,6 +362,14 @@ def _override_get_db(app, db_session: AsyncSession):
 # ---------------------------------------------------------------------------
 
 
+@pytest.fixture(autouse=True)
+def _clear_auth_cache():
+    # Users are rolled back after every test, so cached ones (and their ids) must not leak into the next
+    auth_cache.clear()
+    yield
+    auth_cache.clear()
+
+
 @pytest_asyncio.fixture()
 async def create_user(db_session: AsyncSession) -> Callable[[str, str], Awaitable[UserORM]]:
     async def _inner(username: str, password: str) -> UserORM:
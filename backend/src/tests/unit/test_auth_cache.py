@@ -0,0 +1,38 @@
+import uuid
+
+import pytest
+from sqlalchemy import inspect
+
+from fast_room_api.api import dependencies as deps
+from fast_room_api.api.auth_cache import auth_cache
+from fast_room_api.models.db import UserORM
+
+
+@pytest.mark.asyncio
+async def test_repeat_callers_hit_the_cache_until_user_changes(db_session):
+    user = UserORM(username=f"cached_{uuid.uuid4().hex[:8]}", hashed_password="-")
+    db_session.add(user)
+    await db_session.flush()  # never committed: rolled back with the test
+    token = deps.create_access_token(username=user.username, ttl_seconds=3600)
+    first = await deps.get_current_user(token, db_session)
+    assert first is user  # the miss returns the request session's own instance
+    cached = await deps.get_current_user(token, db_session)
+    assert cached is not user and cached.id == user.id and inspect(cached).detached
+    stats = auth_cache.as_dict()
+    assert stats["tokens"]["hits"] == 1 and stats["users"]["hits"] == 1
+    # Disabling the user evicts it on flush, so the next call sees the new state
+    user.disabled = True
+    await db_session.flush()
+    again = await deps.get_current_user(token, db_session)
+    assert again.disabled and auth_cache.as_dict()["users"]["misses"] == 2
+
+
+def test_token_entries_expire_with_the_token():
+    token = deps.create_access_token(username="someone", ttl_seconds=60)
+    payload = deps.decode_token(token)
+    auth_cache.set_token(token, payload)
+    assert auth_cache.get_token(token) == payload
+    expired = payload.model_copy(update={"exp": payload.iat - 1})
+    auth_cache.clear()
+    auth_cache.set_token(token, expired)
+    assert auth_cache.get_token(token) is None
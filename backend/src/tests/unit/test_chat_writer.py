@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from fast_room_api.api.chat_writer import ChatWriter, PendingMessage
+from fast_room_api.models.db import MessageORM, RoomORM
+
+
+def _msg(n: int) -> PendingMessage:
+    return PendingMessage(room="writer", room_id=901, user_id=1, username="u", content=f"m{n}")
+
+
+@pytest.mark.asyncio
+async def test_group_commit_assigns_ids_in_order(test_engine, _create_all):
+    saved: list[tuple[str, int]] = []
+
+    async def on_saved(msg, message_id, created_at):
+        saved.append((msg.content, message_id))
+
+    async def on_failed(msg):
+        raise AssertionError(msg)
+
+    async with async_sessionmaker(test_engine)() as session:
+        session.add(RoomORM(id=901, name="writer"))
+        await session.commit()
+    writer = ChatWriter(async_sessionmaker(test_engine), on_saved, on_failed, batch_size=3, flush_ms=2000)
+    for n in range(5):
+        assert writer.submit(_msg(n))
+    # The first three filled a batch and were written without waiting out the window
+    async with asyncio.timeout(1):
+        while len(saved) < 3:
+            await asyncio.sleep(0.005)
+    assert [c for c, _ in saved] == ["m0", "m1", "m2"]
+    await writer.close()
+    assert [c for c, _ in saved] == [f"m{n}" for n in range(5)]
+    ids = [i for _, i in saved]
+    assert ids == sorted(ids)
+    assert writer.stats.batches == 2 and writer.stats.max_batch == 3
+    async with async_sessionmaker(test_engine)() as session:
+        rows = (await session.execute(select(MessageORM.id, MessageORM.content).where(MessageORM.room_id == 901))).all()
+        room = await session.get(RoomORM, 901)
+    assert sorted(rows) == sorted((i, c) for c, i in saved)
+    # Counters were bumped once per batch, in the batch's transaction
+    assert room is not None and room.message_count == 5 and room.last_message_at is not None
+    assert not writer.submit(_msg(5))  # closed
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_reported_not_fanned_out():
+    failed: list[str] = []
+
+    def broken_factory():
+        raise RuntimeError("db down")
+
+    async def on_saved(msg, message_id, created_at):
+        raise AssertionError(msg)
+
+    async def on_failed(msg):
+        failed.append(msg.content)
+
+    writer = ChatWriter(broken_factory, on_saved, on_failed, batch_size=10, flush_ms=0)  # type: ignore[arg-type]
+    writer.submit(_msg(0))
+    writer.submit(_msg(1))
+    await writer.close()
+    assert failed == ["m0", "m1"] and writer.stats.failed == 2
+
+
+@pytest.mark.asyncio
+async def test_bad_row_only_fails_its_own_message(test_engine, _create_all):
+    saved: list[str] = []
+    failed: list[str | None] = []
+
+    async def on_saved(msg, message_id, created_at):
+        saved.append(msg.content)
+
+    async def on_failed(msg):
+        failed.append(msg.content)
+
+    async with async_sessionmaker(test_engine)() as session:
+        session.add(RoomORM(id=902, name="writer-bad-row"))
+        await session.commit()
+    writer = ChatWriter(async_sessionmaker(test_engine), on_saved, on_failed, batch_size=5, flush_ms=2000)
+    for n in range(5):
+        # content is NOT NULL: the third row makes the database refuse the batch's INSERT
+        content = None if n == 2 else f"m{n}"
+        writer.submit(PendingMessage(room="w", room_id=902, user_id=1, username="u", content=content))  # type: ignore[arg-type]
+    await writer.close()
+    assert saved == ["m0", "m1", "m3", "m4"] and failed == [None]
+    assert writer.stats.failed == 1 and writer.stats.splits > 0
+    async with async_sessionmaker(test_engine)() as session:
+        room = await session.get(RoomORM, 902)
+    assert room is not None and room.message_count == 4
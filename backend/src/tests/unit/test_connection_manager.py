@@ -1,6 +1,12 @@
+import asyncio
+
 import pytest
 
-from fast_room_api.api.routers.ws import HEARTBEAT_KEY_PREFIX, ConnectionManager
+from fast_room_api import serialization
+from fast_room_api.api.fanout import FanoutBackend, PubSubFanout, StreamFanout, channel_for, stream_key
+from fast_room_api.api.outbox import Frame
+from fast_room_api.api.presence import member_id, users_key, zset_key
+from fast_room_api.api.routers.ws import SERVER_ID, ConnectionManager
 
 
 class DummyWS:
@@ -23,13 +29,12 @@ async def test_connection_manager_join_leave(fake_redis):
     ws = DummyWS()
     first = await cm.join("room1", ws, "alice")  # type: ignore[arg-type]
     assert first is True
-    # Heartbeat key created
-    _, keys = await fake_redis.scan(0, f"{HEARTBEAT_KEY_PREFIX}room1:alice:*")
-    assert keys, "heartbeat key missing after join"
+    # Connection registered in the room's presence index
+    assert await cm.presence.users("room1") == ["alice"]
+    assert len(fake_redis._zsets[zset_key("room1")]) == 1
     removed, uname = await cm.leave("room1", ws)  # type: ignore[arg-type]
     assert removed is True and uname == "alice"
-    _, keys_after = await fake_redis.scan(0, f"{HEARTBEAT_KEY_PREFIX}room1:alice:*")
-    assert not keys_after, "heartbeat key not deleted after leave"
+    assert await cm.presence.users("room1") == [], "presence entry not removed after leave"
 
 
 @pytest.mark.asyncio
@@ -41,3 +46,211 @@ async def test_connection_manager_multi_join_same_user(fake_redis):
     second = await cm.join("roomx", ws2, "bob")  # type: ignore[arg-type]
     assert first is True
     assert second is False  # second websocket for same user shouldn't be first_global
+    removed, _ = await cm.leave("roomx", ws1)  # type: ignore[arg-type]
+    assert removed is False  # bob still has ws2 in the room
+    removed, _ = await cm.leave("roomx", ws2)  # type: ignore[arg-type]
+    assert removed is True
+
+
+@pytest.mark.asyncio
+async def test_presence_index_prunes_expired_connections(fake_redis):
+    cm = ConnectionManager(fake_redis)
+    ws = DummyWS()
+    await cm.join("ghosts", ws, "carol")  # type: ignore[arg-type]
+    # Simulate a connection left behind by a crashed node: its expiry is in the past
+    fake_redis._zsets[zset_key("ghosts")]["dave:deadbeef"] = 0
+    fake_redis._hashes["presence:u:ghosts"]["dave"] = "1"
+    assert await cm.presence.users("ghosts") == ["carol"]
+    # dave's stale entry is swept, so his reconnect counts as a first join again
+    assert await cm.presence.join("ghosts", "dave", "fresh") is True
+    assert await cm.presence.users("ghosts") == ["carol", "dave"]
+
+
+@pytest.mark.asyncio
+async def test_leave_sweeps_connections_of_a_crashed_node(fake_redis):
+    cm = ConnectionManager(fake_redis)
+    ws = DummyWS()
+    await cm.join("crashed", ws, "erin")  # type: ignore[arg-type]
+    # erin's other connection lived on a node that died; its entry has expired
+    fake_redis._zsets[zset_key("crashed")]["erin:deadbeef"] = 0
+    fake_redis._hashes[users_key("crashed")]["erin"] = "2"
+    removed, _ = await cm.leave("crashed", ws)  # type: ignore[arg-type]
+    assert removed is True, "the dead connection must not keep erin present"
+    assert not fake_redis._hashes.get(users_key("crashed"))
+
+
+@pytest.mark.asyncio
+async def test_presence_keys_expire_and_usernames_may_contain_colons(fake_redis):
+    cm = ConnectionManager(fake_redis)
+    ws = DummyWS()
+    assert await cm.join("colons", ws, "a:b") is True  # type: ignore[arg-type]
+    assert await cm.presence.users("colons") == ["a:b"]
+    key_ttl = cm.presence.key_ttl_ms
+    assert fake_redis._ttls[zset_key("colons")] == fake_redis._ttls[users_key("colons")] == key_ttl
+    # The heartbeat pushes the keys' TTL along with the member's expiry
+    fake_redis._ttls.clear()
+    pipe = fake_redis.pipeline()
+    cm.presence.refresh(pipe, ("colons", member_id("a:b", cm.ws_conn_id[ws])))
+    await pipe.execute()
+    assert fake_redis._ttls == {zset_key("colons"): key_ttl, users_key("colons"): key_ttl}
+    removed, uname = await cm.leave("colons", ws)  # type: ignore[arg-type]
+    assert removed is True and uname == "a:b"
+
+
+class TextWS(DummyWS):
+    async def send_text(self, data):
+        self.sent.append(data)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_once_for_peers_and_redis(fake_redis):
+    cm = ConnectionManager(fake_redis)
+    peers = [TextWS() for _ in range(3)]
+    for i, ws in enumerate(peers):
+        cm.connect(ws)  # type: ignore[arg-type]
+        await cm.join("encode-once", ws, f"user{i}")  # type: ignore[arg-type]
+    frame = await cm.broadcast("encode-once", {"type": "chat", "room": "encode-once", "message": "hi"})
+    for _ in range(3):
+        await asyncio.sleep(0)
+    channel, published = fake_redis._published[-1]
+    assert channel.endswith("encode-once")
+    # The exact same buffer is reused for every local peer and for the Redis publish
+    assert all(ws.sent and ws.sent[-1] is frame.text for ws in peers)
+    assert published is frame.data
+    assert frame.text == frame.data.decode()
+    for ws in peers:
+        await cm.leave_all(ws)  # type: ignore[arg-type]
+
+
+@pytest.mark.asyncio
+async def test_bucket_mode_subscribes_once_and_filters_locally(fake_redis):
+    redis = type(fake_redis)()  # private instance: the reader task must not compete with other managers
+    cm = ConnectionManager(redis)
+    fanout = cm.fanout = PubSubFanout(redis, SERVER_ID, cm._deliver, cm._active, buckets=4)
+    ws = TextWS()
+    cm.connect(ws)  # type: ignore[arg-type]
+    for i in range(10):
+        await cm.join(f"bucket{i}", ws, "erin")  # type: ignore[arg-type]
+    for i in range(1, 10):
+        await cm.leave(f"bucket{i}", ws)  # type: ignore[arg-type]
+    assert len(fanout.pubsub._subscribed) == 4
+    assert fanout.counters.subscribes == 4 and fanout.counters.unsubscribes == 0
+    # A remote node publishes to a room with a local socket and to one without
+    for room in ("bucket0", "bucket5"):
+        payload = {"type": "chat", "room": room, "message": "x", "srv": "remote"}
+        await redis.publish(channel_for(room, 4), serialization.dumps(payload))
+    for _ in range(100):
+        if fanout.counters.received == 2:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0)
+    assert [serialization.loads(m)["room"] for m in ws.sent] == ["bucket0"]
+    assert fanout.counters.filtered == 1
+    await cm.leave_all(ws)  # type: ignore[arg-type]
+    await fanout.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_fanout_stamps_ids_and_delivers_remote_events(fake_redis):
+    redis = type(fake_redis)()
+    cm = ConnectionManager(redis)
+    fanout = cm.fanout = StreamFanout(redis, SERVER_ID, cm._deliver, cm._active, maxlen=100, block_ms=10)
+    ws = TextWS()
+    cm.connect(ws)  # type: ignore[arg-type]
+    await cm.join("streamed", ws, "frank")  # type: ignore[arg-type]
+    frame = await cm.broadcast("streamed", {"type": "chat", "room": "streamed", "message": "local"})
+    # Local peers get the stream id assigned by XADD, spliced into the already-encoded payload
+    assert frame.obj["sid"] == redis._streams[stream_key("streamed")][-1][0]
+    assert serialization.loads(frame.data) == {**frame.obj, "srv": SERVER_ID}
+    # An event appended by another node reaches the local socket through the XREAD loop
+    remote = {"type": "chat", "room": "streamed", "message": "remote", "srv": "other"}
+    sid = await redis.xadd(stream_key("streamed"), {"d": serialization.dumps(remote)})
+    for _ in range(100):
+        if len(ws.sent) == 2:
+            break
+        await asyncio.sleep(0.01)
+    assert [serialization.loads(m)["sid"] for m in ws.sent] == [frame.obj["sid"], sid]
+    assert fanout.counters.received == 2  # its own append is read back but skipped
+    await cm.leave_all(ws)  # type: ignore[arg-type]
+    await fanout.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_replay_returns_gap_or_falls_back(fake_redis):
+    redis = type(fake_redis)()
+    fanout = StreamFanout(redis, SERVER_ID, lambda room, frame: None, lambda room: True, maxlen=5, replay_limit=3)
+    sent = []
+    for i in range(5):
+        sent.append(await fanout.publish("r", Frame({"type": "chat", "room": "r", "message": str(i), "srv": "a"})))
+    await fanout.publish("r", Frame({"type": "typing", "room": "r", "user": "x", "isTyping": True, "srv": "a"}))
+    # Typing is skipped on replay; chat events after ``since`` come back in order with their ids
+    replayed = await fanout.replay("r", sent[2].obj["sid"])
+    assert replayed is not None
+    assert [f.obj["message"] for f in replayed] == ["3", "4"]
+    assert serialization.loads(replayed[0].text)["sid"] == sent[3].obj["sid"]
+    # Trimmed past ``since`` (maxlen=5), more than replay_limit events, or a malformed id: fall back to history
+    assert await fanout.replay("r", sent[0].obj["sid"]) is None
+    assert await fanout.replay("r", sent[1].obj["sid"]) is None
+    assert await fanout.replay("r", "not-an-id") is None
+    assert fanout.counters.replay_misses == 2
+
+
+@pytest.mark.asyncio
+async def test_publish_batching_coalesces_room_broadcasts(fake_redis):
+    redis = type(fake_redis)()
+    cm = ConnectionManager(redis)
+    cm.publish_batch_ms = 5
+    ws = TextWS()
+    cm.connect(ws)  # type: ignore[arg-type]
+    await cm.join("coalesce", ws, "gina")  # type: ignore[arg-type]
+    for i in range(3):
+        await cm.broadcast("coalesce", {"type": "chat", "room": "coalesce", "message": str(i)})
+    # Local delivery is immediate; the Redis publish waits for the window
+    assert redis._published == []
+    await asyncio.sleep(0.02)
+    assert len(redis._published) == 1
+    batch = serialization.loads(redis._published[0][1])
+    assert batch["type"] == "batch" and batch["room"] == "coalesce" and batch["srv"] == SERVER_ID
+    assert [e["message"] for e in batch["events"]] == ["0", "1", "2"]
+    # Receiving nodes unpack the batch into individual events
+    other = ConnectionManager(redis)
+    peer = TextWS()
+    other.connect(peer)  # type: ignore[arg-type]
+    other.rooms["coalesce"].add(peer)  # type: ignore[arg-type]
+    other._deliver("coalesce", Frame(batch))
+    await asyncio.sleep(0)
+    assert [serialization.loads(m)["message"] for m in peer.sent] == ["0", "1", "2"]
+    await cm.leave_all(ws)  # type: ignore[arg-type]
+    await other.disconnect(peer)  # type: ignore[arg-type]
+
+
+def test_fanout_backend_missing_a_method_fails_on_construction(fake_redis):
+    class NoPublish(FanoutBackend):
+        async def subscribe(self, room):
+            pass
+
+        async def unsubscribe_if_idle(self, room):
+            pass
+
+    with pytest.raises(TypeError, match="publish"):
+        NoPublish(fake_redis, "srv", lambda room, frame: None, lambda room: True)  # type: ignore[abstract]
+
+
+@pytest.mark.asyncio
+async def test_close_stops_every_background_task(fake_redis, db_session):
+    redis = type(fake_redis)()
+    cm = ConnectionManager(redis)
+    ws = TextWS()
+    cm.connect(ws)  # type: ignore[arg-type]
+    await cm.join("shutdown", ws, "gina")  # type: ignore[arg-type]
+    await cm.set_typing("shutdown", "gina", True)
+    await cm.room_cache.get(db_session, 1)  # starts the invalidation listener
+    fanout = cm.fanout
+    assert isinstance(fanout, PubSubFanout)
+    tasks = [cm.heartbeats._task, cm.typing_task, fanout.task, cm.room_cache.task]
+    assert all(task is not None for task in tasks)
+    await cm.close()
+    assert all(task.done() for task in tasks if task is not None)
+    assert cm.heartbeats._task is None and cm.typing_task is None and not cm.outboxes
+    assert fanout.task is None and not fanout.pubsub._listening
+    assert cm.room_cache.task is None and cm.room_cache.pubsub is None
@@ -0,0 +1,31 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from fast_room_api.models import db as models_db
+from fast_room_api.models.config import settings
+
+
+def test_engine_options_follow_settings(monkeypatch):
+    monkeypatch.setattr(settings, "database_url", "postgresql+asyncpg://u:p@db/app")
+    monkeypatch.setattr(settings, "db_pool_size", 7)
+    monkeypatch.setattr(settings, "db_statement_cache_size", 0)
+    options = models_db._engine_options()
+    assert options["pool_size"] == 7 and options["echo"] is False
+    assert options["connect_args"] == {"statement_cache_size": 0}
+    monkeypatch.setattr(settings, "database_url", "sqlite+aiosqlite:///:memory:")
+    assert "pool_size" not in models_db._engine_options()
+    # A SQLite file gets a regular queue pool, sized like any other database
+    monkeypatch.setattr(settings, "database_url", "sqlite+aiosqlite:///./fastroom.db")
+    options = models_db._engine_options()
+    assert options["pool_size"] == 7
+    file_engine = create_async_engine(settings.database_url, **options)
+    assert file_engine.pool.size() == 7  # type: ignore[attr-defined]
+
+
+@pytest.mark.asyncio
+async def test_warm_pool_opens_connections_up_to_pool_size(monkeypatch, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'warm.db'}", pool_size=3, max_overflow=5)
+    monkeypatch.setattr(models_db, "engine", engine)
+    await models_db.warm_pool(10)
+    assert engine.pool.checkedin() == 3 and engine.pool.checkedout() == 0  # type: ignore[attr-defined]
+    await engine.dispose()
@@ -1,8 +1,11 @@
 from datetime import UTC, datetime, timedelta
 
 import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 from fast_room_api.api import dependencies as deps
+from fast_room_api.api.token_purge import purge_refresh_tokens
 from fast_room_api.models.auth import InvalidToken
 from fast_room_api.models.db import RefreshTokenORM
 
@@ -65,3 +68,23 @@ async def test_password_hash_and_verify():
     hashed = deps.get_password_hash(pw)
     assert deps.verify_password(pw, hashed) is True
     assert deps.verify_password("wrong", hashed) is False
+
+
+@pytest.mark.asyncio
+async def test_rotation_is_single_use_and_purge_drops_dead_rows(
+    create_user, unique_username, unique_password, test_engine
+):
+    sessions = async_sessionmaker(test_engine, expire_on_commit=False)
+    user = await create_user(unique_username(), unique_password())
+    first = deps.create_refresh_token(user.username, ttl_seconds=120)
+    async with sessions() as db:
+        await deps.persist_refresh_token(db, user.username, first, None, None)
+        rotated = await deps.rotate_refresh_token(db, first)
+        assert rotated is not None and rotated[0] == user.username
+        # The old token was revoked in the same transaction, so replaying it fails
+        assert await deps.rotate_refresh_token(db, first) is None
+        assert await deps.validate_refresh_token(db, rotated[1]) is not None
+    assert await purge_refresh_tokens(sessions, batch=1) >= 1
+    async with sessions() as db:
+        hashes = set((await db.execute(select(RefreshTokenORM.token_hash))).scalars())
+    assert deps.hash_refresh_token(first) not in hashes and deps.hash_refresh_token(rotated[1]) in hashes
@@ -0,0 +1,60 @@
+import pytest
+
+from fast_room_api.api.heartbeat import HeartbeatScheduler
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class CountingRedis:
+    def __init__(self, fake_redis):
+        self.inner = fake_redis
+        self.pipelines = 0
+
+    def pipeline(self, transaction: bool = True):
+        self.pipelines += 1
+        return self.inner.pipeline(transaction)
+
+
+def _psetex(pipe, key):
+    pipe.psetex(key, 5000, "1")
+
+
+@pytest.mark.asyncio
+async def test_due_keys_refreshed_in_pipelined_batches(fake_redis):
+    clock = Clock()
+    redis = CountingRedis(fake_redis)
+    sched = HeartbeatScheduler(redis, interval=2, refresh=_psetex, batch_size=2, clock=clock)  # type: ignore[arg-type]
+    keys = [f"presence:hb:wheel:u{i}:c" for i in range(5)]
+    for key in keys:
+        sched.add(key)
+    await sched.tick()  # t=1000: nothing due yet
+    assert redis.pipelines == 0
+    clock.now = 1002.3
+    await sched.tick()
+    assert all(fake_redis._data.get(k) == "1" for k in keys)
+    assert redis.pipelines == 3  # 5 keys in batches of 2
+    assert sched.stats.keys_refreshed == 5 and sched.stats.max_batch_size == 2
+    assert sched.stats.last_lag_ms == pytest.approx(300, abs=1)
+    # Rescheduled one interval later
+    clock.now = 1004.0
+    await sched.tick()
+    assert sched.stats.keys_refreshed == 10
+
+
+@pytest.mark.asyncio
+async def test_removed_keys_are_not_refreshed(fake_redis):
+    clock = Clock()
+    sched = HeartbeatScheduler(fake_redis, interval=1, refresh=_psetex, clock=clock)
+    sched.add("presence:hb:gone:u:c")
+    sched.remove("presence:hb:gone:u:c")
+    assert len(sched) == 0
+    clock.now += 1
+    await sched.tick()
+    assert "presence:hb:gone:u:c" not in fake_redis._data
+    assert sched.stats.keys_refreshed == 0
@@ -0,0 +1,54 @@
+from fast_room_api import serialization
+from fast_room_api.api.history_cache import HistoryCache
+from fast_room_api.models.ws import OutChatMessage
+
+
+def _chat(n: int, **extra) -> dict:
+    return {**OutChatMessage(room="h", user="u", message=f"m{n}", message_id=n).model_dump(), **extra}
+
+
+def test_join_frame_follows_room_events():
+    cache = HistoryCache(size=5, limit=3)
+    assert cache.recent_frame("h") is None
+    cache.begin_fill("h")
+    cache.fill("h", [_chat(n) for n in (1, 2)])
+    frame = cache.recent_frame("h")
+    assert frame is not None and [m["message_id"] for m in frame.obj["messages"]] == [1, 2]
+    assert serialization.loads(frame.data) == serialization.loads(serialization.dumps(frame.obj))
+    cache.apply("h", _chat(3, srv="other"))
+    cache.apply("h", {"type": "message_updated", "room": "h", "message_id": 2, "content": "edited"})
+    messages = cache.recent_frame("h").obj["messages"]
+    assert [(m["message_id"], m["message"]) for m in messages] == [(1, "m1"), (2, "edited"), (3, "m3")]
+    assert "srv" not in messages[-1]
+    # Whole history is in memory (the fill came back short), so older pages are exact
+    assert cache.older("h", 3) == ([messages[0], messages[1]], False)
+    cache.apply("h", {"type": "message_deleted", "room": "h", "message_id": 1})
+    assert cache.recent_frame("h") is None  # refilled by the next join
+    assert cache.stats.hits == 2 and cache.stats.misses == 2
+
+
+def test_events_during_fill_are_merged_or_spoil_it():
+    cache = HistoryCache(size=3, limit=2)
+    cache.begin_fill("h")
+    cache.apply("h", _chat(4))  # committed after the query's snapshot
+    cache.apply("h", _chat(3))  # ...or already in it
+    cache.fill("h", [_chat(n) for n in (1, 2, 3)])
+    history = cache.rooms["h"]
+    assert history.ids == [2, 3, 4] and not history.exhausted
+    assert cache.older("h", 3) is None  # only one older message in memory, the database may have more
+    cache.drop("h")
+    cache.begin_fill("h")
+    cache.apply("h", {"type": "message_updated", "room": "h", "message_id": 2, "content": "x"})
+    cache.fill("h", [_chat(n) for n in (1, 2)])
+    assert "h" not in cache.rooms
+
+
+def test_size_below_the_page_limit_is_raised_to_it():
+    cache = HistoryCache(size=2, limit=3)
+    assert cache.size == 3 and HistoryCache(size=0, limit=3).enabled is False
+    cache.begin_fill("h")
+    cache.fill("h", [_chat(n) for n in (1, 2, 3)])  # a full page: the database may hold more
+    assert not cache.rooms["h"].exhausted
+    cache.apply("h", _chat(4))
+    assert [m["message_id"] for m in cache.recent_frame("h").obj["messages"]] == [2, 3, 4]
+    assert cache.older("h", 2) is None
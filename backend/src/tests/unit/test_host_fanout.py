@@ -0,0 +1,96 @@
+import asyncio
+import socket
+
+import pytest
+
+from fast_room_api import serialization
+from fast_room_api.api.fanout import PubSubFanout, channel_for
+from fast_room_api.api.host_fanout import HostFanout
+from fast_room_api.api.outbox import Frame
+from fast_room_api.serve import main, worker_env
+
+
+def _worker(redis, server_id: str, directory: str, with_redis: bool = True):
+    received: list[dict] = []
+
+    def deliver(_room: str, frame: Frame) -> None:
+        received.append(frame.obj)
+
+    def active(room: str) -> bool:
+        return room == "lobby"
+
+    remote = PubSubFanout(redis, server_id, deliver, active) if with_redis else None
+    return HostFanout(redis, server_id, deliver, active, directory=directory, remote=remote, rescan_s=0), received
+
+
+async def _until(predicate) -> None:
+    async with asyncio.timeout(2):
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_same_host_workers_deliver_each_event_once(fake_redis, tmp_path):
+    redis = type(fake_redis)()
+    a, _ = _worker(redis, "host-0", str(tmp_path))
+    b, b_received = _worker(redis, "host-1", str(tmp_path))
+    await a.subscribe("lobby")
+    await b.subscribe("lobby")
+    # The first publish opens a -> b; b drops it (no sockets in that room) but now knows a is linked
+    await a.publish("elsewhere", Frame({"type": "chat", "room": "elsewhere", "srv": "host-0"}))
+    await _until(lambda: "host-0" in b.linked)
+    frame = await a.publish("lobby", Frame({"type": "chat", "room": "lobby", "message": "hi", "srv": "host-0"}))
+    # Still published to Redis for other hosts, but b delivers only the copy it got over the socket
+    assert serialization.loads(redis._published[-1][1]) == frame.obj
+    await _until(lambda: b.remote.counters.received == 1)
+    await asyncio.sleep(0.01)
+    assert [m["message"] for m in b_received] == ["hi"]
+    assert b.counters.received == 2 and b.counters.filtered == 1 and b.counters.duplicates == 1
+    # An event that never comes over the socket (a's link to b overflowed, say) still arrives from Redis
+    lost = {"type": "chat", "room": "lobby", "message": "redis only", "srv": "host-0"}
+    await redis.publish(channel_for("lobby"), serialization.dumps(lost))
+    await _until(lambda: len(b_received) == 2)
+    assert b_received[-1]["message"] == "redis only" and "host-0" in b.linked
+    await a.close()
+    await b.close()
+    await _until(lambda: not b.linked)
+    assert not list(tmp_path.glob("*.sock"))
+
+
+@pytest.mark.asyncio
+async def test_local_backend_keeps_events_off_redis(fake_redis, tmp_path):
+    redis = type(fake_redis)()
+    a, _ = _worker(redis, "host-0", str(tmp_path), with_redis=False)
+    b, b_received = _worker(redis, "host-1", str(tmp_path), with_redis=False)
+    await a.subscribe("lobby")
+    await b.subscribe("lobby")
+    await b.publish("lobby", Frame({"type": "chat", "room": "lobby", "message": "from b", "srv": "host-1"}))
+    await a.publish("lobby", Frame({"type": "chat", "room": "lobby", "message": "from a", "srv": "host-0"}))
+    await _until(lambda: b_received)
+    assert [m["message"] for m in b_received] == ["from a"]
+    assert not redis._published
+    assert a.stats()["remote"] is None and a.stats()["peers"] == 1
+    await a.close()
+    await b.close()
+
+
+def test_worker_env_gives_each_worker_its_own_server_id():
+    envs = [worker_env("web1", i, "/run/fastroom") for i in range(3)]
+    assert [e["SERVER_ID"] for e in envs] == ["web1-0", "web1-1", "web1-2"]
+    assert {e["WS_LOCAL_FANOUT_DIR"] for e in envs} == {"/run/fastroom"}
+    assert "WS_LOCAL_FANOUT_DIR" not in worker_env("web1", 0, None)
+
+
+def test_second_instance_leaves_the_live_fanout_sockets_alone(tmp_path):
+    live = socket.socket()
+    live.bind(("127.0.0.1", 0))
+    live.listen()
+    port = live.getsockname()[1]
+    peer = tmp_path / "web1-0.sock"
+    peer.touch()
+    try:
+        with pytest.raises(SystemExit):
+            main(["--host", "127.0.0.1", "--port", str(port), "--fanout-dir", str(tmp_path)])
+        assert peer.exists()
+    finally:
+        live.close()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import pytest
+
+from fast_room_api.api.outbox import Frame, Outbox, OutboxStats, OverflowPolicy, Priority
+from fast_room_api.api.routers.ws import ConnectionManager
+from fast_room_api.models.ws import OutBatch
+
+
+class StalledWS:
+    """Socket whose sends block until released (simulates a slow client)."""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+
+    async def send_text(self, data):
+        await self.release.wait()
+        self.sent.append(json.loads(data))
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+
+class FastWS(StalledWS):
+    def __init__(self):
+        super().__init__()
+        self.release.set()
+
+
+async def _drain():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_keeps_newest_frames():
+    ws = StalledWS()
+    stats = OutboxStats()
+    box = Outbox(ws, 2, OverflowPolicy.DROP_OLDEST, stats)  # type: ignore[arg-type]
+    for i in range(4):
+        assert box.put(Frame({"n": i})) is True
+    assert box.depth == 2 and stats.dropped_oldest == 2
+    box.start()
+    ws.release.set()
+    await _drain()
+    assert [m["n"] for m in ws.sent] == [2, 3]
+    await box.close()
+
+
+@pytest.mark.asyncio
+async def test_drop_low_priority_evicts_typing_first():
+    ws = StalledWS()
+    stats = OutboxStats()
+    box = Outbox(ws, 2, OverflowPolicy.DROP_LOW_PRIORITY, stats)  # type: ignore[arg-type]
+    box.put(Frame({"type": "typing"}), Priority.LOW)
+    box.put(Frame({"type": "chat", "n": 1}))
+    assert box.put(Frame({"type": "chat", "n": 2})) is True
+    assert stats.dropped_low_priority == 1
+    # Queue now only holds high priority frames: new low priority frames are discarded
+    assert box.put(Frame({"type": "typing"}), Priority.LOW) is False
+    assert box.depth == 2 and not box.closed
+    # ...and a high priority overflow disconnects the client
+    assert box.put(Frame({"type": "chat", "n": 3})) is False
+    await _drain()
+    assert box.closed and stats.disconnects == 1
+    assert ws.closed_with == 1013
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_client():
+    ws = StalledWS()
+    stats = OutboxStats()
+    box = Outbox(ws, 1, OverflowPolicy.DISCONNECT, stats)  # type: ignore[arg-type]
+    box.start()
+    box.put(Frame({"n": 0}))
+    await _drain()  # writer picks up n=0 and blocks in send
+    box.put(Frame({"n": 1}))
+    assert box.put(Frame({"n": 2})) is False
+    await _drain()
+    assert ws.closed_with == 1013 and stats.disconnects == 1
+    assert box.put(Frame({"n": 3})) is False
+
+
+@pytest.mark.asyncio
+async def test_stalled_peer_does_not_block_room_fanout(fake_redis):
+    cm = ConnectionManager(fake_redis)
+    slow, fast = StalledWS(), FastWS()
+    for ws, name in ((slow, "slow"), (fast, "fast")):
+        cm.connect(ws)  # type: ignore[arg-type]
+        await cm.join("fanout", ws, name)  # type: ignore[arg-type]
+    for i in range(3):
+        cm.broadcast_local("fanout", {"type": "chat", "n": i})
+    await _drain()
+    assert [m["n"] for m in fast.sent] == [0, 1, 2]
+    assert slow.sent == []
+    stats = cm.stats()
+    assert stats["enqueued"] == 6 and stats["queue_depth"] >= 2
+    slow.release.set()
+    await _drain()
+    assert [m["n"] for m in slow.sent] == [0, 1, 2]
+    await cm.leave_all(slow)  # type: ignore[arg-type]
+    await cm.leave_all(fast)  # type: ignore[arg-type]
+    assert cm.stats()["sockets"] == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_window_coalesces_burst_into_one_frame():
+    ws = FastWS()
+    stats = OutboxStats()
+    box = Outbox(ws, 16, OverflowPolicy.DROP_OLDEST, stats, batch_ms=10)  # type: ignore[arg-type]
+    box.start()
+    for i in range(3):
+        box.put(Frame({"type": "chat", "n": i}))
+    await asyncio.sleep(0.03)
+    assert ws.sent == [OutBatch(events=[{"type": "chat", "n": i} for i in range(3)]).model_dump()]
+    assert stats.sent == 3 and stats.batches == 1 and stats.batched_events == 3
+    # A lone frame within a window is sent as-is
+    box.put(Frame({"type": "chat", "n": 3}))
+    await asyncio.sleep(0.03)
+    assert ws.sent[-1] == {"type": "chat", "n": 3}
+    await box.close()
+    # The spliced text encodes exactly the OutBatch the binary path packs
+    idle = Outbox(FastWS(), 16, OverflowPolicy.DROP_OLDEST, stats, batch_ms=10)  # type: ignore[arg-type]
+    idle.put(Frame({"type": "chat", "n": 4}))
+    idle.put(Frame({"type": "typing", "user": "u"}))
+    frame, count = idle._take()
+    assert count == 2 and json.loads(frame.text) == frame.obj
+    assert frame.obj == OutBatch(events=[{"type": "chat", "n": 4}, {"type": "typing", "user": "u"}]).model_dump()
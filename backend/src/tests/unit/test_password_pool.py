@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+
+from fast_room_api.api.password_pool import PasswordPool, PasswordPoolBusy, password_pool
+
+
+@pytest.mark.asyncio
+async def test_pool_bounds_in_flight_work_and_records_queue_wait():
+    pool = PasswordPool(workers=1, max_queue=1)
+    release = threading.Event()
+    running = asyncio.create_task(pool.run(release.wait))
+    queued = asyncio.create_task(pool.run(lambda: "second"))
+    await asyncio.sleep(0.02)
+    with pytest.raises(PasswordPoolBusy):
+        await pool.run(lambda: "third")
+    release.set()
+    assert await running is True and await queued == "second"
+    stats = pool.as_dict()
+    assert stats["completed"] == 2 and stats["rejected"] == 1 and stats["peak_in_flight"] == 2
+    assert stats["queue_wait_ms_max"] >= 15  # the second call waited for the only thread
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_keeps_its_slot_until_the_thread_finishes():
+    pool = PasswordPool(workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_hash() -> str:
+        started.set()
+        release.wait()
+        return "hash"
+
+    caller = asyncio.create_task(pool.run(slow_hash))
+    try:
+        await asyncio.to_thread(started.wait)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        # The client went away but bcrypt is still burning the only thread
+        assert pool.in_flight == 1
+        with pytest.raises(PasswordPoolBusy):
+            await pool.run(lambda: "next")
+    finally:
+        release.set()
+    for _ in range(100):
+        if not pool.in_flight:
+            break
+        await asyncio.sleep(0.01)
+    assert await pool.run(lambda: "next") == "next" and pool.in_flight == 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_password_work_is_shed_with_503_when_saturated(client, monkeypatch):
+    monkeypatch.setattr(password_pool, "workers", 0)
+    monkeypatch.setattr(password_pool, "max_queue", 0)
+    resp = await client.post("/register", params={"username": "storm_user", "password": "secret123"})
+    assert resp.status_code == 503 and resp.headers["retry-after"] == "1"
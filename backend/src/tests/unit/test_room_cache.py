@@ -0,0 +1,106 @@
+import asyncio
+import uuid
+
+import pytest
+
+from fast_room_api import serialization
+from fast_room_api.api.outbox import Frame
+from fast_room_api.api.room_cache import CONTROL_CHANNEL, MemberFlags, RoomCache
+from fast_room_api.api.routers.ws import ConnectionManager
+from fast_room_api.models.db import RoomMemberORM, RoomORM
+from fast_room_api.models.ws import OutMemberUpdate
+
+
+@pytest.mark.asyncio
+async def test_lookups_are_cached_and_remote_invalidation_drops_them(fake_redis, db_session):
+    redis = type(fake_redis)()  # private instance: the listener must not compete with other managers
+    cache = RoomCache(redis, "self")
+    room = RoomORM(name="cached-room", is_private=True)
+    db_session.add(room)
+    await db_session.flush()
+    first = await cache.get_by_name(db_session, "cached-room")
+    assert first is not None and first.id == room.id and first.is_private
+    assert await cache.get(db_session, room.id) == first  # filled both maps from one load
+    assert await cache.get_by_name(db_session, "cached-room") == first
+    assert cache.by_name.hits == 1 and cache.by_id.hits == 1
+    # Another node renamed it
+    await redis.publish(CONTROL_CHANNEL, serialization.dumps({"srv": "other", "id": room.id, "names": ["cached-room"]}))
+    for _ in range(100):
+        if cache.counters.received:
+            break
+        await asyncio.sleep(0.01)
+    assert room.id not in cache.by_id and "cached-room" not in cache.by_name
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_listener_error_and_close_release_the_pubsub(fake_redis, db_session):
+    redis = type(fake_redis)()
+    cache = RoomCache(redis, "self")
+    db_session.add(RoomORM(name="relisten-room"))
+    await db_session.flush()
+    await cache.get_by_name(db_session, "relisten-room")
+    first = cache.pubsub
+    assert first is not None
+    await redis.publish(CONTROL_CHANNEL, "not a payload")
+    for _ in range(100):
+        if cache.task is None:
+            break
+        await asyncio.sleep(0.01)
+    assert cache.task is None and cache.pubsub is None and not first._listening
+    # The next load subscribes on a fresh connection, which close() gives back
+    await cache.get_by_name(db_session, "relisten-room")
+    second = cache.pubsub
+    assert second is not None and second is not first
+    await cache.close()
+    assert cache.pubsub is None and not second._listening
+
+
+@pytest.mark.asyncio
+async def test_rename_invalidates_by_name(client, auth_header, unique_username, unique_password):
+    headers = await auth_header(unique_username(), unique_password())
+    name = f"room_{uuid.uuid4().hex[:8]}"
+    room_id = (await client.post("/rooms/", json={"name": name}, headers=headers)).json()["id"]
+    assert (await client.get(f"/rooms/by-name/{name}")).status_code == 200
+    resp = await client.patch(f"/rooms/{room_id}", json={"name": f"{name}_2"}, headers=headers)
+    assert resp.status_code == 200
+    assert (await client.get(f"/rooms/by-name/{name}")).status_code == 404
+    assert (await client.get(f"/rooms/{room_id}")).json()["name"] == f"{name}_2"
+    assert (await client.delete(f"/rooms/{room_id}", headers=headers)).status_code == 204
+    assert (await client.get(f"/rooms/{room_id}")).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_member_flags_follow_member_update_events(fake_redis, db_session):
+    redis = type(fake_redis)()
+    cm = ConnectionManager(redis)
+    room = RoomORM(name="moderated-room")
+    db_session.add(room)
+    await db_session.flush()
+    db_session.add(RoomMemberORM(room_id=room.id, user_id=42))
+    await db_session.flush()
+    cache = cm.room_cache
+    assert await cache.get_member(db_session, room.id, 7) is None
+    assert await cache.get_member(db_session, room.id, 42) == MemberFlags()
+    # A moderator toggles mute here; the broadcast updates the cache without touching the row
+    evt = OutMemberUpdate(
+        room="moderated-room",
+        room_id=room.id,
+        user_id=42,
+        username="u",
+        is_moderator=False,
+        is_banned=False,
+        is_muted=True,
+    )
+    await cm.broadcast("moderated-room", evt.model_dump())
+    assert (await cache.get_member(db_session, room.id, 42)).is_muted
+    # ...and the same event from another node bans
+    remote = {**evt.model_dump(), "is_muted": False, "is_banned": True, "srv": "other"}
+    cm._deliver("moderated-room", Frame(remote))
+    flags = await cache.get_member(db_session, room.id, 42)
+    assert flags.is_banned and not flags.is_muted
+    assert cache.members.misses == 2  # user 7, then user 42 once
+    await cache.invalidate_member(room.id, 42)
+    assert (room.id, 42) not in cache.members
+    await cache.close()
+    await cm.fanout.close()
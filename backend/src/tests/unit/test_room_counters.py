@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fast_room_api.api import room_counters
+from fast_room_api.models.db import Base, MessageORM, RoomORM
+
+
+@pytest.mark.asyncio
+async def test_reconcile_keeps_bumps_from_concurrent_writers(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'counters.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with sessions() as session:
+        session.add(RoomORM(id=1, name="busy", member_count=7))  # drifted: nobody is a member
+        await session.commit()
+    statements: list[tuple[int, str]] = []  # (DBAPI connection, SQL)
+
+    def record(conn, _cursor, sql, *_args) -> None:
+        statements.append((id(conn.connection.dbapi_connection), sql))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+
+    async def write(n: int) -> None:
+        # What the chat writer does per batch: insert, then bump the room in the same transaction
+        async with sessions() as session:
+            session.add(MessageORM(room_id=1, content=f"m{n}"))
+            await session.flush()
+            await room_counters.add_messages(session, 1, 1)
+            await session.commit()
+
+    try:
+        writers = [write(n) for n in range(20)]
+        await asyncio.gather(*writers[:10], room_counters.reconcile(sessions), *writers[10:])
+        async with sessions() as session:
+            raced = await room_counters.get(session, 1)
+        # Once the writers are done, a run fixes whatever the racing one had to skip
+        await room_counters.reconcile(sessions)
+        async with sessions() as session:
+            counters = await room_counters.get(session, 1)
+            stored = (await session.execute(select(func.count()).select_from(MessageORM))).scalar_one()
+    finally:
+        await engine.dispose()
+    assert stored == 20
+    # Fixed or skipped, the racing run never dropped a writer's bump
+    assert raced is not None and raced.message_count == 20
+    assert counters is not None and counters.member_count == 0 and counters.message_count == 20
+    assert counters.last_message_at is not None
+    # No room rows are locked while counting
+    assert not [sql for _, sql in statements if "FOR UPDATE" in sql]
+
+
+@pytest.mark.asyncio
+async def test_fix_skips_a_room_bumped_after_it_was_counted(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'cas.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    try:
+        async with sessions() as session:
+            session.add(RoomORM(id=1, name="racy", message_count=5))  # drifted: no messages
+            await session.commit()
+            [(room_id, stored, recounted)] = await room_counters.drifted(session, 0, 10)
+            await session.commit()
+            assert stored.message_count == 5 and recounted.message_count == 0
+            # A chat batch commits between the count and the fix
+            session.add(MessageORM(room_id=1, content="late"))
+            await room_counters.add_messages(session, 1, 1)
+            await session.commit()
+            assert not await room_counters.fix(session, room_id, stored, recounted)
+            await session.commit()
+            assert (await room_counters.get(session, 1)).message_count == 6  # type: ignore[union-attr]
+        # The next run recounts it, late message included
+        assert await room_counters.reconcile(sessions) == 1
+        async with sessions() as session:
+            assert (await room_counters.get(session, 1)).message_count == 1  # type: ignore[union-attr]
+    finally:
+        await engine.dispose()
@@ -0,0 +1,49 @@
+import pytest
+
+from fast_room_api.api.routers.ws import get_manager
+
+
+class DummyWS:
+    async def send_text(self, data):
+        return None
+
+
+@pytest.mark.asyncio
+async def test_presence_endpoints_read_live_index(
+    app, client, auth_header, fake_redis, unique_username, unique_password
+):
+    username = unique_username()
+    headers = await auth_header(username, unique_password())
+    ids = []
+    for name in ("presence_a", "presence_b"):
+        resp = await client.post("/rooms/", json={"name": name}, headers=headers)
+        assert resp.status_code == 201
+        ids.append(resp.json()["id"])
+    manager = get_manager(app, fake_redis)
+    ws = DummyWS()
+    await manager.join("presence_a", ws, username)  # type: ignore[arg-type]
+
+    single = await client.get(f"/rooms/{ids[0]}/presence")
+    assert single.status_code == 200
+    assert single.json()["users"] == [username] and single.json()["count"] == 1
+
+    batch = await client.get("/rooms/presence", params={"ids": f"{ids[0]},{ids[1]},999999"})
+    assert batch.status_code == 200
+    by_room = {item["room"]: item["users"] for item in batch.json()}
+    assert by_room == {"presence_a": [username], "presence_b": []}
+
+    # Within the cache TTL the REST view may lag the index; the cache counts the hit
+    hits = manager.presence.cache.hits
+    await manager.leave("presence_a", ws)  # type: ignore[arg-type]
+    cached = await client.get(f"/rooms/{ids[0]}/presence")
+    assert cached.json()["users"] == [username]
+    assert manager.presence.cache.hits == hits + 1
+    manager.presence.cache.clear()
+    fresh = await client.get(f"/rooms/{ids[0]}/presence")
+    assert fresh.json()["users"] == []
+
+
+@pytest.mark.asyncio
+async def test_presence_batch_rejects_bad_ids(client):
+    assert (await client.get("/rooms/presence", params={"ids": "1,abc"})).status_code == 422
+    assert (await client.get("/rooms/presence", params={"ids": ""})).status_code == 422
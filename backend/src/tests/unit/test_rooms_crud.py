@@ -1,6 +1,11 @@
+import uuid
+
 import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
+from fast_room_api.api import room_counters
 from fast_room_api.api.main import app
+from fast_room_api.models.db import MessageORM
 
 ROOM_LIST = "/rooms/"
 
@@ -54,3 +59,38 @@ async def test_room_moderation_toggle(client, auth_header, unique_username, uniq
     # toggle moderator for self (will flip off) then back
     toggle = await client.post(f"/rooms/{room_id}/members/1/moderator", headers=headers)
     assert toggle.status_code in (200, 403, 404)
+
+
+@pytest.mark.asyncio
+async def test_message_keyset_pagination(
+    client, auth_header, unique_username, unique_password, db_session, test_engine
+):
+    headers = await auth_header(unique_username(), unique_password())
+    created = await client.post(ROOM_LIST, json={"name": f"room_{uuid.uuid4().hex[:8]}"}, headers=headers)
+    room_id = created.json()["id"]
+    db_session.add_all(MessageORM(room_id=room_id, content=f"m{n}") for n in range(7))
+    await db_session.commit()
+    # Inserted behind the API's back, so the counters only catch up on reconcile
+    assert (await client.get(f"/rooms/{room_id}/messages")).json()["total"] == 0
+    assert await room_counters.reconcile(async_sessionmaker(test_engine)) >= 1
+    listed = (await client.get(ROOM_LIST, headers=headers)).json()["items"]
+    summary = next(r for r in listed if r["id"] == room_id)
+    assert summary["member_count"] == 1 and summary["message_count"] == 7 and summary["last_message_at"]
+    # Single-room lookups are served from the room cache, which carries no counters
+    assert "message_count" not in (await client.get(f"/rooms/{room_id}", headers=headers)).json()
+    newest = (await client.get(f"/rooms/{room_id}/messages", params={"limit": 3})).json()
+    assert [m["content"] for m in newest["items"]] == ["m4", "m5", "m6"]
+    assert newest["total"] == 7 and newest["has_more"] and newest["next_offset"] == 3
+    seen = [m["content"] for m in newest["items"]]
+    cursor = newest["next_cursor"]
+    while cursor:
+        page = (await client.get(f"/rooms/{room_id}/messages", params={"limit": 3, "cursor": cursor})).json()
+        assert page["total"] == 7 and page["next_offset"] is None
+        seen = [m["content"] for m in page["items"]] + seen
+        cursor = page["next_cursor"]
+    assert seen == [f"m{n}" for n in range(7)]
+    first_id = newest["items"][0]["id"] - 4
+    forward = await client.get(f"/rooms/{room_id}/messages", params={"after_id": first_id})
+    assert [m["content"] for m in forward.json()["items"]] == [f"m{n}" for n in range(1, 7)]
+    assert forward.json()["total"] == 7 and forward.json()["next_cursor"] is None
+    assert (await client.get(f"/rooms/{room_id}/messages", params={"cursor": "nope"})).status_code == 422
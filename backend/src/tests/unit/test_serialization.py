@@ -0,0 +1,24 @@
+import json
+from datetime import UTC, datetime
+
+from fast_room_api import serialization
+from fast_room_api.models.ws import OutChatMessage, OutPresenceState
+
+
+def test_dumps_matches_pydantic_json_mode():
+    msg = OutChatMessage(room="r", user="u", message="héllo", message_id=7, ts=datetime(2024, 1, 2, 3, 4, 5, 6, UTC))
+    out = serialization.dumps(msg.model_dump())
+    assert isinstance(out, bytes)
+    assert json.loads(out) == msg.model_dump(mode="json")
+
+
+def test_dumps_handles_models_and_sets_natively():
+    state = OutPresenceState(room="r", users=["a", "b"])
+    decoded = serialization.loads(serialization.dumps({"state": state, "ids": {1}}))
+    assert decoded["state"]["users"] == ["a", "b"]
+    assert decoded["state"]["ts"].endswith("Z")
+    assert decoded["ids"] == [1]
+
+
+def test_loads_accepts_str_and_bytes():
+    assert serialization.loads('{"a":1}') == serialization.loads(b'{"a":1}') == {"a": 1}
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from fast_room_api import serialization
+from fast_room_api.api.routers.ws import ConnectionManager
+from fast_room_api.api.typing_state import TypingTracker
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TextWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, data):
+        self.sent.append(serialization.loads(data))
+
+
+def test_only_transitions_and_keepalives_are_forwarded():
+    clock = Clock()
+    tracker = TypingTracker(4.0, clock=clock)
+    published = []
+    for step in range(6):  # a keystroke every second
+        changed = tracker.observe("r", "ann", True)
+        if tracker.should_publish("r", "ann", True, changed):
+            published.append(step)
+        clock.now += 1
+    # Start, then one keepalive per ttl/2 so other nodes keep the indicator alive
+    assert published == [0, 2, 4]
+    assert tracker.stats.transitions == 1 and tracker.stats.suppressed == 5 and tracker.stats.keepalives == 2
+    assert tracker.observe("r", "ann", False) is True
+    assert tracker.users("r") == []
+
+
+def test_expiry_reports_origin():
+    clock = Clock()
+    tracker = TypingTracker(4.0, clock=clock)
+    tracker.should_publish("r", "ann", True, tracker.observe("r", "ann", True))  # typed on this node
+    tracker.observe("r", "bob", True)  # relayed from another node
+    clock.now += 3
+    assert tracker.expire() == []
+    clock.now += 1
+    assert sorted(tracker.expire()) == [("r", "ann", True), ("r", "bob", False)]
+    assert len(tracker) == 0
+
+
+@pytest.mark.asyncio
+async def test_manager_forwards_transitions_and_snapshots_large_rooms(fake_redis):
+    redis = type(fake_redis)()
+    cm = ConnectionManager(redis)
+    peers = [TextWS() for _ in range(3)]
+    for i, ws in enumerate(peers):
+        cm.connect(ws)  # type: ignore[arg-type]
+        await cm.join("keys", ws, f"u{i}")  # type: ignore[arg-type]
+    for _ in range(5):
+        await cm.set_typing("keys", "u0", True)
+    await asyncio.sleep(0)
+    assert [m["isTyping"] for m in peers[1].sent if m["type"] == "typing"] == [True]
+    assert len(redis._published) == 1
+    # Large room: transitions from any user collapse into one typing_state snapshot per tick
+    cm.typing_snapshot_min_sockets = 3
+    await cm.set_typing("keys", "u1", True)
+    await cm.set_typing("keys", "u2", True)
+    await cm._typing_tick()
+    await asyncio.sleep(0)
+    snapshots = [m for m in peers[2].sent if m["type"] == "typing_state"]
+    assert [s["users"] for s in snapshots] == [["u0", "u1", "u2"]]
+    assert cm.typing_task
+    cm.typing_task.cancel()
+    for ws in peers:
+        await cm.leave_all(ws)  # type: ignore[arg-type]
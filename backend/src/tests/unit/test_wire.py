@@ -0,0 +1,59 @@
+import asyncio
+from datetime import UTC, datetime
+
+import pytest
+
+from fast_room_api import serialization
+from fast_room_api.api import wire
+from fast_room_api.api.outbox import Frame, Outbox, OutboxStats, OverflowPolicy
+from fast_room_api.models.ws import OutChatMessage
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def test_negotiate_prefers_msgpack_and_defaults_to_json():
+    assert wire.negotiate(["fastroom.json", "fastroom.msgpack.v1"]) == wire.MSGPACK_SUBPROTOCOL
+    assert wire.negotiate(["fastroom.msgpack.v1"], msgpack_enabled=False) is None
+    assert wire.negotiate(["fastroom.json"]) == wire.JSON_SUBPROTOCOL
+    assert wire.negotiate([]) is None
+
+
+def test_envelope_round_trip_matches_json_shape():
+    event = OutChatMessage(room="r", user="u", message="hi", message_id=3, ts=datetime(2024, 1, 2, tzinfo=UTC))
+    packed = Frame(event.model_dump()).packed
+    envelope = msgpack.unpackb(packed)
+    assert envelope["version"] == 1 and envelope["type"] == "chat" and envelope["topic"] == "r"
+    assert "type" not in envelope["payload"] and "room" not in envelope["payload"]
+    # A client rebuilding the event from the envelope sees exactly what JSON clients get
+    rebuilt = {**envelope["payload"], "type": envelope["type"], "room": envelope["topic"]}
+    assert rebuilt == serialization.loads(serialization.dumps(event.model_dump()))
+
+
+def test_decode_envelope_inbound():
+    data = msgpack.packb({"version": 1, "type": "chat", "topic": "r", "payload": {"message": "yo"}})
+    assert wire.decode_envelope(data) == {"type": "chat", "room": "r", "message": "yo"}
+    with pytest.raises(ValueError):
+        wire.decode_envelope(b"\xc1")
+    with pytest.raises(ValueError):
+        wire.decode_envelope(msgpack.packb({"type": "chat"}))  # no version
+
+
+class BytesWS:
+    def __init__(self):
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+@pytest.mark.asyncio
+async def test_binary_outbox_sends_packed_frames():
+    ws = BytesWS()
+    box = Outbox(ws, 8, OverflowPolicy.DROP_OLDEST, OutboxStats(), binary=True)  # type: ignore[arg-type]
+    box.start()
+    frame = Frame({"type": "system", "room": "r", "message": "hello"})
+    box.put(frame)
+    for _ in range(3):
+        await asyncio.sleep(0)
+    assert ws.sent == [frame.packed]
+    await box.close()
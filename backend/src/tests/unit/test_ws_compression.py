@@ -0,0 +1,62 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from uvicorn.config import Config
+from uvicorn.server import ServerState
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+from fast_room_api.api import ws_compression
+from fast_room_api.api.ws_compression import ThresholdDeflateFactory, ThresholdPerMessageDeflate, WebSocketProtocol
+
+
+def test_factory_negotiates_threshold_extension():
+    factory = ThresholdDeflateFactory(min_size=64, server_max_window_bits=12)
+    response, ext = factory.process_request_params([], [])
+    assert isinstance(ext, ThresholdPerMessageDeflate) and ext.min_size == 64
+    assert ("server_max_window_bits", "12") in response
+
+
+def test_small_frames_skip_compression_large_frames_are_counted():
+    before = ws_compression.stats.as_dict()
+    ext = ThresholdPerMessageDeflate(False, False, 15, 15, min_size=64)
+    small = Frame(Opcode.TEXT, b'{"type":"typing"}')
+    assert ext.encode(small) is small  # RSV1 unset: sent as a plain message
+    history = Frame(Opcode.TEXT, b'{"type":"history","messages":[' + b'{"message":"hello there"},' * 50 + b"{}]}")
+    encoded = ext.encode(history)
+    assert encoded.rsv1 and len(encoded.data) < len(history.data)
+    # A peer with the matching decoder gets the original payload back
+    peer = PerMessageDeflate(False, False, 15, 15)
+    assert peer.decode(encoded).data == history.data
+    after = ws_compression.stats.as_dict()
+    assert after["skipped_messages"] - before["skipped_messages"] == 1
+    assert after["compressed_messages"] - before["compressed_messages"] == 1
+    assert after["raw_bytes"] - before["raw_bytes"] == len(history.data)
+
+
+@pytest.mark.asyncio
+async def test_replaced_connection_is_the_one_that_handshakes():
+    # WebSocketProtocol swaps uvicorn's private ``conn``; if uvicorn stops reading that attribute
+    # (see the uvicorn pin in pyproject.toml), the handshake goes through its own connection instead
+    async def app(scope, receive, send):
+        await receive()
+        await send({"type": "websocket.accept"})
+        await receive()
+
+    config = Config(app=app, ws_per_message_deflate=False)
+    config.load()
+    state = ServerState()
+    protocol = WebSocketProtocol(config, state, {})
+    protocol.connection_made(MagicMock())
+    protocol.data_received(
+        b"GET /ws HTTP/1.1\r\nHost: testserver\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n"
+        b"Sec-WebSocket-Extensions: permessage-deflate\r\n\r\n"
+    )
+    assert protocol.response.headers["Sec-WebSocket-Extensions"].startswith("permessage-deflate")
+    [ext] = protocol.conn.extensions
+    assert isinstance(ext, ThresholdPerMessageDeflate)
+    assert ext.min_size == ws_compression.settings.ws_compression_min_size
+    protocol.connection_lost(None)
+    await asyncio.gather(*state.tasks)
@@ -0,0 +1,257 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fast_room_api import serialization
+from fast_room_api.api import dependencies as deps
+from fast_room_api.api.admission import CLOSE_TOO_MANY_CONNECTIONS, CLOSE_TRY_AGAIN_LATER, admission
+from fast_room_api.api.routers import ws as ws_router
+from fast_room_api.models import db as models_db
+from fast_room_api.models.db import Base, MessageORM, RoomMemberORM, RoomORM, UserORM
+
+
+class _Socket:
+    """Drives the /ws endpoint over raw ASGI messages, in the test's own event loop."""
+
+    def __init__(self, app, token: str):
+        self.incoming: asyncio.Queue = asyncio.Queue()
+        self.frames: asyncio.Queue = asyncio.Queue()
+        self.accepted = False
+        self.close_code: int | None = None
+        scope = {
+            "type": "websocket",
+            "path": "/ws",
+            "raw_path": b"/ws",
+            "root_path": "",
+            "scheme": "ws",
+            "query_string": f"access_token={token}".encode(),
+            "headers": [],
+            "subprotocols": [],
+            "server": ("testserver", 80),
+            "client": ("testclient", 50000),
+        }
+        self.incoming.put_nowait({"type": "websocket.connect"})
+        self.task = asyncio.create_task(app(scope, self.incoming.get, self._send))
+
+    async def _send(self, message: dict) -> None:
+        if message["type"] == "websocket.accept":
+            self.accepted = True
+        elif message["type"] == "websocket.close":
+            self.close_code = message.get("code", 1000)
+        elif message["type"] == "websocket.send":
+            await self.frames.put(serialization.loads(message.get("text") or message["bytes"]))
+
+    def send(self, obj: dict) -> None:
+        self.incoming.put_nowait({"type": "websocket.receive", "text": serialization.dumps(obj).decode()})
+
+    async def expect(self, etype: str) -> dict:
+        while True:
+            frame = await asyncio.wait_for(self.frames.get(), 5)
+            if frame.get("type") == etype:
+                return frame
+
+    async def close(self) -> None:
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+async def _rejected(ws: _Socket) -> dict:
+    """The error frame of a socket turned away by admission control (the handler has returned)."""
+    frame = await ws.expect("error")
+    await asyncio.wait_for(ws.task, 5)
+    return frame
+
+
+@pytest.mark.asyncio
+async def test_idle_sockets_hold_no_pooled_connections(app, tmp_path):
+    # One pooled connection and no overflow: a session pinned per socket would stall the second socket
+    url = f"sqlite+aiosqlite:///{tmp_path / 'ws.db'}"
+    engine = create_async_engine(url, pool_size=1, max_overflow=0, pool_timeout=2)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    username, room = f"ws_{uuid.uuid4().hex[:8]}", f"room_{uuid.uuid4().hex[:8]}"
+    async with sessions() as session:
+        session.add_all([UserORM(username=username, hashed_password="-"), RoomORM(name=room)])
+        await session.commit()
+    app.dependency_overrides[models_db.get_session_factory] = lambda: sessions
+    token = deps.create_access_token(username=username, ttl_seconds=3600)
+    sockets: list[_Socket] = []
+    try:
+        for n in range(1, 21):
+            ws = _Socket(app, token)
+            sockets.append(ws)
+            await ws.expect("system")
+            ws.send({"type": "join", "room": room})
+            await ws.expect("joined")
+            ws.send({"type": "ping"})
+            await ws.expect("pong")  # the join, history query included, is done
+            if n in (1, 20):
+                assert engine.pool.checkedout() == 0  # type: ignore[attr-defined]
+    finally:
+        for ws in sockets:
+            await ws.close()
+        app.dependency_overrides.pop(models_db.get_session_factory, None)
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_chat_is_written_through_the_session_factory(app, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'chat.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    user = UserORM(username=f"chat_{uuid.uuid4().hex[:8]}", hashed_password="-")
+    async with sessions() as session:
+        session.add_all([user, RoomORM(name="factory_room")])
+        await session.commit()
+    app.dependency_overrides[models_db.get_session_factory] = lambda: sessions
+    # A fresh manager, so its chat writer is built from the overridden factory
+    previous, app.state.ws_manager = getattr(app.state, "ws_manager", None), None
+    ws = _Socket(app, deps.create_access_token(username=user.username, ttl_seconds=3600))
+    try:
+        await ws.expect("system")
+        ws.send({"type": "join", "room": "factory_room"})
+        await ws.expect("joined")
+        ws.send({"type": "chat", "room": "factory_room", "message": "stored"})
+        saved = await ws.expect("chat")  # fanned out only once committed
+        async with sessions() as session:
+            message = await session.get(MessageORM, saved["message_id"])
+        assert message is not None and message.content == "stored"
+    finally:
+        await ws.close()
+        await app.state.ws_manager.chat_writer.close()
+        app.state.ws_manager = previous
+        app.dependency_overrides.pop(models_db.get_session_factory, None)
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_ban_landing_before_the_room_subscription_is_not_lost(app, tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'ban.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    user, room = UserORM(username=f"ban_{uuid.uuid4().hex[:8]}", hashed_password="-"), RoomORM(name="ban_room")
+    async with sessions() as session:
+        session.add_all([user, room])
+        await session.commit()
+    ensure = ws_router.ensure_room_and_membership
+
+    async def ban_right_after_the_check(db, rooms, name, member_user):
+        room_obj = await ensure(db, rooms, name, member_user)
+        # A moderator on another node bans now; its member_update goes out before this node subscribes
+        async with sessions() as other:
+            await other.execute(
+                update(RoomMemberORM)
+                .where(RoomMemberORM.room_id == room_obj.id, RoomMemberORM.user_id == member_user.id)
+                .values(is_banned=True)
+            )
+            await other.commit()
+        return room_obj
+
+    monkeypatch.setattr(ws_router, "ensure_room_and_membership", ban_right_after_the_check)
+    app.dependency_overrides[models_db.get_session_factory] = lambda: sessions
+    previous, app.state.ws_manager = getattr(app.state, "ws_manager", None), None
+    ws = _Socket(app, deps.create_access_token(username=user.username, ttl_seconds=3600))
+    try:
+        await ws.expect("system")
+        ws.send({"type": "join", "room": "ban_room"})
+        await ws.expect("joined")
+        ws.send({"type": "chat", "room": "ban_room", "message": "let me in"})
+        assert (await ws.expect("error"))["message"] == "banned"
+    finally:
+        await ws.close()
+        await app.state.ws_manager.chat_writer.close()
+        app.state.ws_manager = previous
+        app.dependency_overrides.pop(models_db.get_session_factory, None)
+        await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_admission_caps_sockets_users_and_rooms(app, tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'ws.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    user = UserORM(username=f"adm_{uuid.uuid4().hex[:8]}", hashed_password="-")
+    async with sessions() as session:
+        session.add_all([user, RoomORM(name="adm_a"), RoomORM(name="adm_b")])
+        await session.commit()
+    app.dependency_overrides[models_db.get_session_factory] = lambda: sessions
+    token = deps.create_access_token(username=user.username, ttl_seconds=3600)
+    monkeypatch.setattr(admission, "max_per_user", 2)
+    monkeypatch.setattr(admission, "max_rooms", 1)
+    monkeypatch.setattr(admission, "retry_after_s", 3)
+    sockets = [_Socket(app, token), _Socket(app, token)]
+    try:
+        for ws in sockets:
+            await ws.expect("system")
+        # Third socket of the same user: rejected with a retry hint (jittered between 1x and 2x)
+        third = _Socket(app, token)
+        frame = await _rejected(third)
+        assert frame["message"] == "too many connections" and 3 <= frame["retryAfter"] <= 6
+        assert third.close_code == CLOSE_TOO_MANY_CONNECTIONS
+        # Worker full: turned away before the token is even looked at
+        monkeypatch.setattr(admission, "max_sockets", admission.sockets)
+        full = _Socket(app, "not-a-token")
+        assert (await _rejected(full))["message"] == "server busy"
+        assert full.close_code == CLOSE_TRY_AGAIN_LATER
+        monkeypatch.setattr(admission, "max_sockets", 0)
+        # Room cap: the second room is refused, the socket stays usable
+        ws = sockets[0]
+        ws.send({"type": "join", "room": "adm_a"})
+        await ws.expect("joined")
+        ws.send({"type": "join", "room": "adm_b"})
+        assert await ws.expect("error") == {"type": "error", "message": "too many rooms", "limit": 1}
+        # Closing a socket frees the user's slot
+        await sockets.pop().close()
+        sockets.append(_Socket(app, token))
+        await sockets[-1].expect("system")
+        assert admission.per_user[user.username] == 2
+    finally:
+        for ws in sockets:
+            await ws.close()
+        app.dependency_overrides.pop(models_db.get_session_factory, None)
+        await engine.dispose()
+    assert user.username not in admission.per_user
+
+
+@pytest.mark.asyncio
+async def test_bad_token_is_refused_before_accept(app):
+    before = admission.sockets
+    ws = _Socket(app, "not-a-token")
+    await asyncio.wait_for(ws.task, 5)
+    assert not ws.accepted and ws.close_code == 4400
+    assert admission.sockets == before
+
+
+@pytest.mark.asyncio
+async def test_setup_failure_after_accept_gives_the_slots_back(app, tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'ws.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    user = UserORM(username=f"setup_{uuid.uuid4().hex[:8]}", hashed_password="-")
+    async with sessions() as session:
+        session.add(user)
+        await session.commit()
+    app.dependency_overrides[models_db.get_session_factory] = lambda: sessions
+
+    def broken_manager(*_args):
+        raise RuntimeError("no manager")
+
+    monkeypatch.setattr(ws_router, "get_manager", broken_manager)
+    before = admission.sockets
+    try:
+        ws = _Socket(app, deps.create_access_token(username=user.username, ttl_seconds=3600))
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(ws.task, 5)
+        assert ws.accepted
+    finally:
+        app.dependency_overrides.pop(models_db.get_session_factory, None)
+        await engine.dispose()
+    assert admission.sockets == before and user.username not in admission.per_user
@@ -234,6 +234,40 @@ export type RoomMembersPage = {
     next_offset?: number | null;
 };
 
+/**
+ * RoomSummary
+ */
+export type RoomSummary = {
+    /**
+     * Id
+     */
+    id: number;
+    /**
+     * Name
+     */
+    name: string;
+    /**
+     * Is Private
+     */
+    is_private: boolean;
+    /**
+     * Created At
+     */
+    created_at: string;
+    /**
+     * Member Count
+     */
+    member_count: number;
+    /**
+     * Message Count
+     */
+    message_count: number;
+    /**
+     * Last Message At
+     */
+    last_message_at: string | null;
+};
+
 /**
  * RoomUpdate
  */
@@ -255,11 +289,11 @@ export type RoomsPage = {
     /**
      * Items
      */
-    items: Array<Room>;
+    items: Array<RoomSummary>;
     /**
      * Total
      */
-    total: number;
+    total: number | null;
     /**
      * Limit
      */
@@ -568,6 +602,11 @@ export type ListRoomsRoomsGetData = {
          * Order
          */
         order?: string;
+        /**
+         * Include Total
+         * Count the visible rooms (an extra query)
+         */
+        include_total?: boolean;
     };
     url: '/rooms/';
 };